@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+End-to-end server benchmark: starts server.py with the fake Blender
+(bench/fake_blender.py) and drives it with concurrent clients built on
+client.send_render_job, for each combination of upload size and concurrency.
+Reports jobs/s, upload MB/s, queue wait percentiles and per-job server overhead
+(time a job spends on the server outside upload, queue wait and Blender),
+taken from the jobs' server traces.
+
+    python3 bench/end_to_end.py --sizes-mb 1,16,64 --concurrency 1,4,16 --json results.json
+    python3 bench/end_to_end.py --compare results.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "remote_render_addon"))
+import client
+
+FAKE_BLENDER = os.path.join(ROOT, "bench", "fake_blender.py")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, args):
+    env = dict(
+        os.environ,
+        FAKE_BLENDER_FRAMES=args.frames,
+        FAKE_BLENDER_FRAME_TIME=str(args.frame_time),
+        FAKE_BLENDER_STARTUP=str(args.startup),
+    )
+    cmd = [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port),
+           "--render-root", os.path.join(workdir, "render_root"), "--blender", FAKE_BLENDER,
+           "--workers", str(args.workers)]
+    if args.cold_start:
+        cmd.append("--cold-start")
+    log_path = os.path.join(workdir, "server.log")
+    proc = subprocess.Popen(cmd, stdout=open(log_path, "w"), stderr=subprocess.STDOUT, env=env, cwd=ROOT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        with open(log_path) as f:
+            if "@READY" in f.read():
+                return proc
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"server did not start, see {log_path}")
+
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def make_blend(path, size, block):
+    """Unique content per job, so neither the blob store nor the result cache short-circuits it."""
+    with open(path, "wb") as f:
+        f.write(os.urandom(64))
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
+
+
+def run_client(index, config, workdir, size, block, args, results):
+    config = dict(config, client_id=f"bench-{index}")
+    for n in range(args.jobs_per_client):
+        path = os.path.join(workdir, f"bench_{index}_{n}_{random.getrandbits(32):08x}.blend")
+        make_blend(path, size, block)
+        started = time.perf_counter()
+        job_id = client.send_render_job(path, render_type=args.render_type, output_format="PNG",
+                                        config=config, log=lambda msg: None, use_cache=False)
+        results.append({"job_id": job_id, "latency": time.perf_counter() - started, "size": size + 64})
+        os.remove(path)
+
+
+def covered(intervals):
+    """Seconds covered by the union of (start, end) microsecond intervals."""
+    total, reach = 0, None
+    for start, end in sorted(intervals):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return total / 1e6
+
+
+def span_durations(trace):
+    """Seconds per server span name, plus "waiting": the wall time the job spent
+    uploading, queued or inside Blender, with parallel chunks counted once."""
+    spans = {}
+    waiting = []
+    threads = {e["tid"]: e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "thread_name"}
+    for event in trace["traceEvents"]:
+        if event["ph"] != "X":
+            continue
+        interval = (event["ts"], event["ts"] + event["dur"])
+        if event["tid"] == 0:
+            spans[event["name"]] = spans.get(event["name"], 0.0) + event["dur"] / 1e6
+            if event["name"] in ("upload", "queue wait", "chunk queue wait", "region queue wait"):
+                waiting.append(interval)
+        elif event["name"] == threads.get(event["tid"]):
+            waiting.append(interval)
+    spans["waiting"] = covered(waiting)
+    return spans
+
+
+def run_case(size_mb, concurrency, args):
+    with tempfile.TemporaryDirectory(prefix="render-bench-") as workdir:
+        port = free_port()
+        config = {
+            "server_host": "127.0.0.1", "server_port": port,
+            "local_addons_dir": os.path.join(workdir, "no-addons"),
+            "render_output_dir": os.path.join(workdir, "out"), "socket_buffer_size": 0,
+            "client_id": "bench",
+        }
+        # Keep the client's hash cache out of the user's home directory.
+        client.HASH_CACHE_PATH = os.path.join(workdir, "hashes.json")
+        proc = start_server(workdir, port, args)
+        try:
+            block = os.urandom(1 << 20)
+            results = []
+            threads = [
+                threading.Thread(target=run_client, args=(i, config, workdir, int(size_mb * 1e6), block, args, results))
+                for i in range(concurrency)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - started
+
+            traces = [(r, client.fetch_trace(r["job_id"], config, log=lambda msg: None)) for r in results if r["job_id"]]
+        finally:
+            stop_server(proc)
+
+    spans = [(r, span_durations(t)) for r, t in traces if t]
+    uploads = [r["size"] / 1e6 / s["upload"] for r, s in spans if s.get("upload")]
+    waits = [s.get("queue wait", 0.0) for _, s in spans]
+    overheads = [
+        s["job"] - s["waiting"]
+        for _, s in spans if "job" in s
+    ]
+    latencies = [r["latency"] for r in results if r["job_id"]]
+    return {
+        "size_mb": size_mb,
+        "concurrency": concurrency,
+        "jobs": len(results),
+        "failed": sum(1 for r in results if not r["job_id"]),
+        "wall_s": wall,
+        "jobs_per_s": len(latencies) / wall,
+        "upload_mb_s_median": statistics.median(uploads) if uploads else None,
+        "queue_wait_p50_s": percentile(waits, 50),
+        "queue_wait_p90_s": percentile(waits, 90),
+        "queue_wait_p99_s": percentile(waits, 99),
+        "overhead_p50_ms": percentile(overheads, 50) * 1e3 if overheads else None,
+        "overhead_p90_ms": percentile(overheads, 90) * 1e3 if overheads else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p90_s": percentile(latencies, 90),
+    }
+
+
+def fmt(value, spec):
+    return format(value, spec) if value is not None else "-".rjust(len(format(0, spec)))
+
+
+def print_row(run, baseline=None):
+    line = (f"{run['size_mb']:>7.1f} {run['concurrency']:>5} {run['jobs']:>5} {run['failed']:>4} "
+            f"{run['jobs_per_s']:>8.2f} {fmt(run['upload_mb_s_median'], '>9.1f')} "
+            f"{fmt(run['queue_wait_p50_s'], '>8.3f')} {fmt(run['queue_wait_p90_s'], '>8.3f')} "
+            f"{fmt(run['queue_wait_p99_s'], '>8.3f')} {fmt(run['overhead_p50_ms'], '>9.1f')} "
+            f"{fmt(run['overhead_p90_ms'], '>9.1f')}")
+    if baseline:
+        line += f"   jobs/s {run['jobs_per_s'] / baseline['jobs_per_s']:.2f}x"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes-mb", default="1,16", help="Comma-separated .blend sizes")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--jobs-per-client", type=int, default=2)
+    parser.add_argument("--render-type", choices=("image", "animation"), default="animation")
+    parser.add_argument("--frames", default="1-4", help="Fake scene frame range")
+    parser.add_argument("--frame-time", type=float, default=0.02, help="Fake seconds per frame")
+    parser.add_argument("--startup", type=float, default=0.2, help="Fake Blender startup seconds")
+    parser.add_argument("--workers", type=int, default=2, help="Server render slots")
+    parser.add_argument("--cold-start", action="store_true", help="Run the server without warm workers")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier --json results to compare jobs/s against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["size_mb"], r["concurrency"]): r for r in json.load(f)["runs"]}
+
+    print(f"{'size MB':>7} {'conc':>5} {'jobs':>5} {'fail':>4} {'jobs/s':>8} {'up MB/s':>9} "
+          f"{'wait p50':>8} {'wait p90':>8} {'wait p99':>8} {'ovh p50ms':>9} {'ovh p90ms':>9}")
+    runs = []
+    for size_mb in (float(v) for v in args.sizes_mb.split(",")):
+        for concurrency in (int(v) for v in args.concurrency.split(",")):
+            run = run_case(size_mb, concurrency, args)
+            runs.append(run)
+            print_row(run, baseline.get((size_mb, concurrency)))
+
+    if args.json:
+        settings = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+        with open(args.json, "w") as f:
+            json.dump({"settings": settings, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Blender CLI used to exercise the render server without a real
+Blender install. It understands the subset of arguments the server passes
+(-b, -o, -F, -s, -e, -a, -f, -t, --python, --python-expr, --version), prints
+Cycles-like `Fra:` / `Saved:` output, sleeps to simulate render time and writes
+small frame files: a vertical gradient, so border renders can be stitched and
+compared. `bpy.data.images` can load and save those files for stitching.
+
+Behaviour is tuned through environment variables:
+  FAKE_BLENDER_FRAMES      scene frame range, e.g. "1-48" (default "1-24")
+  FAKE_BLENDER_FRAME_TIME  seconds per frame (default 0.05)
+  FAKE_BLENDER_STARTUP     startup delay in seconds (default 0.2)
+  FAKE_BLENDER_SAMPLES     samples per frame (default 16)
+  FAKE_BLENDER_RESOLUTION  scene resolution, e.g. "64x36" (default "64x36")
+  FAKE_BLENDER_FAIL_FRAMES comma-separated frames that crash the render, e.g. "5,9"
+"""
+import os
+import sys
+import time
+import types
+import struct
+import zlib
+
+VERSION = "4.0.2"
+EXTENSIONS = {
+    "PNG": ".png", "JPEG": ".jpg", "OPEN_EXR": ".exr", "OPEN_EXR_MULTILAYER": ".exr",
+    "TIFF": ".tif", "BMP": ".bmp", "TGA": ".tga", "RAWTGA": ".tga", "FFMPEG": ".mp4",
+}
+
+started = time.time()
+mem_peak = 0.0
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def scene_frames():
+    start, _, end = os.environ.get("FAKE_BLENDER_FRAMES", "1-24").partition("-")
+    return int(start), int(end or start)
+
+
+def scene_resolution():
+    x, _, y = os.environ.get("FAKE_BLENDER_RESOLUTION", "64x36").partition("x")
+    return int(x), int(y or x)
+
+
+def clock(seconds):
+    return f"{int(seconds // 60):02d}:{seconds % 60:05.2f}"
+
+
+def png_bytes(width, height, rows):
+    """8-bit RGBA PNG from `rows` of pixel bytes, top row first."""
+    raw = b"".join(b"\x00" + row for row in rows)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def frame_path(pattern, frame, file_format):
+    if "#" in pattern:
+        head = pattern[:pattern.index("#")]
+        width = len(pattern) - len(head) - len(pattern[pattern.index("#"):].lstrip("#"))
+        tail = pattern[len(head) + width:]
+        path = f"{head}{frame:0{width}d}{tail}"
+    else:
+        path = f"{pattern}{frame:04d}"
+    return path + EXTENSIONS.get(file_format, ".png")
+
+
+def crop_rect(render=None):
+    """(x, y, width, height) of the rendered image, from the bottom left: the whole
+    frame, or its border with crop-to-border on (truncated to pixels, as Blender does)."""
+    width, height = scene_resolution()
+    if render is None or not (render.use_border and render.use_crop_to_border):
+        return 0, 0, width, height
+    x0, x1 = int(render.border_min_x * width), int(render.border_max_x * width)
+    y0, y1 = int(render.border_min_y * height), int(render.border_max_y * height)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def write_frame(path, file_format, frame, rect=None):
+    x, y, width, height = rect or crop_rect()
+    # Row value counts from the bottom of the whole frame, so regions line up.
+    shades = [(frame * 37 + y + row) % 256 for row in range(height)]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        if file_format == "JPEG":
+            f.write(b"\xff\xd8\xff\xe0" + bytes(64) + b"\xff\xd9")
+        elif file_format.startswith("OPEN_EXR"):
+            f.write(b"v/1\x01" + struct.pack("<II", width, height))
+            for shade in shades:
+                f.write(struct.pack("<4f", shade / 255, shade / 255, shade / 255, 1.0) * width)
+        else:
+            f.write(png_bytes(width, height, [bytes([shade, shade, shade, 255]) * width for shade in reversed(shades)]))
+
+
+def render_frame(frame, pattern, file_format, write=True, rect=None):
+    global mem_peak
+    samples = int(env_float("FAKE_BLENDER_SAMPLES", 16))
+    frame_time = env_float("FAKE_BLENDER_FRAME_TIME", 0.05)
+    frame_started = time.time()
+    mem_peak = max(mem_peak, 40.0 + frame % 7)
+    if str(frame) in os.environ.get("FAKE_BLENDER_FAIL_FRAMES", "").split(","):
+        raise RuntimeError(f"Simulated crash rendering frame {frame}")
+    print(f"Fra:{frame} Mem:12.34M (Peak {mem_peak:.2f}M) | Time:{clock(0)} | Mem:0.00M, Peak:0.00M "
+          f"| Scene, ViewLayer | Synchronizing object | Cube", flush=True)
+    for sample in range(1, samples + 1):
+        time.sleep(frame_time / samples)
+        elapsed = time.time() - frame_started
+        remaining = frame_time - elapsed
+        print(f"Fra:{frame} Mem:{mem_peak - 2:.2f}M (Peak {mem_peak:.2f}M) | Time:{clock(elapsed)} "
+              f"| Remaining:{clock(max(remaining, 0))} | Mem:20.00M, Peak:22.00M | Scene, ViewLayer "
+              f"| Sample {sample}/{samples}", flush=True)
+    if write and file_format != "FFMPEG":
+        path = frame_path(pattern, frame, file_format)
+        write_frame(path, file_format, frame, rect)
+        print(f"Saved: '{path}'", flush=True)
+    print(f" Time: {clock(time.time() - frame_started)} (Saving: 00:00.00)\n", flush=True)
+
+
+def make_bpy(state):
+    """Minimal `bpy` stand-in so probe expressions and driver scripts can run."""
+    bpy = types.ModuleType("bpy")
+    start, end = scene_frames()
+    res_x, res_y = scene_resolution()
+    image_settings = types.SimpleNamespace(file_format="PNG", color_depth="8", exr_codec="ZIP")
+    render = types.SimpleNamespace(
+        filepath="//", image_settings=image_settings, resolution_x=res_x, resolution_y=res_y,
+        resolution_percentage=100, use_border=False, use_crop_to_border=False,
+        border_min_x=0.0, border_max_x=1.0, border_min_y=0.0, border_max_y=1.0,
+        threads_mode="AUTO", threads=1,
+    )
+    scene = types.SimpleNamespace(frame_start=start, frame_end=end, frame_step=1, render=render)
+
+    def frame_set(frame):
+        scene.frame_current = frame
+
+    scene.frame_set = frame_set
+    scene.frame_current = start
+    bpy.context = types.SimpleNamespace(scene=scene)
+    bpy.app = types.SimpleNamespace(version=tuple(int(p) for p in VERSION.split(".")),
+                                    version_string=VERSION, handlers=types.SimpleNamespace())
+
+    def open_mainfile(filepath="", **_):
+        print(f'Read blend: "{filepath}"', flush=True)
+        state["blend"] = filepath
+        # Loading a file replaces the scene, as it does in Blender.
+        scene.frame_start, scene.frame_end = scene_frames()
+        scene.frame_step = 1
+        scene.frame_current = scene.frame_start
+        render.filepath = "//"
+        render.use_border = render.use_crop_to_border = False
+        image_settings.file_format = "PNG"
+        return {"FINISHED"}
+
+    def render_op(animation=False, write_still=False, **_):
+        pattern = bpy.path.abspath(render.filepath)
+        file_format = image_settings.file_format
+        frames = range(scene.frame_start, scene.frame_end + 1, scene.frame_step) if animation else [scene.frame_current]
+        for frame in frames:
+            render_frame(frame, pattern, file_format, write=animation or write_still, rect=crop_rect(render))
+        if animation and file_format == "FFMPEG":
+            path = frame_path(pattern, scene.frame_start, file_format).replace(
+                f"{scene.frame_start:05d}", f"{scene.frame_start:05d}-{scene.frame_end:05d}", 1)
+            write_frame(path, file_format, scene.frame_start)
+            print(f"Saved: '{path}'", flush=True)
+        return {"FINISHED"}
+
+    def read_factory_settings(**_):
+        return {"FINISHED"}
+
+    bpy.ops = types.SimpleNamespace(
+        wm=types.SimpleNamespace(open_mainfile=open_mainfile, read_factory_settings=read_factory_settings,
+                                 read_homefile=read_factory_settings),
+        render=types.SimpleNamespace(render=render_op),
+    )
+    bpy.path = types.SimpleNamespace(abspath=lambda p: p)
+    bpy.data = types.SimpleNamespace(scenes=[scene], images=make_images())
+    return bpy
+
+
+def make_images():
+    """Minimal `bpy.data.images`: loads and saves the PNG and EXR files write_frame produces."""
+    import numpy
+
+    class Image:
+        def __init__(self, width, height, is_float):
+            self.size = (width, height)
+            self.channels = 4
+            self.is_float = is_float
+            self.colorspace_settings = types.SimpleNamespace(name="Linear Rec.709" if is_float else "sRGB")
+            self.filepath_raw = ""
+            self.file_format = "PNG"
+            # Flat RGBA floats, bottom row first, like Image.pixels.
+            self.data = numpy.zeros(width * height * 4, dtype=numpy.float32)
+            self.pixels = types.SimpleNamespace(foreach_get=self.get, foreach_set=self.set)
+
+        def get(self, out):
+            out[:] = self.data
+
+        def set(self, values):
+            self.data[:] = values
+
+        def save(self):
+            width, height = self.size
+            rgba = self.data.reshape(height, width, 4)
+            with open(self.filepath_raw, "wb") as f:
+                if self.file_format.startswith("OPEN_EXR"):
+                    f.write(b"v/1\x01" + struct.pack("<II", width, height) + rgba.astype("<f4").tobytes())
+                else:
+                    rows = numpy.round(rgba[::-1] * 255).astype(numpy.uint8)
+                    f.write(png_bytes(width, height, [row.tobytes() for row in rows]))
+
+    def load(filepath, **_):
+        with open(filepath, "rb") as f:
+            data = f.read()
+        if data.startswith(b"v/1\x01"):
+            width, height = struct.unpack_from("<II", data, 4)
+            image = Image(width, height, True)
+            image.data[:] = numpy.frombuffer(data, dtype="<f4", offset=12)
+            return image
+        # Only the unfiltered 8-bit RGBA PNGs png_bytes writes.
+        width, height = struct.unpack_from(">II", data, 16)
+        idat, pos = b"", 8
+        while pos < len(data):
+            length, kind = struct.unpack_from(">I4s", data, pos)
+            if kind == b"IDAT":
+                idat += data[pos + 8:pos + 8 + length]
+            pos += length + 12
+        rows = numpy.frombuffer(zlib.decompress(idat), dtype=numpy.uint8).reshape(height, 1 + width * 4)[:, 1:]
+        image = Image(width, height, False)
+        image.data[:] = (rows[::-1].astype(numpy.float32) / 255).ravel()
+        return image
+
+    def new(name, width, height, alpha=True, float_buffer=False, **_):
+        return Image(width, height, float_buffer)
+
+    return types.SimpleNamespace(load=load, new=new, remove=lambda image: None)
+
+
+def make_addon_utils():
+    """Minimal `addon_utils` stand-in: enabling an add-on only checks that it is on the scripts path."""
+    addon_utils = types.ModuleType("addon_utils")
+    enabled = set()
+
+    def check(name):
+        return False, name in enabled
+
+    def enable(name, **_):
+        addons_dir = os.path.join(os.environ.get("BLENDER_USER_SCRIPTS", ""), "addons")
+        found = os.path.isfile(os.path.join(addons_dir, name, "__init__.py")) or \
+            os.path.isfile(os.path.join(addons_dir, name + ".py"))
+        print(f"{'Enabled' if found else 'Could not find'} add-on: {name}", flush=True)
+        if found:
+            enabled.add(name)
+
+    addon_utils.check = check
+    addon_utils.enable = enable
+    return addon_utils
+
+
+def main(argv):
+    if "--version" in argv or "-v" in argv:
+        print(f"Blender {VERSION}")
+        print("\tbuild date: 2023-12-05")
+        return 0
+
+    time.sleep(env_float("FAKE_BLENDER_STARTUP", 0.2))
+    print(f"Blender {VERSION} (hash 9be62e85b727 built 2023-12-05 07:43:12)", flush=True)
+
+    state = {"blend": None}
+    pattern = "/tmp/"
+    file_format = "PNG"
+    start, end = scene_frames()
+    python_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+    bpy = None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        value = argv[i + 1] if i + 1 < len(argv) else None
+        if arg == "-b":
+            if value and not value.startswith("-"):
+                state["blend"] = value
+                print(f'Read blend: "{value}"', flush=True)
+                i += 1
+        elif arg == "-o":
+            pattern = value
+            i += 1
+        elif arg == "-F":
+            file_format = value.upper()
+            i += 1
+        elif arg == "-s":
+            start = int(value)
+            i += 1
+        elif arg == "-e":
+            end = int(value)
+            i += 1
+        elif arg in ("-t", "-j", "--addons"):
+            i += 1
+        elif arg == "-f":
+            render_frame(int(value), pattern, file_format, rect=crop_rect(bpy.context.scene.render if bpy else None))
+            i += 1
+        elif arg == "-a":
+            for frame in range(start, end + 1):
+                render_frame(frame, pattern, file_format)
+            if file_format == "FFMPEG":
+                path = frame_path(pattern, start, file_format).replace(
+                    f"{start:05d}", f"{start:05d}-{end:05d}", 1)
+                write_frame(path, file_format, start)
+                print(f"Saved: '{path}'", flush=True)
+        elif arg in ("--python-expr", "--python"):
+            bpy = bpy or make_bpy(state)
+            if state["blend"]:
+                bpy.data.filepath = state["blend"]
+            sys.modules["bpy"] = bpy
+            sys.modules["addon_utils"] = make_addon_utils()
+            if arg == "--python":
+                with open(value) as f:
+                    code = compile(f.read(), value, "exec")
+                sys.argv = [sys.argv[0]] + argv + ["--"] + python_args
+                exec(code, {"__name__": "__main__", "__file__": value})
+            else:
+                exec(value, {"__name__": "__main__"})
+            i += 1
+        i += 1
+
+    print("\nBlender quit", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Localhost upload throughput: the old 4 KB read/sendall + recv/write loop against
+socket.sendfile on the client and recv_into a preallocated buffer on the server
+(server.receive_file).
+
+    python3 bench/transfer.py --size-mb 1024 --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+MODES = {
+    # name: (client uses sendfile, server uses recv_into)
+    "legacy": (False, False),
+    "sendfile": (True, False),
+    "zero-copy": (True, True),
+}
+
+
+async def legacy_receive(reader, writer, path, file_size):
+    """The receive loop the server used before: 4 KB reads, one write per chunk."""
+    with open(path, "wb") as f:
+        received = 0
+        while received < file_size:
+            chunk = await reader.read(min(4096, file_size - received))
+            if not chunk:
+                break
+            f.write(chunk)
+            received += len(chunk)
+    return received
+
+
+def send(port, path, use_sendfile, socket_buffer):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        if socket_buffer:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_buffer)
+        s.sendall(f"{os.path.getsize(path)}\n".encode())
+        with open(path, "rb") as f:
+            if use_sendfile:
+                s.sendfile(f)
+            else:
+                while True:
+                    chunk = f.read(4096)
+                    if not chunk:
+                        break
+                    s.sendall(chunk)
+        s.recv(16)
+
+
+async def run_mode(source, output, mode, repeat, socket_buffer):
+    use_sendfile, use_recv_into = MODES[mode]
+    receive = server.receive_file if use_recv_into else legacy_receive
+
+    async def handle(reader, writer):
+        size = int(await reader.readline())
+        await receive(reader, writer, output, size)
+        writer.write(b"OK\n")
+        await writer.drain()
+        writer.close()
+
+    listener = await asyncio.start_server(handle, "127.0.0.1", 0, limit=server.STREAM_LIMIT)
+    port = listener.sockets[0].getsockname()[1]
+    rates = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await asyncio.to_thread(send, port, source, use_sendfile, socket_buffer)
+        rates.append(os.path.getsize(source) / 1e6 / (time.perf_counter() - started))
+    listener.close()
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--socket-buffer", type=int, default=0, help="SO_SNDBUF/SO_RCVBUF in bytes (0 = OS default)")
+    parser.add_argument("--output", default=os.devnull, help="Where the server writes the upload")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    server.SOCKET_BUFFER_SIZE = args.socket_buffer
+    results = {}
+    with tempfile.NamedTemporaryFile(suffix=".blend") as source:
+        block = os.urandom(1 << 20)
+        for _ in range(args.size_mb):
+            source.write(block)
+        source.flush()
+
+        for mode in MODES:
+            rates = asyncio.run(run_mode(source.name, args.output, mode, args.repeat, args.socket_buffer))
+            results[mode] = {"median_mb_s": statistics.median(rates), "best_mb_s": max(rates), "runs": rates}
+            print(f"{mode:<10} median {results[mode]['median_mb_s']:8.1f} MB/s   best {results[mode]['best_mb_s']:8.1f} MB/s")
+
+    baseline = results["legacy"]["median_mb_s"]
+    print(f"zero-copy speedup over legacy: {results['zero-copy']['median_mb_s'] / baseline:.2f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"size_mb": args.size_mb, "socket_buffer": args.socket_buffer, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
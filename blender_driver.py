@@ -0,0 +1,159 @@
+"""
+Long-lived Blender worker for the render server's warm pool. Started as
+`blender -b --python blender_driver.py`, it reads one JSON render request per
+line on stdin and answers each with an `@DRIVER {json}` line on stdout, after
+Blender's own output for that job. Exits when stdin is closed.
+
+Request: {"blend": path, "output": path, "format": "PNG", "start": 1, "end": 24, "animation": true, "threads": 4,
+          "addons": ["my_addon"], "border": [min_x, max_x, min_y, max_y]}
+Stitch request: {"stitch": {"tiles": [{"path": path, "x": 0, "y": 0}], "width": 1920, "height": 1080,
+                            "output": path, "format": "PNG"}}
+
+`blender -b --python blender_driver.py -- '{request}'` runs a single request
+and exits, nonzero if it failed; servers without warm workers use it to stitch.
+"""
+import ctypes
+import json
+import os
+import sys
+import time
+import traceback
+
+import addon_utils
+import bpy
+import numpy
+
+DRIVER_PREFIX = "@DRIVER "
+
+try:
+    libc = ctypes.CDLL(None)
+except OSError:
+    libc = None
+
+def report(event, **fields):
+    # Blender's C code writes progress through stdio; flush it first so those
+    # lines reach the server before the event that ends the job.
+    if libc is not None:
+        libc.fflush(None)
+    sys.stdout.write(DRIVER_PREFIX + json.dumps(dict(event=event, **fields)) + "\n")
+    sys.stdout.flush()
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM, so each job reports its own peak.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def render(request):
+    # Add-ons are enabled before the file loads so their handlers and properties apply to it.
+    for name in request.get("addons") or ():
+        if not addon_utils.check(name)[1]:
+            addon_utils.enable(name, default_set=True)
+    bpy.ops.wm.open_mainfile(filepath=request["blend"])
+    scene = bpy.context.scene
+    scene.render.filepath = request["output"]
+    scene.render.image_settings.file_format = request["format"]
+    if request.get("threads"):
+        scene.render.threads_mode = "FIXED"
+        scene.render.threads = request["threads"]
+    if request.get("start") is not None:
+        scene.frame_start = request["start"]
+        scene.frame_end = request["end"]
+    if request.get("border"):
+        scene.render.use_border = scene.render.use_crop_to_border = True
+        (scene.render.border_min_x, scene.render.border_max_x,
+         scene.render.border_min_y, scene.render.border_max_y) = request["border"]
+
+    if request.get("animation", True):
+        bpy.ops.render.render(animation=True)
+    else:
+        scene.frame_set(request["start"])
+        bpy.ops.render.render(write_still=True)
+
+def stitch(request):
+    """Paste rendered regions into one image at their pixel offsets (from the bottom left, like Blender) and save it."""
+    canvas = numpy.zeros((request["height"], request["width"], 4), dtype=numpy.float32)
+    canvas[..., 3] = 1.0
+    is_float = False
+    colorspace = None
+    for tile in request["tiles"]:
+        image = bpy.data.images.load(tile["path"])
+        width, height = image.size
+        pixels = numpy.empty(width * height * image.channels, dtype=numpy.float32)
+        image.pixels.foreach_get(pixels)
+        x, y = tile["x"], tile["y"]
+        canvas[y:y + height, x:x + width, :image.channels] = pixels.reshape(height, width, image.channels)
+        is_float = is_float or image.is_float
+        colorspace = image.colorspace_settings.name
+        bpy.data.images.remove(image)
+
+    output = bpy.data.images.new("stitched", request["width"], request["height"], alpha=True, float_buffer=is_float)
+    if colorspace:
+        output.colorspace_settings.name = colorspace
+    output.pixels.foreach_set(canvas.ravel())
+    output.filepath_raw = request["output"]
+    output.file_format = request["format"]
+    output.save()
+    print(f"Saved: '{request['output']}'")
+
+def reset():
+    """Drop the previous job's data so it can't leak into the next one."""
+    bpy.ops.wm.read_homefile(use_empty=True)
+
+def run_request(line):
+    request = json.loads(line)
+    if "stitch" in request:
+        stitch(request["stitch"])
+    else:
+        render(request)
+
+def main():
+    args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if args:
+        try:
+            run_request(args[0])
+        except Exception:
+            traceback.print_exc()
+            sys.exit(1)
+        return
+    report("ready", version=bpy.app.version_string, pid=os.getpid())
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        started = time.time()
+        error = None
+        reset_peak_rss()
+        try:
+            run_request(line)
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e)
+        try:
+            reset()
+        except Exception:
+            traceback.print_exc()
+        peak = peak_rss_mb()
+        report("done", ok=error is None, error=error, seconds=round(time.time() - started, 3),
+               rss_mb=round(rss_mb(), 1), peak_rss_mb=round(peak, 1) if peak else None)
+
+main()
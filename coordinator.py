@@ -0,0 +1,389 @@
+import asyncio
+import os
+import datetime
+import json
+import time
+import uuid
+import argparse
+import signal
+
+import server
+from server import step, info, success, verbose, shutdown_log
+
+# === CONFIGURATION ===
+HOST = "0.0.0.0"
+PORT = 5550
+RENDER_ROOT = os.path.expanduser("~/render_jobs_coordinator")
+STATUS_TIMEOUT = 2
+# Nodes that registered themselves are forgotten after missing a few heartbeats.
+NODE_EXPIRY = 3 * server.REGISTER_INTERVAL
+# v2 capabilities offered to clients: only what the coordinator itself handles.
+# Job status, logs and traces live on the nodes, so those verbs aren't offered.
+# Nodes are driven over v1, which can't sync add-ons, and the coordinator keeps
+# no job feeds to detach from, so clients are told neither is available and the
+# `addons` and `detach` options are not passed on (a detached node job would
+# look like a lost node).
+COORDINATOR_CAPABILITIES = ["blob-store", "fetch", "stream-frames", "resume-upload", "delta-upload"]
+NODE_DROPPED_OPTIONS = {"addons", "detach"}
+
+# "host:port" -> {"host", "port", "static", "last_seen", "status", "pending"}
+nodes = {}
+
+# === NODE REGISTRY ===
+def add_node(host, port, static=False):
+    name = f"{host}:{port}"
+    node = nodes.setdefault(name, {
+        "name": name, "host": host, "port": int(port),
+        "static": static, "status": None, "pending": 0,
+    })
+    node["last_seen"] = time.time()
+    return node
+
+async def node_command(node, command):
+    """Send an `@COMMAND` to a node and return its (reader, writer)."""
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(node["host"], node["port"]), STATUS_TIMEOUT)
+    writer.write(f"{command}\n===END===\n".encode())
+    return reader, writer
+
+async def poll_node(node):
+    try:
+        reader, writer = await node_command(node, "@NODE_STATUS")
+        line = (await asyncio.wait_for(reader.readline(), STATUS_TIMEOUT)).decode()
+        writer.close()
+        if not line.startswith("STATUS:"):
+            raise Exception(line.strip() or "no reply")
+        node["status"] = json.loads(line.split(":", 1)[1])
+    except Exception as e:
+        if node["status"] is not None:
+            verbose(f"Node {node['name']} unreachable: {e!r}")
+        node["status"] = None
+
+async def refresh_nodes():
+    """Poll every node's queue depth and core count. Returns reachable nodes, least loaded first."""
+    now = time.time()
+    for name, node in list(nodes.items()):
+        if not node["static"] and now - node["last_seen"] > NODE_EXPIRY:
+            verbose(f"Node {name} expired")
+            del nodes[name]
+
+    current = list(nodes.values())
+    await asyncio.gather(*(poll_node(node) for node in current))
+    available = [node for node in current if node["status"] is not None]
+    return sorted(available, key=lambda node: (node_load(node), -node["status"]["cores"]))
+
+def node_load(node):
+    status = node["status"]
+    busy = status["queue_depth"] + status["active_jobs"] + node["pending"]
+    return busy / max(status["slots"], 1)
+
+def aggregate_status():
+    available = [node for node in nodes.values() if node["status"] is not None]
+    return {
+        "queue_depth": sum(node["status"]["queue_depth"] for node in available),
+        "active_jobs": sum(node["status"]["active_jobs"] for node in available),
+        "slots": sum(node["status"]["slots"] for node in available),
+        "cores": sum(node["status"]["cores"] for node in available),
+        "nodes": {node["name"]: node["status"] for node in nodes.values()},
+    }
+
+# === JOB PLANNING ===
+def split_frames(frame_range, available):
+    """
+    Split a frame range across nodes in proportion to their free capacity.
+    Returns [(node, "START-END:STEP"), ...] with contiguous, step-aligned ranges.
+    """
+    start, end, step = frame_range
+    total = (end - start) // step + 1
+    weights = [node["status"]["cores"] / (1 + node_load(node)) for node in available]
+    shares = [total * w / sum(weights) for w in weights]
+    counts = [int(share) for share in shares]
+    # Largest remainder so the counts add up to the whole range.
+    by_remainder = sorted(range(len(shares)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+
+    plan = []
+    first = start
+    for node, count in zip(available, counts):
+        if count == 0:
+            continue
+        last = first + (count - 1) * step
+        plan.append((node, f"{first}-{last}:{step}"))
+        first = last + step
+    return plan
+
+async def plan_job(header, blend_path, available):
+    """Decide which nodes render what: whole jobs go to the least-loaded node."""
+    if (header["render_type"] == "animation" and header["output_format"] != "FFMPEG"
+            and len(available) > 1):
+        if "frames" in header["options"]:
+            frame_range = server.parse_frame_range(header["options"]["frames"])
+        else:
+            frame_range = await server.probe_frame_range(blend_path)
+        if frame_range is not None:
+            return split_frames(frame_range, available)
+    return [(available[0], header["options"].get("frames"))]
+
+# === DISPATCH ===
+async def send_to_client(job, data):
+    try:
+        job["channel"].log(data)
+        await job["channel"].writer.drain()
+    except Exception:
+        pass
+
+async def notify(job, event, text=None, **fields):
+    try:
+        job["channel"].send(event, text, **fields)
+        await job["channel"].writer.drain()
+    except Exception:
+        pass
+
+async def fetch_outputs(node, node_job_id, job_dir):
+    """Copy a node's job outputs into the coordinator's job directory via @FETCH."""
+    reader, writer = await node_command(node, f"@FETCH {node_job_id}")
+    try:
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if line == "END":
+                return
+            if not line.startswith("FILE "):
+                raise Exception(f"Fetch from {node['name']} failed: {line or 'connection closed'}")
+            _, size, name = line.split(" ", 2)
+            path = os.path.join(job_dir, os.path.basename(name))
+            if await server.receive_file(reader, writer, path, int(size)) < int(size):
+                raise Exception(f"Fetch from {node['name']} truncated")
+    finally:
+        writer.close()
+
+async def dispatch(job, node, frames):
+    """
+    Run one assignment on a node, relaying its log lines to the client.
+    Returns True/False for the render result, or None if the node dropped out.
+    """
+    header = job["header"]
+    header_lines = [header["blend_name"], header["render_type"], str(header["file_size"]), header["output_format"]]
+    options = {key: value for key, value in header["options"].items() if key not in NODE_DROPPED_OPTIONS}
+    options["sha256"] = job["blend_hash"]
+    if frames:
+        options["frames"] = frames
+    header_lines += [f"{key}={value}" for key, value in options.items()]
+
+    label = f"[{node['name']}{' ' + frames if frames else ''}]"
+    node_job_id = None
+    result = None
+    # Count the assignment against the node until it shows up in the node's own queue.
+    pending = True
+    node["pending"] += 1
+    try:
+        reader, writer = await asyncio.open_connection(node["host"], node["port"], limit=1 << 20)
+        try:
+            writer.write(("\n".join(header_lines) + "\n===END===\n").encode())
+            # The node answers HAVE/SEND for the content hash; only send what it lacks.
+            # Anything before that reply is informational and is relayed to the client.
+            async for reply in reader:
+                if reply.startswith((b"HAVE:", b"SEND:", b"ERR:")):
+                    break
+                if reply.strip():
+                    await send_to_client(job, f"{label} {reply.decode(errors='ignore')}".encode())
+            else:
+                raise Exception("connection closed before the blob reply")
+            if reply.startswith(b"ERR:"):
+                await send_to_client(job, f"{label} {reply.decode(errors='ignore')}".encode())
+                return False
+            if not reply.startswith(b"HAVE:"):
+                with open(job["blend_path"], "rb") as f:
+                    await asyncio.get_running_loop().sendfile(writer.transport, f)
+            verbose(f"Job {job['job_id']} {label} dispatched")
+
+            async for raw in reader:
+                line = raw.decode(errors="ignore").rstrip("\n")
+                if line.startswith(("UPLOAD:", "SEND:", "HAVE:")):
+                    continue
+                elif line.startswith("QUEUED:"):
+                    if pending:
+                        pending = False
+                        node["pending"] -= 1
+                    await send_to_client(job, f"{label} {line}\n".encode())
+                elif line.startswith("PROCESSING:"):
+                    if not job["processing_sent"]:
+                        job["processing_sent"] = True
+                        await notify(job, "processing", "PROCESSING: Your job is now rendering.\n")
+                elif line.startswith("JOB_ID:"):
+                    node_job_id = line.split(":", 1)[1].strip()
+                elif line.startswith("DONE:"):
+                    result = line.strip() == "DONE: OK"
+                elif line.startswith("ERR:"):
+                    await send_to_client(job, f"{label} {line}\n".encode())
+                    result = False
+                elif line.strip():
+                    await send_to_client(job, f"{label} {line}\n".encode())
+        finally:
+            writer.close()
+    except Exception as e:
+        verbose(f"Job {job['job_id']} {label} lost node: {e!r}")
+        return None
+    finally:
+        if pending:
+            node["pending"] -= 1
+
+    if result is None:
+        return None
+    if result and node_job_id:
+        try:
+            await fetch_outputs(node, node_job_id, job["job_dir"])
+        except Exception as e:
+            verbose(f"Job {job['job_id']} {label}: {e!r}")
+            return False
+    return result
+
+async def run_assignment(job, node, frames):
+    """Dispatch one assignment, moving it to another node if the first one drops out."""
+    tried = set()
+    while node is not None:
+        tried.add(node["name"])
+        result = await dispatch(job, node, frames)
+        if result is not None:
+            return result
+        node["status"] = None
+        candidates = [n for n in await refresh_nodes() if n["name"] not in tried]
+        node = candidates[0] if candidates else None
+        if node is not None:
+            await send_to_client(job, f"Reassigning {frames or 'job'} to {node['name']}\n".encode())
+    return False
+
+# === CLIENT HANDLING ===
+async def process_job(channel, addr, request):
+    try:
+        if channel.version == 1:
+            header = server.parse_job_header(request)
+        else:
+            header = server.job_header_from_message(request)
+        # Nodes see the coordinator's address; keep fair share keyed on the real client.
+        header["options"].setdefault("client", addr[0])
+        job_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f") + "_" + str(uuid.uuid4())[:8]
+        job_dir = os.path.join(RENDER_ROOT, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        blend_path = os.path.join(job_dir, header["blend_name"])
+
+        if server.offer_blob(channel, header, blend_path):
+            blend_hash = header["options"]["sha256"].lower()
+            verbose(f"Blend file reused from store: {blend_path}")
+        else:
+            blend_hash, upload_stats = await server.receive_blend(channel, header, blend_path)
+            verbose(f"Blend file received: {blend_path} ({upload_stats})")
+            channel.send("upload", f"UPLOAD: {upload_stats}\n", message=upload_stats)
+
+        available = await refresh_nodes()
+        if not available:
+            raise Exception("No render nodes available.")
+        plan = await plan_job(header, blend_path, available)
+        channel.send("job", job_id=job_id)
+        channel.send("queued", f"QUEUED: Your request has been dispatched to {len(plan)} node(s).\n", position=None)
+        verbose(f"Job {job_id} from {addr}: " + ", ".join(f"{n['name']} {f or 'all'}" for n, f in plan))
+
+        job = {
+            "job_id": job_id,
+            "channel": channel,
+            "header": header,
+            "job_dir": job_dir,
+            "blend_path": blend_path,
+            "blend_hash": blend_hash,
+            "processing_sent": False,
+        }
+        results = await asyncio.gather(*(run_assignment(job, node, frames) for node, frames in plan))
+
+        status = "OK" if all(results) else "ERROR"
+        verbose(f"Job {job_id} finished: {status}")
+        if all(results) and "stream-frames" in channel.capabilities:
+            await server.send_files(channel, server.output_files(job_dir))
+        await notify(job, "done", f"\nDONE: {status}\nJOB_ID:{job_id}\n", ok=all(results), job_id=job_id)
+    except Exception as e:
+        verbose(f"Exception: {e!r}")
+        try:
+            channel.send("error", f"ERR: {e}\n", message=str(e))
+        except:
+            pass
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    try:
+        channel, request = await server.open_channel(reader, writer, COORDINATOR_CAPABILITIES)
+        if channel.version == 1:
+            command = request[0] if request and request[0].startswith("@") else None
+        else:
+            command = f"@{request.get('name', '')} {request.get('args', '')}".strip() if request.get("type") == "command" else None
+
+        if command is None:
+            await process_job(channel, addr, request)
+        elif command.startswith("@REGISTER "):
+            node = add_node(addr[0], int(command.split()[1]))
+            verbose(f"Node {node['name']} registered")
+            channel.send("ok", "OK\n")
+        elif command == "@NODE_STATUS":
+            await refresh_nodes()
+            status = aggregate_status()
+            channel.send("status", f"STATUS: {json.dumps(status)}\n", status=status)
+        elif command.startswith("@FETCH "):
+            await server.send_job_files(channel, command.split(" ", 1)[1].strip(), RENDER_ROOT)
+        else:
+            channel.send("error", f"ERR: Unknown command {command[1:]}\n", message=f"Unknown command {command[1:]}")
+        await writer.drain()
+    except Exception as e:
+        verbose(f"Exception: {e!r}")
+    finally:
+        writer.close()
+
+def handle_shutdown():
+    shutdown_log("Coordinator shutting down.")
+    os._exit(0)
+
+async def serve():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, handle_shutdown)
+
+    for node in await refresh_nodes():
+        info(f"Node {node['name']}: {node['status']}")
+
+    coordinator = await asyncio.start_server(
+        handle_client, HOST, PORT,
+        limit=server.STREAM_LIMIT, backlog=server.LISTEN_BACKLOG, reuse_address=True,
+    )
+    print("\n@READY: RenderCoordinator running on", f"{HOST}:{PORT}")
+    print("========================================")
+    async with coordinator:
+        await coordinator.serve_forever()
+
+def start_coordinator():
+    step("Starting Render Coordinator")
+    os.makedirs(RENDER_ROOT, exist_ok=True)
+    success(f"Render root ready: {RENDER_ROOT}")
+    # Uploads are kept in server.py's blob store under our own render root.
+    server.RENDER_ROOT = RENDER_ROOT
+    info(f"Blob store: {server.load_blob_store()} file(s)")
+    server.clean_partial_uploads()
+    server.raise_fd_limit()
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distribute render jobs across several render servers")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--render-root", default=RENDER_ROOT)
+    parser.add_argument("--node", action="append", default=[], metavar="HOST:PORT",
+                        help="Render node to use (repeatable); nodes may also register with server.py --coordinator")
+    parser.add_argument("--blender", help="Blender executable used to read animation frame ranges")
+    args = parser.parse_args()
+
+    HOST, PORT = args.host, args.port
+    RENDER_ROOT = os.path.abspath(os.path.expanduser(args.render_root))
+    if args.blender:
+        server.BLENDER_PATH = os.path.abspath(args.blender)
+    elif not os.path.isfile(server.BLENDER_PATH):
+        info("No Blender available: animations will not be split across nodes.")
+    for spec in args.node:
+        node_host, _, node_port = spec.rpartition(":")
+        add_node(node_host, int(node_port), static=True)
+    start_coordinator()
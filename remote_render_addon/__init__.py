@@ -2,7 +2,7 @@
 bl_info = {
     "name": "Remote Render Client",
     "author": "Wys",
-    "version": (1, 1),
+    "version": (1, 3),
     "blender": (4, 0, 0),
     "location": "3D View > Sidebar > Remote Render",
     "description": "Send render jobs to remote server",
@@ -10,15 +10,90 @@ bl_info = {
 }
 
 import bpy
-from bpy.props import StringProperty, EnumProperty, PointerProperty
+from bpy.props import StringProperty, EnumProperty, BoolProperty, IntProperty, PointerProperty
 from bpy.types import Panel, Operator, PropertyGroup
 import os
+import queue
+import threading
 
 try:
     from . import client
 except ImportError:
     import client
 
+# Jobs run in background threads. They only post (job, event, fields) to
+# `events`; drain_events applies them to `jobs` on Blender's main thread.
+EVENT_POLL_INTERVAL = 0.2
+jobs = []
+events = queue.Queue()
+job_counter = 0
+
+def run_job(job, path, props):
+    post = lambda event, fields: events.put((job["id"], event, fields))
+    try:
+        job_id = client.send_render_job(
+            blend_path=path,
+            config=None,
+            log=lambda msg: post("log", {"message": msg}),
+            events=post,
+            control=job["control"],
+            **props,
+        )
+    except Exception as e:
+        post("log", {"message": f"Render job failed: {e}"})
+        job_id = None
+    post("finished", {"job_id": job_id})
+
+def apply_event(job, event, fields):
+    if event == "log":
+        job["message"] = fields["message"]
+        print(f"[Remote Render] {job['name']}: {fields['message']}")
+    elif event == "uploading":
+        job["status"] = "Uploading"
+        job["progress"] = fields["sent"] / max(fields["total"], 1)
+    elif event in ("have", "upload"):
+        job["progress"] = 1.0
+    elif event == "job":
+        job["job_id"] = fields.get("job_id")
+    elif event == "queued":
+        job["status"] = f"Queued #{fields['position']}" if fields.get("position") else "Queued"
+        job["progress"] = 0.0
+    elif event == "processing":
+        job["status"] = "Rendering"
+    elif event == "regions":
+        job["status"] = f"Rendering {fields.get('count')} regions"
+    elif event == "progress":
+        job["status"] = f"Frame {fields.get('frame', '?')}"
+        if fields.get("frames_total"):
+            job["progress"] = fields.get("frames_done", 0) / fields["frames_total"]
+    elif event == "finished":
+        job["job_id"] = fields["job_id"] or job["job_id"]
+        if fields["job_id"]:
+            job["state"], job["status"], job["progress"] = "done", "Done", 1.0
+        elif job["control"].get("cancelled"):
+            job["state"], job["status"] = "cancelled", "Cancelled"
+        else:
+            job["state"], job["status"] = "failed", "Failed"
+
+def drain_events():
+    """bpy.app.timers callback: apply queued job events, stop once no job is running."""
+    jobs_by_id = {job["id"]: job for job in jobs}
+    changed = False
+    while True:
+        try:
+            job_id, event, fields = events.get_nowait()
+        except queue.Empty:
+            break
+        if job_id in jobs_by_id:
+            apply_event(jobs_by_id[job_id], event, fields)
+            changed = True
+    if changed:
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+    return EVENT_POLL_INTERVAL if any(job["state"] == "running" for job in jobs) else None
+
 class RemoteRenderProperties(PropertyGroup):
     filepath: StringProperty(
         name="Blend File",
@@ -41,9 +116,27 @@ class RemoteRenderProperties(PropertyGroup):
             ('PNG', "PNG", ""),
             ('FFMPEG', "FFMPEG", ""),
             ('JPEG', "JPEG", ""),
+            ('OPEN_EXR', "OpenEXR", ""),
         ],
         default='PNG',
     )
+    split_regions: BoolProperty(
+        name="Split Across Slots",
+        description="Render the image as regions on every free server slot and stitch them (PNG, JPEG, OpenEXR)",
+        default=False,
+    )
+    use_cache: BoolProperty(
+        name="Reuse Cached Renders",
+        description="Let the server return outputs of an identical earlier render instead of rendering again",
+        default=True,
+    )
+    priority: IntProperty(
+        name="Priority",
+        description="Higher priority jobs are scheduled first on the server",
+        default=0,
+        min=-10,
+        max=10,
+    )
 
 class RENDERCLIENT_OT_send_job(Operator):
     bl_idname = "renderclient.send_job"
@@ -51,6 +144,7 @@ class RENDERCLIENT_OT_send_job(Operator):
     bl_description = "Send the current .blend or chosen file to remote render server"
 
     def execute(self, context):
+        global job_counter
         props = context.scene.remote_render_props
         path = props.filepath
         if not path:
@@ -60,25 +154,54 @@ class RENDERCLIENT_OT_send_job(Operator):
             self.report({'ERROR'}, "File does not exist")
             return {'CANCELLED'}
 
-        self.report({'INFO'}, f"Sending {os.path.basename(path)} for remote rendering...")
-        job_id = client.send_render_job(
-            blend_path=path,
-            render_type=props.render_type,
-            output_format=props.output_format,
-            config=None,
-            log=lambda msg: self.report({'INFO'}, msg)
-        )
-        if job_id:
-            self.report({'INFO'}, f"Render job sent successfully! Job ID: {job_id}")
-            return {'FINISHED'}
-        else:
-            self.report({'ERROR'}, "Failed to send render job")
-            return {'CANCELLED'}
+        job_counter += 1
+        job = {
+            "id": job_counter, "name": os.path.basename(path), "state": "running", "status": "Starting",
+            "progress": 0.0, "message": "", "job_id": None, "control": {},
+        }
+        jobs.append(job)
+        # Properties are read here: the thread must not touch bpy data.
+        options = {
+            "render_type": props.render_type, "output_format": props.output_format,
+            "use_cache": props.use_cache, "priority": props.priority,
+        }
+        if props.render_type == 'image' and props.split_regions:
+            options["regions"] = "auto"
+        threading.Thread(target=run_job, args=(job, path, options), daemon=True).start()
+        if not bpy.app.timers.is_registered(drain_events):
+            bpy.app.timers.register(drain_events, first_interval=EVENT_POLL_INTERVAL)
+        self.report({'INFO'}, f"Sending {job['name']} for remote rendering...")
+        return {'FINISHED'}
 
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
 
+class RENDERCLIENT_OT_cancel_job(Operator):
+    bl_idname = "renderclient.cancel_job"
+    bl_label = "Cancel Render Job"
+    bl_description = "Stop uploading or rendering this job"
+
+    job: IntProperty()
+
+    def execute(self, context):
+        job = next((job for job in jobs if job["id"] == self.job and job["state"] == "running"), None)
+        if job is None:
+            return {'CANCELLED'}
+        job["status"] = "Cancelling"
+        post = lambda msg: events.put((job["id"], "log", {"message": msg}))
+        threading.Thread(target=client.cancel_render_job, args=(job["control"], None, post), daemon=True).start()
+        return {'FINISHED'}
+
+class RENDERCLIENT_OT_clear_jobs(Operator):
+    bl_idname = "renderclient.clear_jobs"
+    bl_label = "Clear Finished"
+    bl_description = "Remove finished jobs from the list"
+
+    def execute(self, context):
+        jobs[:] = [job for job in jobs if job["state"] == "running"]
+        return {'FINISHED'}
+
 class RENDERCLIENT_PT_panel(Panel):
     bl_label = "Remote Render Client"
     bl_idname = "RENDERCLIENT_PT_panel"
@@ -93,16 +216,38 @@ class RENDERCLIENT_PT_panel(Panel):
         layout.prop(props, "filepath")
         layout.prop(props, "render_type")
         layout.prop(props, "output_format")
+        if props.render_type == 'image':
+            layout.prop(props, "split_regions")
+        layout.prop(props, "use_cache")
+        layout.prop(props, "priority")
         layout.operator(RENDERCLIENT_OT_send_job.bl_idname, text="Send Render Job")
 
+        for job in jobs:
+            box = layout.box()
+            row = box.row()
+            row.label(text=job["name"] + (f" ({job['job_id']})" if job["job_id"] else ""))
+            if job["state"] == "running":
+                row.operator(RENDERCLIENT_OT_cancel_job.bl_idname, text="", icon='X').job = job["id"]
+            box.progress(factor=job["progress"], type='BAR', text=job["status"])
+            if job["message"]:
+                box.label(text=job["message"][:80])
+        if any(job["state"] != "running" for job in jobs):
+            layout.operator(RENDERCLIENT_OT_clear_jobs.bl_idname)
+
 def register():
     bpy.utils.register_class(RemoteRenderProperties)
     bpy.types.Scene.remote_render_props = PointerProperty(type=RemoteRenderProperties)
     bpy.utils.register_class(RENDERCLIENT_OT_send_job)
+    bpy.utils.register_class(RENDERCLIENT_OT_cancel_job)
+    bpy.utils.register_class(RENDERCLIENT_OT_clear_jobs)
     bpy.utils.register_class(RENDERCLIENT_PT_panel)
 
 def unregister():
+    if bpy.app.timers.is_registered(drain_events):
+        bpy.app.timers.unregister(drain_events)
     bpy.utils.unregister_class(RENDERCLIENT_PT_panel)
+    bpy.utils.unregister_class(RENDERCLIENT_OT_clear_jobs)
+    bpy.utils.unregister_class(RENDERCLIENT_OT_cancel_job)
     bpy.utils.unregister_class(RENDERCLIENT_OT_send_job)
     del bpy.types.Scene.remote_render_props
     bpy.utils.unregister_class(RemoteRenderProperties)
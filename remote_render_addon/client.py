@@ -1,10 +1,50 @@
 import socket
 import os
+import getpass
 import sys
 import subprocess
 import json
+import time
+import hashlib
+import struct
+import zlib
+
+try:
+    # Bundled with Blender; speeds up the rolling checksum for delta uploads.
+    import numpy
+except ImportError:
+    numpy = None
 
 CONFIG_PATH = os.path.expanduser("~/.render_client_config.json")
+# sha256 of previously sent files, keyed by path and invalidated by size/mtime
+HASH_CACHE_PATH = os.path.expanduser("~/.render_client_hashes.json")
+
+# Protocol v2 framing, as in server.py: magic and version byte, then frames of
+# one kind byte (J = JSON message, L = log text, D = data) and an 8-byte length.
+V2_MAGIC = b"\x00RRP"
+PROTOCOL_VERSION = 2
+FRAME_HEADER = struct.Struct(">cQ")
+CLIENT_CAPABILITIES = ["blob-store", "result-cache", "job-status", "fetch", "stream-frames", "resume-upload",
+                       "delta-upload", "progress", "trace", "addon-sync", "detach",
+                       "regions"]
+# Resumable uploads go out in CRC-checked chunks; a dropped connection is
+# retried this many times, continuing from the last chunk the server confirmed.
+UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+# Upload progress is reported to an `events` callback this often.
+UPLOAD_PROGRESS_STEP = 4 * 1024 * 1024
+UPLOAD_RETRIES = 5
+CHUNK_RETRIES = 3
+# Delta uploads, as in server.py: block signatures are an Adler-32 and a 16-byte
+# BLAKE2b; the delta is a stream of b"C" (copy blocks) / b"L" (literal) records.
+# The whole file is sent instead when the delta would be larger than this share.
+DELTA_SIGNATURE = struct.Struct(">I16s")
+DELTA_OP = struct.Struct(">cQQ")
+DELTA_MAX_RATIO = 0.7
+DELTA_WINDOW = 4 * 1024 * 1024
+# Client spans in merged job traces (the server's events use pid 1).
+TRACE_CLIENT_PID = 2
+# Not sent with add-ons: caches and VCS metadata.
+ADDON_SKIP_NAMES = {"__pycache__", ".git", ".svn", ".hg", ".DS_Store"}
 
 def default_log(msg):
     print(f"[CLIENT] {msg}")
@@ -33,15 +73,21 @@ def ensure_config(config=None, log=default_log):
         raise ValueError("Missing 'server_host' in config")
     if "server_port" not in config:
         raise ValueError("Missing 'server_port' in config")
-    if "remote_addons_dir" not in config:
-        config["remote_addons_dir"] = "~/.config/blender/4.5/scripts/addons/"
-        changed = True
     if "local_addons_dir" not in config:
         config["local_addons_dir"] = os.path.expanduser("~/Library/Application Support/Blender/4.1/scripts/addons/")
         changed = True
     if "render_output_dir" not in config:
         config["render_output_dir"] = os.path.expanduser("~/Rendered")
         changed = True
+    if "socket_buffer_size" not in config:
+        # 0 keeps the OS's own buffer autotuning
+        config["socket_buffer_size"] = 0
+        changed = True
+
+    if "client_id" not in config:
+        # Servers share render slots fairly between client ids.
+        config["client_id"] = f"{getpass.getuser()}@{socket.gethostname()}"
+        changed = True
 
     if changed:
         save_config(config)
@@ -49,6 +95,384 @@ def ensure_config(config=None, log=default_log):
 
     return config
 
+def file_sha256(path):
+    """Content hash of `path`, reusing the cached value while size and mtime are unchanged."""
+    return hash_files([path])[os.path.abspath(path)]
+
+def hash_files(paths):
+    """Content hashes of `paths` (absolute path -> sha256), through the hash cache."""
+    try:
+        with open(HASH_CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    hashes = {}
+    changed = False
+    for path in paths:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = cache.get(path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            hashes[path] = entry["sha256"]
+            continue
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(block)
+        cache[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": hasher.hexdigest()}
+        hashes[path] = cache[path]["sha256"]
+        changed = True
+
+    if changed:
+        try:
+            with open(HASH_CACHE_PATH, 'w') as f:
+                json.dump(cache, f)
+        except OSError:
+            pass
+    return hashes
+
+def addon_manifest(addons_dir):
+    """
+    Describe the add-on directory for the server's add-on store. Returns
+    ({relative path: [sha256, size]}, {sha256: local path}, manifest digest).
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(addons_dir):
+        dirnames[:] = [name for name in dirnames if name not in ADDON_SKIP_NAMES]
+        paths += [os.path.join(dirpath, name) for name in filenames
+                  if name not in ADDON_SKIP_NAMES and not name.endswith(".pyc")]
+    hashes = hash_files(paths)
+    files = {}
+    by_hash = {}
+    for path, digest in hashes.items():
+        relpath = os.path.relpath(path, os.path.abspath(addons_dir)).replace(os.sep, "/")
+        files[relpath] = [digest, os.path.getsize(path)]
+        by_hash[digest] = path
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+    return files, by_hash, digest
+
+def send_addon_files(s, wanted, by_hash, log):
+    sent = 0
+    for digest in wanted:
+        path = by_hash[digest]
+        send_message(s, type="addon_file", sha256=digest)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            s.sendall(FRAME_HEADER.pack(b"D", size))
+            if size:
+                s.sendfile(f)
+        sent += size
+    log(f"[Add-ons] Sent {len(wanted)} changed file(s), {sent / 1e6:.2f} MB")
+
+def recv_exact(s, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = s.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError("Server closed the connection.")
+        data += chunk
+    return bytes(data)
+
+def send_message(s, **message):
+    payload = json.dumps(message).encode()
+    s.sendall(FRAME_HEADER.pack(b"J", len(payload)) + payload)
+
+def recv_frame(s):
+    """Read one frame; returns (kind, payload), or (None, b"") once the server has closed the connection."""
+    header = b""
+    while len(header) < FRAME_HEADER.size:
+        chunk = s.recv(FRAME_HEADER.size - len(header))
+        if not chunk:
+            if header:
+                raise ConnectionError("Server closed the connection mid-frame.")
+            return None, b""
+        header += chunk
+    kind, length = FRAME_HEADER.unpack(header)
+    return kind, recv_exact(s, length)
+
+def recv_file(s, path, size):
+    """Write the next `size` bytes from the socket to `path`."""
+    buffer = memoryview(bytearray(min(max(size, 1), 1 << 20)))
+    received = 0
+    with open(path + ".part", "wb") as f:
+        while received < size:
+            n = s.recv_into(buffer, min(len(buffer), size - received))
+            if not n:
+                raise ConnectionError("Server closed the connection mid-file.")
+            f.write(buffer[:n])
+            received += n
+    os.replace(path + ".part", path)
+
+def recv_message(s):
+    kind, payload = recv_frame(s)
+    if kind is None:
+        raise ConnectionError("Server closed the connection.")
+    if kind != b"J":
+        raise ConnectionError(f"Unexpected {kind!r} frame from server.")
+    return json.loads(payload)
+
+def open_connection(config, clock=None):
+    """
+    Connect to the server and run the v2 handshake. Returns (socket, server
+    capabilities). If a `clock` dict is given, it receives the server's clock
+    offset (server minus local seconds) and the handshake round trip.
+    """
+    s = socket.create_connection((config["server_host"], config["server_port"]))
+    try:
+        s.sendall(V2_MAGIC + bytes([PROTOCOL_VERSION]))
+        sent_at = time.time()
+        send_message(s, type="hello", version=PROTOCOL_VERSION, capabilities=CLIENT_CAPABILITIES)
+        hello = recv_message(s)
+        received_at = time.time()
+        if hello.get("event") != "hello":
+            raise ConnectionError(hello.get("message", "Handshake failed."))
+    except Exception:
+        s.close()
+        raise
+    if clock is not None and hello.get("time") is not None:
+        clock["offset"] = hello["time"] - (sent_at + received_at) / 2
+        clock["rtt"] = received_at - sent_at
+    return s, set(hello.get("capabilities", []))
+
+def file_crc32(f, offset, size):
+    f.seek(offset)
+    crc = 0
+    remaining = size
+    while remaining:
+        block = f.read(min(remaining, 1 << 20))
+        if not block:
+            raise OSError("Blend file changed during upload.")
+        crc = zlib.crc32(block, crc)
+        remaining -= len(block)
+    return crc
+
+def recv_reply(s):
+    """Next JSON message from the server, skipping log frames."""
+    kind, payload = recv_frame(s)
+    while kind == b"L":
+        kind, payload = recv_frame(s)
+    if kind != b"J":
+        raise ConnectionError("Server closed the connection mid-upload.")
+    return json.loads(payload)
+
+def blend_compression(f):
+    """'gzip' or 'zstd' for compressed .blend files (by magic bytes), else None."""
+    f.seek(0)
+    magic = f.read(4)
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    if magic == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    return None
+
+def rolling_candidates(path, weak_sums, block_size):
+    """
+    Offsets of `path` whose Adler-32 over the next `block_size` bytes is in
+    `weak_sums`, computed for every offset at once with numpy (cumulative sums,
+    DELTA_WINDOW bytes at a time). A table on the low 24 bits filters offsets
+    before the exact lookup.
+    """
+    data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+    wanted = numpy.unique(numpy.fromiter(weak_sums, dtype=numpy.int64))
+    table = numpy.zeros(1 << 24, dtype=bool)
+    table[wanted & 0xFFFFFF] = True
+    count = len(data) - block_size + 1
+    weights = numpy.arange(DELTA_WINDOW + block_size, dtype=numpy.int64)
+    for start in range(0, max(count, 0), DELTA_WINDOW):
+        stop = min(start + DELTA_WINDOW, count)
+        x = data[start:stop + block_size - 1].astype(numpy.int64)
+        sums = numpy.zeros(len(x) + 1, dtype=numpy.int64)
+        numpy.cumsum(x, out=sums[1:])
+        x *= weights[:len(x)]
+        weighted = numpy.zeros(len(x) + 1, dtype=numpy.int64)
+        numpy.cumsum(x, out=weighted[1:])
+        # Adler-32 of the window at k: a = 1 + sum, b = block_size + sum((block_size - i) * x[k + i])
+        a = sums[block_size:] - sums[:-block_size]
+        b = weights[block_size:block_size + len(a)] * a
+        b -= weighted[block_size:]
+        b += weighted[:-block_size]
+        b += block_size
+        b %= 65521
+        a += 1
+        a %= 65521
+        b <<= 16
+        b |= a
+        hits = numpy.flatnonzero(table[b & 0xFFFFFF])
+        weak = b[hits]
+        found = wanted[numpy.searchsorted(wanted, weak).clip(max=len(wanted) - 1)] == weak
+        yield from (start + hits[found]).tolist()
+
+def match_blocks(f, path, file_size, signatures, block_size):
+    """
+    Find blocks of the server's copy in the file, rsync style. Returns
+    non-overlapping (offset, block) pairs in file order. Without numpy only
+    block-aligned offsets are tried, which misses data that moved.
+    """
+    blocks = {}
+    for i in range(len(signatures) // DELTA_SIGNATURE.size):
+        weak, strong = DELTA_SIGNATURE.unpack_from(signatures, i * DELTA_SIGNATURE.size)
+        blocks.setdefault(weak, {}).setdefault(strong, i)
+    if numpy is not None:
+        candidates = rolling_candidates(path, blocks, block_size)
+    else:
+        candidates = range(0, file_size - block_size + 1, block_size)
+
+    matches = []
+    end = 0
+    for offset in candidates:
+        if offset < end:
+            continue
+        f.seek(offset)
+        block = f.read(block_size)
+        strongs = blocks.get(zlib.adler32(block))
+        if strongs:
+            index = strongs.get(hashlib.blake2b(block, digest_size=16).digest())
+            if index is not None:
+                matches.append((offset, index))
+                end = offset + block_size
+    return matches
+
+def delta_ops(matches, file_size, block_size):
+    """Turn block matches into (kind, a, b) ops: copy runs (b"C", first, count) and literals (b"L", offset, length)."""
+    ops = []
+    position = 0
+    for offset, index in matches:
+        if offset > position:
+            ops.append((b"L", position, offset - position))
+        if ops and ops[-1][0] == b"C" and offset == position and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = (b"C", ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append((b"C", index, 1))
+        position = offset + block_size
+    if position < file_size:
+        ops.append((b"L", position, file_size - position))
+    return ops
+
+def send_delta(s, f, path, file_size, log=default_log):
+    """
+    Answer the server's `delta` offer: match the file against the block
+    signatures it sends and upload only the changed data, or tell it to expect
+    the whole file when that wouldn't save enough. Returns bytes sent, or None
+    if the file still has to be sent in full.
+    """
+    offer = recv_reply(s)
+    if offer.get("event") != "delta":
+        raise ConnectionError(offer.get("message", "Expected block signatures from the server."))
+    kind, signatures = recv_frame(s)
+    if kind != b"D":
+        raise ConnectionError("Expected block signatures from the server.")
+
+    compression = blend_compression(f)
+    if compression == "gzip":
+        # One gzip stream: any edit changes everything after it.
+        log("Blend file is gzip-compressed, delta upload won't help. Sending it whole.")
+        send_message(s, type="full")
+        return None
+    started = time.time()
+    block_size = offer["block_size"]
+    ops = delta_ops(match_blocks(f, path, file_size, signatures, block_size), file_size, block_size)
+    delta_size = sum(DELTA_OP.size + (length if kind == b"L" else 0) for kind, _, length in ops)
+    ratio = delta_size / max(file_size, 1)
+    note = f" ({compression}-compressed)" if compression else ""
+    log(f"Delta against the server's previous copy{note}: {delta_size / 1e6:.1f} MB of "
+        f"{file_size / 1e6:.1f} MB ({ratio:.1%}), computed in {time.time() - started:.2f}s")
+    if ratio > DELTA_MAX_RATIO:
+        log("Delta doesn't pay off, sending the whole file.")
+        send_message(s, type="full")
+        return None
+
+    send_message(s, type="delta", ops=len(ops))
+    s.sendall(FRAME_HEADER.pack(b"D", delta_size))
+    for kind, a, b in ops:
+        if kind == b"C":
+            s.sendall(DELTA_OP.pack(kind, a, b))
+        else:
+            s.sendall(DELTA_OP.pack(kind, b, 0))
+            s.sendfile(f, a, b)
+    return delta_size
+
+def send_range(s, f, offset, size, progress=None):
+    """sendfile `size` bytes of `f` from `offset`, passing the position reached to `progress` every UPLOAD_PROGRESS_STEP."""
+    end = offset + size
+    while offset < end:
+        step = min(UPLOAD_PROGRESS_STEP, end - offset) if progress else end - offset
+        s.sendfile(f, offset, step)
+        offset += step
+        if progress:
+            progress(offset)
+
+def send_chunks(s, f, offset, file_size, log=default_log, progress=None):
+    """
+    Upload `f` from `offset` in UPLOAD_CHUNK_SIZE pieces, each announced with
+    its CRC-32 and confirmed by the server (chunk_ok) before the next one.
+    Log frames arriving meanwhile are skipped.
+    """
+    retries = 0
+    while offset < file_size:
+        size = min(UPLOAD_CHUNK_SIZE, file_size - offset)
+        send_message(s, type="chunk", offset=offset, size=size, crc32=file_crc32(f, offset, size))
+        s.sendall(FRAME_HEADER.pack(b"D", size))
+        send_range(s, f, offset, size, progress)
+
+        reply = recv_reply(s)
+        if reply.get("event") == "chunk_ok":
+            offset = reply["offset"]
+            retries = 0
+            log(f"Uploaded {offset / 1e6:.1f} / {file_size / 1e6:.1f} MB")
+        elif reply.get("event") == "chunk_retry" and retries < CHUNK_RETRIES:
+            offset = reply["offset"]
+            retries += 1
+            log(f"Chunk at {offset / 1e6:.1f} MB was corrupted in transit, resending...")
+        else:
+            raise ConnectionError(reply.get("message", "Upload rejected by the server."))
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes:02d}:{seconds:02d}"
+
+def format_progress(message):
+    """One line for a `progress` event."""
+    total = message.get("frames_total")
+    parts = [f"Frame {message.get('frame', '?')}", f"{message.get('frames_done', 0)}/{total if total is not None else '?'} done"]
+    if message.get("samples_total"):
+        parts.append(f"samples {message['samples_done']}/{message['samples_total']}")
+    if message.get("mem_peak_mb") is not None:
+        parts.append(f"peak {message['mem_peak_mb']:.0f} MB")
+    if message.get("elapsed") is not None:
+        parts.append(f"elapsed {format_duration(message['elapsed'])}")
+    if message.get("remaining") is not None:
+        parts.append(f"remaining {format_duration(message['remaining'])}")
+    return " | ".join(parts)
+
+def format_retry(message):
+    """One line for a `retry` event, about a frame or a region of a still."""
+    what = f"Region {message['region']}" if "region" in message else f"Frame {message.get('frame')}"
+    return f"{what} failed, retrying ({message.get('attempt')}/{message.get('retries')})"
+
+def format_finished(ok, job_id, message):
+    """The closing line for a `done` event, naming frames that were skipped after failing every retry."""
+    status = "success" if ok else "failure"
+    skipped = message.get("failed_frames")
+    if ok and skipped:
+        status += f", {len(skipped)} frame(s) skipped: {', '.join(map(str, skipped))}"
+    return f"Render finished with status: {status} (job_id={job_id})"
+
+def trace_span(spans, name, start, end, **args):
+    """Record a Chrome trace span in local wall-clock time."""
+    spans.append({"name": name, "ph": "X", "pid": TRACE_CLIENT_PID, "tid": 0,
+                  "ts": round(start * 1e6), "dur": round(max(end - start, 0) * 1e6), "args": args})
+
+def merge_trace(server_trace, spans, clock):
+    """Server trace plus the client's spans, shifted onto the server clock."""
+    shift = round(clock.get("offset", 0.0) * 1e6)
+    events = list(server_trace.get("traceEvents", []))
+    events.append({"name": "process_name", "ph": "M", "pid": TRACE_CLIENT_PID, "args": {"name": "client"}})
+    events.append({"name": "thread_name", "ph": "M", "pid": TRACE_CLIENT_PID, "tid": 0, "args": {"name": "send_render_job"}})
+    events += [dict(span, ts=span["ts"] + shift) for span in spans]
+    other = dict(server_trace.get("otherData", {}), clock_offset_s=clock.get("offset"), clock_rtt_s=clock.get("rtt"))
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": other}
+
 def auto_download(server_host, job_id, local_folder, log=default_log):
     remote_path = f"wys@{server_host}:~/render_jobs/{job_id}/"
     log(f"Attempting to auto-download render output from {remote_path}")
@@ -74,6 +498,14 @@ def send_render_job(
     output_format="PNG",
     config=None,
     log=default_log,
+    use_cache=True,
+    priority=0,
+    trace=False,
+    blender_version=None,
+    events=None,
+    control=None,
+    detach=False,
+    regions=None,
 ):
     """
     Send the blend file to the remote render server.
@@ -81,119 +513,476 @@ def send_render_job(
     Parameters:
       - blend_path: full path to .blend file to render
       - render_type: "image" or "animation"
-      - output_format: "PNG", "FFMPEG", "JPEG"
+      - output_format: "PNG", "FFMPEG", "JPEG", "OPEN_EXR"
       - config: dict with keys:
-         server_host, server_port, remote_addons_dir, local_addons_dir, render_output_dir
+         server_host, server_port, local_addons_dir, render_output_dir,
+         socket_buffer_size, client_id
       - log: callable(msg) for logging output
+      - use_cache: let the server reuse outputs of earlier identical renders
+      - priority: higher values are scheduled before other clients' jobs
+      - trace: save a Chrome trace of the job (client and server spans on the
+        server's clock) to <render_output_dir>/<job_id>/trace.json
+      - blender_version: Blender version to render with, e.g. "4.1"; the server
+        uses the closest one it has installed
+      - events: callable(event, fields) receiving every server message as it
+        arrives, plus ("uploading", {"sent": bytes, "total": bytes}) during the
+        upload; called from the thread running send_render_job
+      - control: dict shared with cancel_render_job to cancel the job from
+        another thread; send_render_job keeps its "socket" and "job_id" there
+      - detach: return as soon as the job is queued; follow it later with
+        attach_job and download its outputs with fetch_results
+      - regions: render a single image as this many regions in parallel on the
+        server and stitch them, or "auto" to size it from the server's free
+        slots and the image size
 
     Returns:
       - job_id (str) if successful, None otherwise
     """
 
     config = ensure_config(config, log)
-    SERVER_HOST = config["server_host"]
-    SERVER_PORT = config["server_port"]
     LOCAL_ADDONS_DIR = config["local_addons_dir"]
-    REMOTE_ADDONS_DIR = config["remote_addons_dir"]
-    RENDER_OUTPUT_DIR = os.path.abspath(os.path.expanduser(config["render_output_dir"]))
 
     if not os.path.isfile(blend_path):
         log(f"Blend file does not exist: {blend_path}")
         return None
 
+    spans = []
+    clock = {}
+    started = time.time()
     blend_name = os.path.basename(blend_path)
     file_size = os.path.getsize(blend_path)
+    blend_hash = file_sha256(blend_path)
+    trace_span(spans, "hash blend", started, time.time())
 
-    # Sync add-ons
-    log("Syncing Blender add-ons...")
-    if os.path.exists(LOCAL_ADDONS_DIR):
-        rsync_cmd = [
-            "rsync", "-avz", LOCAL_ADDONS_DIR,
-            f"wys@{SERVER_HOST}:{REMOTE_ADDONS_DIR}"
-        ]
-        result = subprocess.run(rsync_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            log("Add-on sync failed:")
-            log(result.stderr)
-        else:
-            log("Add-ons synced.")
+    # Add-ons go over the job connection; hashing them here is all an unchanged set costs.
+    synced = time.time()
+    addons = None
+    if os.path.isdir(LOCAL_ADDONS_DIR):
+        addons = addon_manifest(LOCAL_ADDONS_DIR)
+        if not addons[0]:
+            addons = None
     else:
         log("Local add-ons directory not found.")
+    trace_span(spans, "hash add-ons", synced, time.time(), files=len(addons[0]) if addons else 0)
+
+    # The upload id names this client's partial copy on the server, so a retry
+    # (or a later run) resumes it instead of starting over.
+    upload_id = hashlib.sha256(f"{config['client_id']}:{blend_hash}".encode()).hexdigest()[:16]
+
+    # Connect & send; only a connection lost before the upload is confirmed is retried.
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if control is not None and control.get("cancelled"):
+            log("Render job cancelled.")
+            return None
+        if attempt:
+            log(f"Upload interrupted, reconnecting (attempt {attempt + 1} of {UPLOAD_RETRIES + 1})...")
+            time.sleep(min(2 ** attempt, 30))
+        result = _send_render_job(config, blend_path, blend_name, file_size, blend_hash, upload_id,
+                                  render_type, output_format, use_cache, priority, blender_version, addons,
+                                  log, spans, clock, events, control, detach, regions)
+        if result is not _UPLOAD_INTERRUPTED:
+            trace_span(spans, "send_render_job", started, time.time(), job_id=result)
+            if trace and result:
+                save_trace(result, spans, clock, config, log)
+            return result
+    log("Giving up on the upload.")
+    return None
+
+# Returned by _send_render_job when the connection dropped mid-upload.
+_UPLOAD_INTERRUPTED = object()
+
+def _send_render_job(config, blend_path, blend_name, file_size, blend_hash, upload_id,
+                     render_type, output_format, use_cache, priority, blender_version, addons, log, spans, clock,
+                     events=None, control=None, detach=False, regions=None):
+    SERVER_HOST = config["server_host"]
+    SERVER_PORT = config["server_port"]
+    RENDER_OUTPUT_DIR = os.path.abspath(os.path.expanduser(config["render_output_dir"]))
+    uploading = False
+    emit = events or (lambda event, fields: None)
+    progress = lambda sent: emit("uploading", {"sent": sent, "total": file_size})
+    control = {} if control is None else control
 
-    # Connect & send
     log(f"Connecting to render server at {SERVER_HOST}:{SERVER_PORT}...")
     try:
-        with socket.create_connection((SERVER_HOST, SERVER_PORT)) as s:
-            log("Connected to server.")
-
-            header = f"{blend_name}\n{render_type}\n{file_size}\n{output_format}\n===END===\n"
-            s.sendall(header.encode())
+        connected = time.time()
+        s, capabilities = open_connection(config, clock)
+        trace_span(spans, "connect", connected, time.time())
+        waiting = time.time()
+        control["socket"] = s
+        with s:
+            if control.get("cancelled"):
+                return None
+            log(f"Connected to server (protocol v{PROTOCOL_VERSION}: {', '.join(sorted(capabilities)) or 'no extras'}).")
 
-            with open(blend_path, "rb") as f:
-                while True:
-                    chunk = f.read(4096)
-                    if not chunk:
-                        break
-                    s.sendall(chunk)
+            if config["socket_buffer_size"]:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config["socket_buffer_size"])
 
-            log("Blend file sent. Waiting for response...")
+            options = {"sha256": blend_hash, "client": config["client_id"], "upload_id": upload_id}
+            if priority:
+                options["priority"] = str(priority)
+            if not use_cache:
+                options["cache"] = "0"
+            if blender_version:
+                options["blender"] = blender_version
+            if addons and "addon-sync" in capabilities:
+                options["addons"] = addons[2]
+            elif addons:
+                log("Server does not support add-on sync; add-ons were not sent.")
+            if detach and "detach" in capabilities:
+                options["detach"] = "1"
+            elif detach:
+                log("Server does not support detached jobs; staying connected.")
+            if regions and "regions" in capabilities:
+                options["regions"] = str(regions)
+            elif regions:
+                log("Server does not support region rendering; rendering the image in one piece.")
+            send_message(s, type="job", blend_name=blend_name, render_type=render_type,
+                         file_size=file_size, output_format=output_format, options=options)
 
-            buffer = ""
             job_id = None
-            done_received = False
+            ok = False
+            detached = False
+            files_received = 0
             while True:
-                chunk = s.recv(1024)
-                if not chunk:
-                    # connexion fermée : traiter le dernier buffer s’il reste
-                    if buffer:
-                        lines = buffer.split("\n")
-                        for line in lines:
-                            log(f"[Server] {line.strip()}")
+                kind, payload = recv_frame(s)
+                if kind is None:
+                    if uploading:
+                        return _UPLOAD_INTERRUPTED
+                    log("Server closed the connection before the job finished.")
                     break
-                decoded = chunk.decode(errors="ignore")
-                print(f"[DEBUG received chunk]: {repr(decoded)}")
-
-                decoded = chunk.decode(errors="ignore")
-                buffer += decoded
-                lines = buffer.split("\n")
-
-                buffer = lines.pop() if not decoded.endswith("\n") else ""
-
-                for line in lines:
-                    line = line.strip()
-                    log(f"[Server] {line}")  # afficher toutes les lignes reçues
-
-                    if "Fra:" in line or "Rendering" in line:
-                        log(f"[Blender] {line[:100]}")
-
-                    elif line.startswith("QUEUED:"):
-                        log(f"[Queue] {line}")
-
-                    elif line.startswith("PROCESSING:"):
-                        log(f"[Status] {line}")
-
-                    if line.startswith("JOB_ID:"):
-                        job_id = line.split(":", 1)[1].strip()
-                        done_received = True
-                        log(f"job_id={job_id}")
-
-                    if "DONE: OK" in line or "DONE: ERROR" in line:
-                        status = "success" if "DONE: OK" in line else "failure"
-                        log(f"Render finished with status: {status}")
-                        #break
-                
-                if done_received and job_id is not None:
-                    log(f"done_received=True, job_id={job_id}")
-                    
-            if job_id is not None:
+
+                if kind == b"L":
+                    for line in payload.decode(errors="ignore").splitlines():
+                        line = line.strip()
+                        if "Fra:" in line or "Rendering" in line:
+                            log(f"[Blender] {line[:100]}")
+                        elif line:
+                            log(f"[Server] {line}")
+                    continue
+                if kind != b"J":
+                    continue
+
+                message = json.loads(payload)
+                event = message.get("event")
+                emit(event, message)
+                if event == "have":
+                    # The server already stores this exact file.
+                    log("Server already has this blend file, skipping upload. Waiting for response...")
+                elif event == "send":
+                    # socket.sendfile hands the copy to the kernel (sendfile(2)) where available
+                    started = time.time()
+                    offset = message.get("offset") or 0
+                    uploading = True
+                    with open(blend_path, "rb") as f:
+                        sent = send_delta(s, f, blend_path, file_size, log) if message.get("delta_base") else None
+                        if sent is None and "resume-upload" in capabilities:
+                            if offset:
+                                log(f"Resuming upload at {offset / 1e6:.1f} MB")
+                            send_chunks(s, f, offset, file_size, log, progress)
+                        elif sent is None:
+                            s.sendall(FRAME_HEADER.pack(b"D", file_size))
+                            send_range(s, f, 0, file_size, progress)
+                    elapsed = max(time.time() - started, 1e-6)
+                    sent = file_size - offset if sent is None else sent
+                    trace_span(spans, "upload", started, time.time(), bytes=sent, offset=offset)
+                    waiting = time.time()
+                    log(f"Blend file sent ({sent / 1e6:.1f} MB, {sent / 1e6 / elapsed:.1f} MB/s). Waiting for response...")
+                elif event == "upload":
+                    uploading = False
+                    log(f"[Server] Upload received: {message.get('message')}")
+                elif event == "job":
+                    job_id = control["job_id"] = message.get("job_id")
+                    log(f"[Job] Server job ID: {job_id}")
+                    if control.get("cancelled"):
+                        # Cancelled while the upload was finishing; now there is a job to cancel.
+                        cancel_render_job(control, config, log)
+                elif event == "file":
+                    # Frames are streamed as soon as Blender saves them.
+                    kind, size = FRAME_HEADER.unpack(recv_exact(s, FRAME_HEADER.size))
+                    if kind != b"D":
+                        raise ConnectionError(f"Expected file data, got a {kind!r} frame.")
+                    output_folder = os.path.join(RENDER_OUTPUT_DIR, job_id or os.path.splitext(blend_name)[0])
+                    os.makedirs(output_folder, exist_ok=True)
+                    name = os.path.basename(message["name"])
+                    received = time.time()
+                    recv_file(s, os.path.join(output_folder, name), size)
+                    trace_span(spans, f"receive {name}", received, time.time(), bytes=size)
+                    files_received += 1
+                    log(f"[Output] {name} ({size / 1e6:.2f} MB)")
+                elif event == "queued":
+                    position = message.get("position")
+                    log(f"[Queue] Current position: {position}" if position else "[Queue] Job added to the queue.")
+                elif event == "progress":
+                    log(f"[Progress] {format_progress(message)}")
+                elif event == "processing":
+                    log("[Status] Your job is now rendering.")
+                elif event == "cached":
+                    if message.get("complete"):
+                        log("[Cache] All outputs reused from earlier renders.")
+                    else:
+                        log(f"[Cache] {message.get('frames')} of {message.get('total')} frame(s) reused from earlier renders.")
+                elif event == "resumed":
+                    log(f"[Resume] {message.get('frames')} of {message.get('total')} frame(s) already rendered.")
+                elif event == "retry":
+                    log(f"[Retry] {format_retry(message)}")
+                elif event == "skipped":
+                    log(f"[Skipped] {message.get('message')}")
+                elif event == "addons":
+                    if message.get("want") == "manifest":
+                        send_message(s, type="addon_manifest", files=addons[0])
+                    elif message.get("want") == "files":
+                        sent_at = time.time()
+                        send_addon_files(s, message.get("files", []), addons[1], log)
+                        trace_span(spans, "send add-ons", sent_at, time.time(), files=len(message.get("files", [])))
+                    else:
+                        log(f"[Add-ons] {message.get('files')} file(s) ready on the server")
+                elif event == "blender":
+                    log(f"[Status] Rendering with Blender {message.get('version')} (requested {message.get('requested')})")
+                elif event == "regions":
+                    log(f"[Status] Rendering {message.get('width')}x{message.get('height')} as {message.get('count')} regions")
+                elif event == "worker":
+                    log(f"[Status] Reusing a warm Blender process (saved ~{message.get('startup_saved', 0):.2f}s startup)")
+                elif event == "error":
+                    uploading = False
+                    log(f"[Server] Error: {message.get('message')}")
+                elif event == "detached":
+                    job_id, ok, detached = message.get("job_id"), True, True
+                    log(f"[Job] Detached from job {job_id}. Follow it with --attach {job_id}, download it with --fetch {job_id}.")
+                    break
+                elif event == "done":
+                    trace_span(spans, "wait for server", waiting, time.time())
+                    job_id = message.get("job_id")
+                    ok = bool(message.get("ok"))
+                    log(format_finished(ok, job_id, message))
+                    break
+
+            if detached:
+                return job_id
+            if job_id is not None and ok:
                 output_folder = os.path.join(RENDER_OUTPUT_DIR, job_id)
-                log(f"Render job {job_id} complete. Attempting to fetch results...")
-                auto_download(SERVER_HOST, job_id, output_folder, log)
+                if "stream-frames" in capabilities:
+                    log(f"Render job {job_id} complete. {files_received} file(s) saved to {output_folder}")
+                else:
+                    log(f"Render job {job_id} complete. Attempting to fetch results...")
+                    auto_download(SERVER_HOST, job_id, output_folder, log)
                 return job_id
             else:
-                log(f"No job ID received. Cannot download results. (value:{job_id})")
+                log(f"Render did not complete. (job_id:{job_id})")
                 return None
 
+    except (ConnectionError, OSError) as e:
+        log(f"Connection error: {e}")
+        return _UPLOAD_INTERRUPTED if uploading else None
+    except Exception as e:
+        log(f"Connection error: {e}")
+        return None
+    finally:
+        control["socket"] = None
+
+def cancel_render_job(control, config=None, log=default_log):
+    """
+    Cancel a send_render_job(control=control) running in another thread. Once
+    the server has assigned a job id it is asked to stop the job (CANCEL);
+    before that the upload is cut off, which fails the job on the server.
+
+    Returns True if the job was cancelled or its upload cut off.
+    """
+    control["cancelled"] = True
+    job_id = control.get("job_id")
+    if job_id is None:
+        s = control.get("socket")
+        if s is None:
+            return False
+        try:
+            # Only the sending side: a "job" event already on its way still
+            # arrives, and send_render_job cancels that job then.
+            s.shutdown(socket.SHUT_WR)
+        except OSError:
+            return False
+        log("Upload cancelled.")
+        return True
+
+    config = ensure_config(config, log)
+    try:
+        s, _ = open_connection(config)
+        with s:
+            send_message(s, type="command", name="CANCEL", args=job_id)
+            message = recv_message(s)
+    except Exception as e:
+        log(f"Connection error: {e}")
+        return False
+    if message.get("event") == "cancelled":
+        log(f"[Server] Job {job_id} cancelled.")
+        return True
+    log(f"[Server] {message.get('message', message)}")
+    return False
+
+def attach_job(job_id, offset=0, config=None, log=default_log, events=None, fetch=True):
+    """
+    Follow a running or finished job (ATTACH): replay its server-side event
+    feed from `offset`, then stream it until the job ends. A dropped
+    connection is reattached from the last event received. When the job
+    succeeded and `fetch` is set, its outputs are downloaded with fetch_results.
+
+    Returns the job_id if the job finished successfully, None otherwise.
+    """
+    config = ensure_config(config, log)
+    emit = events or (lambda event, fields: None)
+    ok = None
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if attempt:
+            log(f"Connection lost, reattaching at event {offset} (attempt {attempt + 1} of {UPLOAD_RETRIES + 1})...")
+            time.sleep(min(2 ** attempt, 30))
+        try:
+            s, _ = open_connection(config)
+            with s:
+                send_message(s, type="command", name="ATTACH", args=f"{job_id} {offset}")
+                while ok is None:
+                    kind, payload = recv_frame(s)
+                    if kind is None:
+                        break
+                    if kind != b"J":
+                        continue
+                    message = json.loads(payload)
+                    event = message.get("event")
+                    if "seq" in message:
+                        offset = message["seq"] + 1
+                    emit(event, message)
+                    if event == "attached":
+                        offset = message["offset"]
+                        if message.get("missed"):
+                            log(f"[Server] {message['missed']} earlier event(s) are no longer buffered; --log {job_id} has the full log.")
+                        log(f"[Job] Attached to {job_id} ({message.get('state')}).")
+                    elif event == "log":
+                        for line in message.get("line", "").splitlines():
+                            if line.strip():
+                                log(f"[Server] {line.strip()}")
+                    elif event == "queued":
+                        position = message.get("position")
+                        log(f"[Queue] Current position: {position}" if position else "[Queue] Job is queued.")
+                    elif event == "progress":
+                        log(f"[Progress] {format_progress(message)}")
+                    elif event == "processing":
+                        log("[Status] Job is now rendering.")
+                    elif event == "resumed":
+                        log(f"[Resume] {message.get('frames')} of {message.get('total')} frame(s) already rendered.")
+                    elif event == "retry":
+                        log(f"[Retry] {format_retry(message)}")
+                    elif event == "skipped":
+                        log(f"[Skipped] {message.get('message')}")
+                    elif event == "error":
+                        log(f"[Server] Error: {message.get('message')}")
+                        if "seq" not in message:
+                            return None
+                    elif event == "done":
+                        ok = bool(message.get("ok"))
+                        log(format_finished(ok, job_id, message))
+        except (ConnectionError, OSError) as e:
+            log(f"Connection error: {e}")
+            continue
+        if ok is not None:
+            break
+    if not ok:
+        if ok is None:
+            log(f"Giving up. Reattach later with --attach {job_id} --offset {offset}.")
+        return None
+    if fetch and fetch_results(job_id, config, log) is None:
+        return None
+    return job_id
+
+def fetch_results(job_id, config=None, log=default_log):
+    """
+    Download a finished job's outputs (FETCH) into <render_output_dir>/<job_id>/.
+    Returns the list of saved paths, None on error.
+    """
+    config = ensure_config(config, log)
+    output_folder = os.path.join(os.path.abspath(os.path.expanduser(config["render_output_dir"])), job_id)
+    paths = []
+    try:
+        s, _ = open_connection(config)
+        with s:
+            send_message(s, type="command", name="FETCH", args=job_id)
+            while True:
+                message = recv_message(s)
+                event = message.get("event")
+                if event == "end":
+                    break
+                if event != "file":
+                    log(f"Server error: {message.get('message')}")
+                    return None
+                kind, size = FRAME_HEADER.unpack(recv_exact(s, FRAME_HEADER.size))
+                if kind != b"D":
+                    raise ConnectionError(f"Expected file data, got a {kind!r} frame.")
+                os.makedirs(output_folder, exist_ok=True)
+                path = os.path.join(output_folder, os.path.basename(message["name"]))
+                recv_file(s, path, size)
+                paths.append(path)
+                log(f"[Output] {os.path.basename(path)} ({size / 1e6:.2f} MB)")
+    except Exception as e:
+        log(f"Connection error: {e}")
+        return None
+    log(f"{len(paths)} file(s) saved to {output_folder}")
+    return paths
+
+def query_jobs(job_id=None, config=None, log=default_log):
+    """
+    Ask the server for one job's status (JOB_STATUS) or for all jobs (JOBS).
+
+    Returns the status dict (or list of dicts), None on error.
+    """
+    config = ensure_config(config, log)
+    try:
+        s, _ = open_connection(config)
+        with s:
+            send_message(s, type="command", name="JOB_STATUS" if job_id else "JOBS", args=job_id or "")
+            message = recv_message(s)
+    except Exception as e:
+        log(f"Connection error: {e}")
+        return None
+
+    if message.get("event") == "job_status":
+        return message["job"]
+    if message.get("event") == "jobs":
+        return message["jobs"]
+    log(f"[Server] {message.get('message', message)}")
+    return None
+
+def fetch_log(job_id, config=None, log=default_log):
+    """Download a job's full Blender log (LOG command). Returns its text, None on error."""
+    data = fetch_job_file("LOG", job_id, config, log)
+    return data.decode(errors="replace") if data is not None else None
+
+def fetch_trace(job_id, config=None, log=default_log):
+    """Download a job's server-side Chrome trace (TRACE command). Returns the dict, None on error."""
+    data = fetch_job_file("TRACE", job_id, config, log)
+    return json.loads(data) if data is not None else None
+
+def save_trace(job_id, spans, clock, config, log=default_log):
+    server_trace = fetch_trace(job_id, config, log)
+    if server_trace is None:
+        return None
+    path = os.path.join(os.path.abspath(os.path.expanduser(config["render_output_dir"])), job_id, "trace.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(merge_trace(server_trace, spans, clock), f)
+    log(f"Trace saved to {path} (open in ui.perfetto.dev or chrome://tracing)")
+    return path
+
+def fetch_job_file(command, job_id, config=None, log=default_log):
+    """Run a command that answers with one file (LOG, TRACE). Returns its bytes, None on error."""
+    config = ensure_config(config, log)
+    try:
+        s, _ = open_connection(config)
+        with s:
+            send_message(s, type="command", name=command, args=job_id)
+            message = recv_message(s)
+            if message.get("event") != "file":
+                log(f"Server error: {message.get('message')}")
+                return None
+            kind, payload = recv_frame(s)
+            if kind != b"D":
+                raise ConnectionError(f"Expected file data, got a {kind!r} frame.")
+            return payload
     except Exception as e:
         log(f"Connection error: {e}")
         return None
@@ -1,5 +1,4 @@
-import socket
-import threading
+import asyncio
 import os
 import datetime
 import subprocess
@@ -7,20 +6,253 @@ import time
 import shutil
 import signal
 import sys
-import queue
 import uuid
+import json
+import argparse
+import resource
+import socket
+import hashlib
+import fcntl
+import errno
+import re
+import struct
+import zlib
+import bisect
+import tempfile
+import sqlite3
+import threading
+from collections import OrderedDict, deque
 
 # === CONFIGURATION ===
 HOST = "0.0.0.0"
 PORT = 5555
 RENDER_ROOT = os.path.expanduser("~/render_jobs")
-BLENDER_DOWNLOAD_URL = "https://ftp.nluug.nl/pub/graphics/blender/release/Blender4.0/blender-4.0.2-linux-x64.tar.xz"
+# Blender installs are cached side by side in BLENDER_INSTANCE_DIR/<version> and
+# kept across restarts. Release tarballs are checked against the sha256 list
+# published next to them; jobs may ask for a version with the `blender` option.
+BLENDER_MIRROR = "https://ftp.nluug.nl/pub/graphics/blender/release"
+BLENDER_VERSIONS = ["4.0.2"]
+BLENDER_ARCHIVES = []
 BLENDER_INSTANCE_DIR = os.path.abspath("BlenderServerInstance")
-BLENDER_PATH = os.path.join(BLENDER_INSTANCE_DIR, "blender")
-MAX_CONCURRENT_JOBS = 2
-job_queue = queue.Queue()
+BLENDER_INSTALL_MARKER = "install.json"
+BLENDER_PATH = os.path.join(BLENDER_INSTANCE_DIR, BLENDER_VERSIONS[0], "blender")
+# 0 sizes the slot count from the detected cores and memory at startup.
+MAX_CONCURRENT_JOBS = 0
+# Each render slot gets its own set of cores (CPU affinity plus a matching Blender
+# thread count) and is only admitted while its expected peak memory fits. Cores
+# are divided among the jobs running or waiting at dispatch time, so the layout
+# follows the job mix; animation chunks pick up the new layout at every chunk.
+PIN_CPUS = True
+SLOT_MIN_CPUS = 4
+MEMORY_RESERVE_MB = 2048
+DEFAULT_JOB_MEMORY_MB = 2048
+MEMORY_HEADROOM = 1.2
+# Animations are split into frame-range chunks so one job can use every free slot.
+# Chunks are sized from the measured per-frame time so Blender startup stays a
+# small share of each chunk's wall time.
+CHUNK_INITIAL_FRAMES = 2
+CHUNK_MAX_FRAMES = 100
+CHUNK_MAX_STARTUP_SHARE = 0.1
+# Frames are checkpointed as Blender saves them, so a job that is restarted or
+# resubmitted only renders the frames without a valid file (non-empty, and with
+# the format's leading and trailing signature where it has one). A frame whose
+# chunk failed before saving it is retried on its own up to FRAME_RETRIES times;
+# after that the rest of the animation carries on without it.
+FRAME_RETRIES = 2
+FRAME_SIGNATURES = {
+    "PNG": (b"\x89PNG\r\n\x1a\n", b"IEND\xaeB`\x82"),
+    "JPEG": (b"\xff\xd8", b"\xff\xd9"),
+    "OPEN_EXR": (b"v/1\x01", b""),
+    "OPEN_EXR_MULTILAYER": (b"v/1\x01", b""),
+}
+# A still with the `regions=N|auto` option is rendered as N horizontal border
+# regions, each on its own render slot, then stitched into one image by a
+# Blender worker with numpy. `auto` takes one region per free slot (plus the
+# job's own), and no region smaller than REGION_MIN_PIXELS. Regions are rendered
+# in a lossless format (REGION_FORMATS: output format -> region format); formats
+# missing there, such as FFMPEG, are refused.
+REGION_MAX = 16
+REGION_MIN_PIXELS = 256 * 256
+REGION_FORMATS = {"PNG": "PNG", "JPEG": "PNG", "TIFF": "TIFF", "OPEN_EXR": "OPEN_EXR"}
+FORMAT_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "TIFF": ".tif", "OPEN_EXR": ".exr"}
+# Per-connection read buffer. Headers and messages are small; uploads bypass it.
+STREAM_LIMIT = 16 * 1024
+# Uploads are received with recv_into straight into a preallocated buffer that is
+# written to disk each time it fills up.
+UPLOAD_BUFFER_SIZE = 4 * 1024 * 1024
+# SO_RCVBUF/SO_SNDBUF for client sockets. Linux autotunes buffers unless one is
+# set explicitly, so 0 leaves that in place; raise net.core.rmem_max/wmem_max
+# before setting a large value.
+SOCKET_BUFFER_SIZE = 0
+# Uploaded .blend files are kept in a content-addressed store under
+# RENDER_ROOT/blobs so clients can skip re-uploading unchanged files. Least
+# recently used blobs are evicted once the store grows past this size.
+BLOB_STORE_BUDGET = 50 * 1024**3
+# v2 clients upload in CRC-checked chunks that land in RENDER_ROOT/uploads,
+# keyed by content hash and the client's upload id, so a dropped upload resumes
+# where it stopped. Partial uploads untouched for this long are deleted.
+UPLOAD_PARTIAL_TTL = 24 * 3600
+UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Clients with the delta-upload capability get block signatures (Adler-32 and a
+# 16-byte BLAKE2b per block) of the last stored upload with the same file name
+# (or `project=` option) and send only what changed: a DATA frame of DELTA_OP
+# records, b"C" (copy `count` blocks from block `first`) or b"L" (`length`
+# literal bytes follow).
+BLOB_NAMES_FILE = "blob_names.json"
+DELTA_BLOCK_SIZE = 32 * 1024
+DELTA_SIGNATURE = struct.Struct(">I16s")
+DELTA_OP = struct.Struct(">cQQ")
+# Add-ons travel over the job connection: the job names a manifest of the
+# client's add-on files by hash, and only files missing from the store under
+# RENDER_ROOT/addons are sent. Each manifest is built once into a scripts
+# directory that Blender gets as BLENDER_USER_SCRIPTS, with its add-ons enabled.
+ADDON_STORE_DIR = "addons"
+ADDON_MAX_FILE_SIZE = 256 * 1024 * 1024
+# Finished outputs are cached by blend content, render parameters and Blender
+# version (per frame for image sequences), so resubmissions skip Blender.
+RESULT_CACHE_FILE = "result_cache.json"
+FRAME_FILE_RE = re.compile(r"^frame_(\d+)\.[A-Za-z0-9]+$")
+FRAME_PROGRESS_RE = re.compile(r"^Fra:(\d+)\b")
+SAVED_RE = re.compile(r"^Saved: '(.+)'")
+# Blender's output is parsed into `progress` events (frame, samples, memory
+# peak, elapsed/remaining time, saved path). Clients with the `progress`
+# capability get those, coalesced to one per PROGRESS_INTERVAL seconds, instead
+# of every status line; others keep getting the raw lines. The raw output of
+# each job is kept in JOB_LOG_NAME in its job dir (@LOG <job_id>).
+PROGRESS_INTERVAL = 0.5
+JOB_LOG_NAME = "render.log"
+# Each job's events and client-bound output also go to a feed holding its last
+# JOB_FEED_LIMIT entries, numbered from 0. A `detach=1` job releases its
+# connection once queued; @ATTACH <job_id> <offset> replays the feed from
+# `offset` and follows it until the job ends. Attached clients with more than
+# ATTACH_MAX_BUFFER bytes unsent are dropped (they can attach again).
+JOB_FEED_LIMIT = 2000
+ATTACH_MAX_BUFFER = 4 * 1024 * 1024
+PEAK_MEMORY_RE = re.compile(r"\(Peak ([\d.]+)M\)|Peak:? ?([\d.]+)M")
+ELAPSED_RE = re.compile(r"\| Time:([\d:.]+)")
+REMAINING_RE = re.compile(r"\| Remaining:([\d:.]+)")
+SAMPLES_RE = re.compile(r"\| Sample (\d+)/(\d+)")
+APPEND_FRAME_RE = re.compile(r"^Append frame (\d+)")
+# Every job records a timeline of spans (handshake, upload, queue wait, then per
+# render call: launch, scene load and each frame, inferred from Blender output)
+# as Chrome trace events, written to JOB_TRACE_NAME in its job dir once it ends
+# (@TRACE <job_id>). Timestamps are wall-clock microseconds so clients can merge
+# their own spans using the clock in the v2 hello.
+JOB_TRACE_NAME = "trace.json"
+TRACE_SERVER_PID = 1
+TRACE_JOB_TID, TRACE_OUTPUT_TID = 0, 1
+# Render slots go to waiting jobs by header priority first, then to the client
+# (client= option, else IP) holding the fewest slots and with the least recent
+# usage, then in arrival order. Usage decays with this half-life in seconds.
+FAIR_SHARE_HALF_LIFE = 600
+# Optionally prefer the job expected to finish first (per-frame timings of
+# earlier renders of the same blend); unknown animation lengths count as this many frames.
+SHORTEST_JOB_FIRST = False
+SJF_DEFAULT_FRAMES = 250
+# Finished jobs kept in the registry for @JOB_STATUS / @JOBS.
+JOB_HISTORY_LIMIT = 1000
+# Job parameters and state changes are journaled to JOURNAL_FILE (SQLite) in
+# RENDER_ROOT, written in batches every JOURNAL_FLUSH_INTERVAL seconds off the
+# event loop. On startup queued and interrupted jobs whose .blend is still on
+# disk are queued again without a client (@ATTACH / @FETCH them).
+JOURNAL_FILE = "journal.sqlite"
+JOURNAL_FLUSH_INTERVAL = 0.2
+JOB_TRANSITIONS = {
+    "uploading": {"queued", "done", "failed", "cancelled"},
+    "queued": {"rendering", "failed", "cancelled"},
+    "rendering": {"done", "failed", "cancelled"},
+    "done": set(),
+    "failed": set(),
+    "cancelled": set(),
+}
+# Renders run in long-lived Blender processes driven by blender_driver.py, so
+# each job skips Blender startup. A worker is replaced after WORKER_MAX_JOBS
+# jobs or once its resident memory passes WORKER_MAX_RSS_MB.
+WARM_WORKERS = True
+WORKER_MAX_JOBS = 50
+WORKER_MAX_RSS_MB = 8192
+DRIVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_driver.py")
+DRIVER_PREFIX = "@DRIVER "
+# Protocol v2: V2_MAGIC and a version byte, then frames of one kind byte and
+# an 8-byte big-endian length. JSON frames carry messages, LOG frames Blender
+# output and DATA frames file contents. v1 (newline text) stays supported.
+V2_MAGIC = b"\x00RRP"
+PROTOCOL_VERSION = 2
+FRAME_HEADER = struct.Struct(">cQ")
+FRAME_JSON, FRAME_LOG, FRAME_DATA = b"J", b"L", b"D"
+MAX_MESSAGE_SIZE = 1 << 20
+SERVER_CAPABILITIES = ["blob-store", "result-cache", "job-status", "fetch", "stream-frames", "resume-upload",
+                       "delta-upload", "progress", "trace", "addon-sync", "detach",
+                       "regions"]
+LISTEN_BACKLOG = 4096
+# Optional Prometheus endpoint (`--metrics-port`, 0 = off) serving /metrics in
+# the text exposition format. Instrumentation is a dict update per event; the
+# disk usage of RENDER_ROOT is measured at most every DISK_USAGE_INTERVAL seconds.
+METRICS_HOST = "0.0.0.0"
+METRICS_PORT = 0
+DISK_USAGE_INTERVAL = 60
+HISTOGRAM_BUCKETS = {
+    "render_upload_seconds": (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900),
+    "render_queue_wait_seconds": (0.1, 1, 5, 15, 60, 300, 900, 3600, 4 * 3600),
+    "render_blender_startup_seconds": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    "render_frame_seconds": (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+    "render_job_seconds": (1, 10, 30, 60, 300, 900, 3600, 4 * 3600, 12 * 3600),
+}
+REGISTER_INTERVAL = 10
 
-active_connections = []
+# Free render slots, the tickets waiting for one and those holding one; see SCHEDULER.
+free_slots = 0
+waiting_tickets = []
+granted_tickets = []
+ticket_seq = 0
+slots_by_client = {}
+# client -> (decayed slot-seconds, when they were last updated)
+usage_by_client = {}
+# sha256 -> seconds per frame, from earlier renders
+frame_times = {}
+# Cores not pinned to a slot, memory budget and what running slots reserve; see SCHEDULER
+slot_cpus = []
+free_cpus = set()
+memory_budget_mb = 0
+reserved_memory_mb = 0
+# sha256 -> peak memory in MB of one Blender render of it
+memory_peaks = {}
+# job_id -> registry record, oldest first
+jobs = OrderedDict()
+running_jobs = set()
+# job_id -> the task running process_render_job, for @CANCEL
+job_tasks = {}
+# job_id -> (state, record json, params json or None) not yet written; None deletes. See JOB JOURNAL
+journal_pending = {}
+journal_db = None
+journal_lock = threading.Lock()
+active_connections = set()
+active_processes = set()
+upload_buffers = []
+# sha256 -> size, least recently used first
+blob_index = OrderedDict()
+blob_store_usage = 0
+# file name or project -> sha256 of its latest upload, base for delta uploads
+blob_names = {}
+# (sha256, upload_id) -> partial upload state, see RESUMABLE UPLOADS
+partial_uploads = {}
+# {"frames": {key: {frame: "job_id/file"}}, "jobs": {key: job_id}, "probes": {sha256: [start, end, step]},
+#  "resolutions": {sha256: [width, height]}}
+result_cache = {"frames": {}, "jobs": {}, "probes": {}, "resolutions": {}}
+BLENDER_VERSION = "unknown"
+# version -> Blender executable, see INSTALL BLENDER
+blender_installs = {}
+idle_workers = []
+worker_stats = {"started": 0, "reused": 0, "recycled": 0, "startup_saved": 0.0, "busy": 0}
+# (name, labels) -> value, and name -> [bucket counts, sum, count]; see METRICS
+counters = {}
+histograms = {}
+# job_id -> {"events": [...], "threads": {tid: name}}, see TRACING
+job_traces = OrderedDict()
+# job_id -> {"entries": deque of (seq, event, fields), "next": seq, "watchers": {channel: future}, ...}, see JOB FEEDS
+job_feeds = {}
+# (measured at, bytes) for RENDER_ROOT
+disk_usage = (0.0, 0)
 shutdown_requested = False
 
 # === LOG UTILS ===
@@ -31,222 +263,2944 @@ def error(msg): print(f"\n[{datetime.datetime.now().strftime('%H:%M:%S')}] @ERRO
 def verbose(msg): print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}")
 def shutdown_log(msg): print(f"@SHUTDOWN: {msg}")
 
-# === INSTALL BLENDER LOCALLY ===
-def install_blender():
-    step("Installing Blender to local server instance")
-    if os.path.exists(BLENDER_INSTANCE_DIR):
-        shutil.rmtree(BLENDER_INSTANCE_DIR)
-    os.makedirs(BLENDER_INSTANCE_DIR, exist_ok=True)
+# === INSTALL BLENDER ===
+def blender_archive_url(version):
+    major, minor = version.split(".")[:2]
+    return f"{BLENDER_MIRROR}/Blender{major}.{minor}/blender-{version}-linux-x64.tar.xz"
 
-    archive_path = os.path.join(BLENDER_INSTANCE_DIR, "blender.tar.xz")
-    info("Downloading Blender...")
-    result = subprocess.run([
-        "curl", "-L", "-o", archive_path, BLENDER_DOWNLOAD_URL
-    ], capture_output=True)
-    if result.returncode != 0:
-        error("Failed to download Blender.")
-        exit(1)
+def read_checksum(listing, name):
+    """The sha256 for `name` in a `sha256sum`-style listing, or None."""
+    for line in listing.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip("*") == name:
+            return parts[0].lower()
+    return None
 
-    info("Extracting Blender...")
-    result = subprocess.run([
-        "tar", "-xf", archive_path, "--strip-components=1", "-C", BLENDER_INSTANCE_DIR
-    ], capture_output=True)
+def installed_blenders():
+    """version -> executable for every complete install in the cache whose binary is unchanged."""
+    found = {}
+    try:
+        versions = os.listdir(BLENDER_INSTANCE_DIR)
+    except OSError:
+        return found
+    for version in versions:
+        install_dir = os.path.join(BLENDER_INSTANCE_DIR, version)
+        try:
+            with open(os.path.join(install_dir, BLENDER_INSTALL_MARKER)) as f:
+                marker = json.load(f)
+            st = os.stat(os.path.join(install_dir, "blender"))
+        except (OSError, ValueError):
+            continue
+        if [st.st_size, int(st.st_mtime)] != [marker.get("size"), marker.get("mtime")]:
+            verbose(f"Blender {version} install was modified, ignoring it")
+            continue
+        found[version] = os.path.join(install_dir, "blender")
+    return found
+
+def archive_install(installs, digest):
+    """The cached version (from `installs`) that was extracted from the archive with sha256 `digest`, or None."""
+    for version, path in installs.items():
+        try:
+            with open(os.path.join(os.path.dirname(path), BLENDER_INSTALL_MARKER)) as f:
+                if json.load(f).get("sha256") == digest:
+                    return version
+        except (OSError, ValueError):
+            continue
+    return None
+
+def download_blender(version):
+    """Download a release tarball and its published checksum. Returns (archive path, sha256)."""
+    url = blender_archive_url(version)
+    archive_path = os.path.join(BLENDER_INSTANCE_DIR, os.path.basename(url))
+    info(f"Downloading Blender {version}...")
+    result = subprocess.run(["curl", "-L", "-f", "-o", archive_path, url], capture_output=True)
     if result.returncode != 0:
-        error("Failed to extract Blender.")
-        exit(1)
+        raise RuntimeError(f"Failed to download Blender {version}.")
+    result = subprocess.run(["curl", "-L", "-f", "-s", url.rsplit("/", 1)[0] + f"/blender-{version}.sha256"],
+                            capture_output=True, text=True)
+    expected = read_checksum(result.stdout, os.path.basename(url)) if result.returncode == 0 else None
+    if expected is None:
+        os.remove(archive_path)
+        raise RuntimeError(f"No published checksum for Blender {version}.")
+    return archive_path, expected
+
+def install_blender_archive(archive_path, expected=None, digest=None):
+    """
+    Verify and extract a Blender tarball into the cache. The version is read
+    from the extracted binary. Returns (version, executable).
+    """
+    digest = digest or file_digest(archive_path).hexdigest()
+    if expected and digest != expected:
+        raise RuntimeError(f"Checksum mismatch for {os.path.basename(archive_path)}: expected {expected}, got {digest}")
+
+    # Extract next to the cache and move into place, so a half-extracted tree is never used.
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=BLENDER_INSTANCE_DIR)
+    try:
+        info(f"Extracting {os.path.basename(archive_path)}...")
+        result = subprocess.run(["tar", "-xf", archive_path, "--strip-components=1", "-C", staging], capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to extract {os.path.basename(archive_path)}.")
+        blender_bin = os.path.join(staging, "blender")
+        if not os.path.isfile(blender_bin):
+            raise RuntimeError("Blender binary not found after extraction.")
+        os.chmod(blender_bin, 0o755)
+        version = detect_blender_version(blender_bin)
+        if version == "unknown":
+            raise RuntimeError(f"Could not read the Blender version of {os.path.basename(archive_path)}.")
 
-    blender_bin = os.path.join(BLENDER_INSTANCE_DIR, "blender")
-    if not os.path.isfile(blender_bin):
-        error("Blender binary not found after extraction.")
+        st = os.stat(blender_bin)
+        with open(os.path.join(staging, BLENDER_INSTALL_MARKER), "w") as f:
+            json.dump({"version": version, "archive": os.path.basename(archive_path), "sha256": digest,
+                       "size": st.st_size, "mtime": int(st.st_mtime), "installed_at": time.time()}, f)
+        install_dir = os.path.join(BLENDER_INSTANCE_DIR, version)
+        shutil.rmtree(install_dir, ignore_errors=True)
+        os.rename(staging, install_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return version, os.path.join(install_dir, "blender")
+
+def install_blender(versions, archives=()):
+    """
+    Make sure the install cache holds every version in `versions` (downloading
+    missing ones) and the Blender in each local archive. Returns (version ->
+    executable, default version): the first of `versions`, else of the archives.
+    """
+    step("Preparing Blender installs")
+    os.makedirs(BLENDER_INSTANCE_DIR, exist_ok=True)
+    installs = installed_blenders()
+    default = versions[0] if versions else None
+    try:
+        for archive_path in archives:
+            # A `<archive>.sha256` file next to a local tarball is checked like a download.
+            expected = None
+            if os.path.isfile(archive_path + ".sha256"):
+                with open(archive_path + ".sha256") as f:
+                    expected = read_checksum(f.read(), os.path.basename(archive_path))
+            digest = file_digest(archive_path).hexdigest()
+            version = archive_install(installs, digest) if not expected or digest == expected else None
+            if version is not None:
+                # Already extracted from this exact archive: leave the install in place.
+                info(f"Blender {version}: cached at {os.path.dirname(installs[version])} ({os.path.basename(archive_path)})")
+                default = default or version
+                continue
+            version, path = install_blender_archive(archive_path, expected, digest)
+            installs[version] = path
+            default = default or version
+            success(f"Blender {version} installed from {archive_path}")
+        for version in versions:
+            if version in installs:
+                info(f"Blender {version}: cached at {os.path.dirname(installs[version])}")
+                continue
+            archive_path, expected = download_blender(version)
+            try:
+                installed, path = install_blender_archive(archive_path, expected)
+            finally:
+                os.remove(archive_path)
+            installs[installed] = path
+            success(f"Blender {installed} installed.")
+    except RuntimeError as e:
+        error(str(e))
         exit(1)
-    os.chmod(blender_bin, 0o755)
-    success("Blender installed successfully.")
+    return installs, default
+
+def version_key(version):
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+def resolve_blender(requested):
+    """
+    The installed version a job asking for `requested` renders with: that
+    version, else the closest one (same major.minor first, newer on ties).
+    """
+    if not requested or requested in blender_installs or not blender_installs:
+        return requested if requested in blender_installs else BLENDER_VERSION
+    wanted = (version_key(requested) + (0, 0, 0))[:3]
+
+    def distance(version):
+        have = (version_key(version) + (0, 0, 0))[:3]
+        return tuple(abs(a - b) for a, b in zip(have, wanted)), tuple(-part for part in have)
+    return min(blender_installs, key=distance)
 
 # === CLEANUP ===
 def cleanup():
     shutdown_log("Cleaning up server state...")
     shutdown_log("Closing all active connections.")
-    for conn in active_connections:
+    for channel in list(active_connections):
         try:
-            conn.sendall(b"ERR: Server Stop Requested\n")
-            conn.close()
+            channel.send("error", "ERR: Server Stop Requested\n", message="Server Stop Requested")
+            channel.writer.close()
         except:
             pass
 
-    shutdown_log("Removing BlenderServerInstance folder.")
-    try:
-        shutil.rmtree(BLENDER_INSTANCE_DIR)
-    except Exception as e:
-        shutdown_log(f"Failed to remove Blender instance: {e}")
+    for proc in list(active_processes):
+        try:
+            proc.terminate()
+        except ProcessLookupError:
+            pass
 
+    # Jobs still queued or rendering stay so in the journal and run again on restart.
+    try:
+        flush_journal()
+    except sqlite3.Error as e:
+        shutdown_log(f"Job journal write failed: {e}")
     shutdown_log("Shutdown complete.")
 
 # === HANDLE CTRL+C ===
-def handle_shutdown(signum, frame):
+def handle_shutdown():
     global shutdown_requested
     shutdown_requested = True
     shutdown_log("KeyboardInterrupt received. Shutting down...")
     cleanup()
     os._exit(0)
 
-signal.signal(signal.SIGINT, handle_shutdown)
-signal.signal(signal.SIGTERM, handle_shutdown)
+# === PROTOCOL ===
+async def read_header(reader, prefix=b""):
+    """Read up to the ===END=== marker and return the header lines."""
+    try:
+        data = prefix + await reader.readuntil(b"===END===\n")
+    except asyncio.IncompleteReadError:
+        raise Exception("Client disconnected before sending header.")
+    except asyncio.LimitOverrunError:
+        raise Exception("Header too large.")
+    return data[:-len(b"===END===\n")].decode().strip().split("\n")
+
+def job_header_from_message(message):
+    """The v2 `job` message as the dict parse_job_header returns."""
+    try:
+        return {
+            "blend_name": os.path.basename(str(message["blend_name"])),
+            "render_type": str(message["render_type"]),
+            "file_size": int(message["file_size"]),
+            "output_format": str(message["output_format"]),
+            "options": {str(key): str(value) for key, value in message.get("options", {}).items()},
+        }
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid job message.")
+
+def parse_job_header(header_lines):
+    """
+    Job header: blend name, render type, file size and output format, one per
+    line, optionally followed by `key=value` option lines.
+    """
+    if len(header_lines) < 4:
+        raise ValueError("Invalid header format.")
+    options = {}
+    for line in header_lines[4:]:
+        key, sep, value = line.partition("=")
+        if sep:
+            options[key.strip()] = value.strip()
+    return {
+        "blend_name": os.path.basename(header_lines[0]),
+        "render_type": header_lines[1],
+        "file_size": int(header_lines[2]),
+        "output_format": header_lines[3].upper(),
+        "options": options,
+    }
+
+def parse_frame_range(value):
+    """Parse a `frames=START-END[:STEP]` option."""
+    frames, _, step = value.partition(":")
+    start, _, end = frames.partition("-")
+    return int(start), int(end or start), int(step or 1)
+
+def node_status():
+    return {
+        "queue_depth": sum(1 for ticket in waiting_tickets if not ticket["chunk"]),
+        "active_jobs": len(running_jobs),
+        "slots": MAX_CONCURRENT_JOBS,
+        "cores": len(slot_cpus) or os.cpu_count() or 1,
+        "blender_versions": sorted(blender_installs, key=version_key),
+        "free_cores": len(free_cpus),
+        "memory_free_mb": round(memory_budget_mb - reserved_memory_mb) if memory_budget_mb else None,
+        "workers": dict(worker_stats, idle=len(idle_workers)),
+    }
+
+# === PROTOCOL ===
+class Channel:
+    """
+    A client connection. Request handling reports events through it: v1
+    clients get the classic text lines, v2 clients typed frames.
+    """
+
+    def __init__(self, reader, writer, version=1, capabilities=()):
+        self.reader = reader
+        self.writer = writer
+        self.version = version
+        self.capabilities = set(capabilities)
+        self.opened_at = time.time()
+        # Held while a file goes out with sendfile, which can't share the transport.
+        self.lock = asyncio.Lock()
+
+    def send(self, event, text=None, **fields):
+        """Queue an event. `text` is its v1 form; v1 clients don't see events without one."""
+        if self.version == 1:
+            if text:
+                self.writer.write(text.encode())
+        else:
+            self.write_frame(FRAME_JSON, json.dumps(dict(fields, event=event)).encode())
+
+    def log(self, data):
+        if self.version == 1:
+            self.writer.write(data)
+        else:
+            self.write_frame(FRAME_LOG, data)
+
+    def write_frame(self, kind, payload):
+        self.writer.write(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+    def start_data(self, size):
+        """Announce `size` raw bytes that the caller writes to the transport next."""
+        if self.version != 1:
+            self.writer.write(FRAME_HEADER.pack(FRAME_DATA, size))
+
+    async def read_frame_header(self, expected):
+        kind, length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        if kind != expected:
+            raise ValueError(f"Expected a {expected.decode()} frame, got {kind!r}")
+        return length
+
+    async def read_message(self):
+        length = await self.read_frame_header(FRAME_JSON)
+        if length > MAX_MESSAGE_SIZE:
+            raise ValueError("Message too large.")
+        return json.loads(await self.reader.readexactly(length))
+
+async def open_channel(reader, writer, capabilities=SERVER_CAPABILITIES):
+    """
+    Detect the client's protocol from its first byte. Returns the channel and
+    its request: v1 header lines, or the v2 message that follows the handshake.
+    `capabilities` are the ones this end offers in the hello.
+    """
+    try:
+        first = await reader.readexactly(1)
+    except asyncio.IncompleteReadError:
+        raise Exception("Client disconnected before sending header.")
+    if first != V2_MAGIC[:1]:
+        return Channel(reader, writer), await read_header(reader, first)
+
+    preamble = first + await reader.readexactly(len(V2_MAGIC))
+    channel = Channel(reader, writer, version=preamble[-1])
+    if preamble[:-1] != V2_MAGIC or channel.version != PROTOCOL_VERSION:
+        channel.version = PROTOCOL_VERSION
+        channel.send("error", message=f"Unsupported protocol version {preamble[-1]}", version=PROTOCOL_VERSION)
+        raise Exception("Unsupported protocol version.")
+    hello = await channel.read_message()
+    if hello.get("type") != "hello":
+        raise Exception("Expected hello message.")
+    channel.capabilities = set(hello.get("capabilities", [])) & set(capabilities)
+    # `time` lets the client estimate its clock offset for merging traces.
+    channel.send("hello", version=PROTOCOL_VERSION, capabilities=sorted(channel.capabilities), time=time.time())
+    return channel, await channel.read_message()
+
+class UploadProtocol(asyncio.BufferedProtocol):
+    """
+    Temporarily replaces a connection's stream protocol while an upload is
+    received. The transport reads straight into `buffer` (recv_into), which is
+    written out in one call whenever it fills up. Connection events are passed
+    through to the stream protocol so the StreamReader/Writer stay consistent.
+    """
+
+    def __init__(self, transport, stream_protocol, f, size, buffer, hasher=None):
+        self.transport = transport
+        self.stream_protocol = stream_protocol
+        self.f = f
+        self.hasher = hasher
+        self.remaining = size
+        self.received = 0
+        self.buffer = buffer
+        self.filled = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+    def get_buffer(self, sizehint):
+        # Never read past the upload: whatever follows belongs to the stream protocol.
+        return self.buffer[self.filled:min(len(self.buffer), self.filled + self.remaining)]
+
+    def buffer_updated(self, nbytes):
+        self.filled += nbytes
+        self.remaining -= nbytes
+        self.received += nbytes
+        if self.filled == len(self.buffer) or self.remaining == 0:
+            self.flush()
+        if self.remaining == 0:
+            self.transport.pause_reading()
+            self.finish()
+
+    def flush(self):
+        if self.filled:
+            self.f.write(self.buffer[:self.filled])
+            if self.hasher is not None:
+                self.hasher.update(self.buffer[:self.filled])
+            self.filled = 0
+
+    def finish(self, exc=None):
+        if self.done.done():
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            exc = exc or e
+        if exc is not None:
+            self.done.set_exception(exc)
+        else:
+            self.done.set_result(self.received)
+
+    def eof_received(self):
+        self.finish()
+        return self.stream_protocol.eof_received()
+
+    def connection_lost(self, exc):
+        self.finish()
+        self.stream_protocol.connection_lost(exc)
+
+    def pause_writing(self):
+        self.stream_protocol.pause_writing()
+
+    def resume_writing(self):
+        self.stream_protocol.resume_writing()
+
+def take_buffered(reader, limit):
+    """
+    Take up to `limit` bytes the StreamReader has already buffered past the
+    header. StreamReader has no public non-blocking read, so this reaches into
+    its buffer; the transport must be paused first. Returns None if those
+    internals aren't there (another Python version), see copy_stream.
+    """
+    if not isinstance(getattr(reader, "_buffer", None), bytearray) or not hasattr(reader, "_paused"):
+        return None
+    data = bytes(reader._buffer[:limit])
+    del reader._buffer[:len(data)]
+    # The transport is resumed explicitly once the upload is done.
+    reader._paused = False
+    return data
+
+async def copy_stream(reader, f, size, hasher=None):
+    """Copy `size` bytes (fewer at EOF) from the stream to `f` through StreamReader's public API. Returns bytes copied."""
+    copied = 0
+    while copied < size:
+        data = await reader.read(min(size - copied, UPLOAD_BUFFER_SIZE))
+        if not data:
+            break
+        f.write(data)
+        if hasher is not None:
+            hasher.update(data)
+        copied += len(data)
+    return copied
+
+async def receive_file(reader, writer, path, file_size, hasher=None, mode="wb"):
+    """Write `file_size` bytes of upload to `path`, feeding `hasher` if given. Returns bytes received."""
+    transport = writer.transport
+    transport.pause_reading()
+    buffer = upload_buffers.pop() if upload_buffers else memoryview(bytearray(UPLOAD_BUFFER_SIZE))
+    try:
+        with open(path, mode) as f:
+            data = take_buffered(reader, file_size)
+            if data is None:
+                transport.resume_reading()
+                return await copy_stream(reader, f, file_size, hasher)
+            f.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            received = len(data)
+            if received < file_size and not reader.at_eof() and not transport.is_closing():
+                stream_protocol = transport.get_protocol()
+                upload = UploadProtocol(transport, stream_protocol, f, file_size - received, buffer, hasher)
+                transport.set_protocol(upload)
+                transport.resume_reading()
+                try:
+                    received += await upload.done
+                finally:
+                    upload.finish()
+                    transport.set_protocol(stream_protocol)
+    finally:
+        upload_buffers.append(buffer)
+        if not transport.is_closing():
+            transport.resume_reading()
+    return received
+
+# === BLOB STORE ===
+def blob_path(digest):
+    return os.path.join(RENDER_ROOT, "blobs", digest[:2], digest)
+
+def valid_digest(digest):
+    return bool(digest) and re.fullmatch(r"[0-9a-f]{64}", digest) is not None
+
+def load_blob_store():
+    """Index the blobs already on disk, oldest use first."""
+    global blob_store_usage
+    entries = []
+    root = os.path.join(RENDER_ROOT, "blobs")
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            st = os.stat(os.path.join(dirpath, name))
+            if valid_digest(name):
+                entries.append((st.st_mtime, name, st.st_size))
+    blob_index.clear()
+    for _, digest, size in sorted(entries):
+        blob_index[digest] = size
+    blob_store_usage = sum(blob_index.values())
+    load_blob_names()
+    return len(blob_index)
+
+def load_blob_names():
+    global blob_names
+    try:
+        with open(os.path.join(RENDER_ROOT, BLOB_NAMES_FILE)) as f:
+            blob_names = {name: digest for name, digest in json.load(f).items() if digest in blob_index}
+    except (OSError, ValueError, AttributeError):
+        blob_names = {}
+
+def remember_blob_name(header, digest):
+    name = header["options"].get("project") or header["blend_name"]
+    if blob_names.get(name) == digest:
+        return
+    blob_names[name] = digest
+    path = os.path.join(RENDER_ROOT, BLOB_NAMES_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(blob_names, f)
+    os.replace(path + ".tmp", path)
+
+def lookup_blob(digest, size):
+    """Return the stored path for `digest` and mark it recently used, or None."""
+    if blob_index.get(digest) != size:
+        return None
+    path = blob_path(digest)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        forget_blob(digest)
+        return None
+    blob_index.move_to_end(digest)
+    return path
+
+def forget_blob(digest):
+    global blob_store_usage
+    blob_store_usage -= blob_index.pop(digest, 0)
+
+def add_blob(digest, path):
+    """Add an uploaded file to the store by linking it, then enforce the size budget."""
+    global blob_store_usage
+    if lookup_blob(digest, os.path.getsize(path)):
+        return
+    target = blob_path(digest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+    link_file(path, tmp)
+    os.replace(tmp, target)
+    blob_index[digest] = os.path.getsize(target)
+    blob_store_usage += blob_index[digest]
+    evict_blobs()
+
+def evict_blobs():
+    # Jobs hold their own link to the data, so evicting never breaks a running job.
+    while blob_store_usage > BLOB_STORE_BUDGET and len(blob_index) > 1:
+        digest = next(iter(blob_index))
+        verbose(f"Evicting blob {digest[:12]} from store")
+        try:
+            os.remove(blob_path(digest))
+        except FileNotFoundError:
+            pass
+        forget_blob(digest)
+
+FICLONE = 0x40049409
+
+def link_file(src, dst):
+    """Place `src` at `dst` without copying data where possible: reflink, then hardlink, then copy."""
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EBADF):
+            raise
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def offer_blob(channel, header, blend_path):
+    """
+    Answer a client that sent `sha256=` in its header: `HAVE:` when the store
+    already holds that content (it is linked into the job dir right away so it
+    can't be evicted while queued), otherwise `SEND:`. Returns True on HAVE.
+    """
+    digest = header["options"].get("sha256", "").lower()
+    if not valid_digest(digest):
+        channel.send("send", sha256=None)
+        return False
+    blob = lookup_blob(digest, header["file_size"])
+    if blob is None:
+        offset = 0
+        if resumable(channel, header):
+            offset = partial_upload(digest, header["options"]["upload_id"], header["file_size"])["received"]
+        # A half-finished upload is cheaper to resume than to diff.
+        header["delta_base"] = delta_base(channel, header, digest) if offset == 0 else None
+        channel.send("send", f"SEND: {digest}\n", sha256=digest, offset=offset, delta_base=header["delta_base"])
+        return False
+    link_file(blob, blend_path)
+    remember_blob_name(header, digest)
+    channel.send("have", f"HAVE: {digest}\n", sha256=digest)
+    return True
+
+async def receive_blend(channel, header, blend_path):
+    """Receive an uploaded .blend, check it against the claimed hash and add it to the store."""
+    if header.get("delta_base"):
+        result = await receive_delta(channel, header, blend_path, header["delta_base"])
+        if result is not None:
+            return result
+    if resumable(channel, header):
+        digest, stats = await receive_chunks(channel, header, blend_path)
+        remember_blob_name(header, digest)
+        return digest, stats
+    hasher = hashlib.sha256()
+    started = time.time()
+    if channel.version != 1 and await channel.read_frame_header(FRAME_DATA) != header["file_size"]:
+        raise Exception("Upload size doesn't match the header.")
+    received = await receive_file(channel.reader, channel.writer, blend_path, header["file_size"], hasher)
+    count("render_bytes_received_total", received)
+    if received < header["file_size"]:
+        raise Exception("Client disconnected during upload.")
+    stats = format_rate(received, time.time() - started)
+    digest = hasher.hexdigest()
+    claimed = header["options"].get("sha256", "").lower()
+    if claimed and claimed != digest:
+        raise Exception("Upload checksum mismatch.")
+    add_blob(digest, blend_path)
+    remember_blob_name(header, digest)
+    return digest, stats
+
+# === DELTA UPLOADS ===
+def delta_base(channel, header, digest):
+    """Stored blob the client can send a delta against: the last upload under the same name."""
+    if channel.version == 1 or "delta-upload" not in channel.capabilities:
+        return None
+    base = blob_names.get(header["options"].get("project") or header["blend_name"])
+    if base is None or base == digest or base not in blob_index:
+        return None
+    return base
+
+def block_signatures(path, block_size):
+    """DELTA_SIGNATURE records for every whole block of `path`."""
+    signatures = bytearray()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            if len(block) < block_size:
+                break
+            signatures += DELTA_SIGNATURE.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=16).digest())
+    return bytes(signatures)
+
+async def receive_delta(channel, header, blend_path, base):
+    """
+    Send the base blob's block signatures and rebuild the upload from the
+    client's delta. Returns (digest, stats), or None when the client chose to
+    send the whole file instead.
+    """
+    # The open handle keeps the base readable even if it is evicted meanwhile.
+    with open(blob_path(base), "rb") as base_file:
+        signatures = await asyncio.to_thread(block_signatures, base_file.name, DELTA_BLOCK_SIZE)
+        base_blocks = len(signatures) // DELTA_SIGNATURE.size
+        channel.send("delta", base=base, block_size=DELTA_BLOCK_SIZE, blocks=base_blocks)
+        channel.start_data(len(signatures))
+        channel.writer.write(signatures)
+        await channel.writer.drain()
+
+        reply = await channel.read_message()
+        if reply.get("type") == "full":
+            verbose(f"Client declined a delta upload against {base[:12]}")
+            return None
+        if reply.get("type") != "delta":
+            raise Exception("Expected a delta or full upload.")
+        remaining = await channel.read_frame_header(FRAME_DATA)
+        delta_size = remaining
+        started = time.time()
+        hasher = hashlib.sha256()
+        written = 0
+        with open(blend_path, "wb") as out:
+            while remaining:
+                if remaining < DELTA_OP.size:
+                    raise Exception("Truncated delta.")
+                kind, first, blocks = DELTA_OP.unpack(await channel.reader.readexactly(DELTA_OP.size))
+                remaining -= DELTA_OP.size
+                if kind == b"C":
+                    if first + blocks > base_blocks:
+                        raise Exception("Delta refers past the end of the base file.")
+                    base_file.seek(first * DELTA_BLOCK_SIZE)
+                    left = blocks * DELTA_BLOCK_SIZE
+                    while left:
+                        data = base_file.read(min(left, UPLOAD_BUFFER_SIZE))
+                        out.write(data)
+                        hasher.update(data)
+                        left -= len(data)
+                elif kind == b"L":
+                    if first > remaining:
+                        raise Exception("Truncated delta.")
+                    remaining -= first
+                    left = first
+                    while left:
+                        data = await channel.reader.readexactly(min(left, STREAM_LIMIT))
+                        out.write(data)
+                        hasher.update(data)
+                        left -= len(data)
+                else:
+                    raise Exception(f"Unknown delta op {kind!r}.")
+                written = out.tell()
+                if written > header["file_size"]:
+                    raise Exception("Delta is larger than the file.")
+
+    digest = hasher.hexdigest()
+    if written != header["file_size"] or digest != header["options"].get("sha256", "").lower():
+        raise Exception("Upload checksum mismatch.")
+    count("render_bytes_received_total", delta_size)
+    add_blob(digest, blend_path)
+    remember_blob_name(header, digest)
+    stats = format_rate(delta_size, time.time() - started)
+    return digest, f"{stats}, delta against {base[:12]}: {delta_size / max(written, 1):.1%} of {written / 1e6:.1f} MB"
+
+# === RESUMABLE UPLOADS ===
+class ChunkHasher:
+    """Feeds upload data to the whole-file sha256 and to a CRC-32 of the current chunk."""
+
+    def __init__(self, sha256):
+        self.sha256 = sha256
+        self.crc = 0
+
+    def update(self, data):
+        self.sha256.update(data)
+        self.crc = zlib.crc32(data, self.crc)
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher
+
+def resumable(channel, header):
+    return (channel.version != 1 and "resume-upload" in channel.capabilities
+            and valid_digest(header["options"].get("sha256", "").lower())
+            and UPLOAD_ID_RE.match(header["options"].get("upload_id", "")) is not None)
+
+def partial_upload(digest, upload_id, size):
+    """State of the partial upload for this hash and id; restored from disk after a restart."""
+    entry = partial_uploads.get((digest, upload_id))
+    if entry is not None and entry["size"] == size:
+        return entry
+    path = os.path.join(RENDER_ROOT, "uploads", f"{digest}.{upload_id}.part")
+    received = 0
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        if meta["size"] == size:
+            received = meta["received"]
+    except (OSError, ValueError, KeyError):
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Drop anything past the last verified chunk.
+    with open(path, "ab") as f:
+        f.truncate(received)
+    entry = {"key": (digest, upload_id), "path": path, "size": size, "received": received,
+             "hasher": None if received else hashlib.sha256(), "busy": False}
+    partial_uploads[entry["key"]] = entry
+    return entry
+
+def save_partial_upload(entry):
+    with open(entry["path"] + ".json", "w") as f:
+        json.dump({"size": entry["size"], "received": entry["received"]}, f)
+
+def forget_partial_upload(entry):
+    partial_uploads.pop(entry["key"], None)
+    for path in (entry["path"], entry["path"] + ".json"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def clean_partial_uploads():
+    """Delete partial uploads nobody resumed within UPLOAD_PARTIAL_TTL."""
+    upload_dir = os.path.join(RENDER_ROOT, "uploads")
+    if not os.path.isdir(upload_dir):
+        return
+    cutoff = time.time() - UPLOAD_PARTIAL_TTL
+    for name in os.listdir(upload_dir):
+        path = os.path.join(upload_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+async def receive_chunks(channel, header, blend_path):
+    """
+    Receive a v2 upload as `chunk` messages ({offset, size, crc32}) each followed
+    by a data frame, continuing the partial upload offered in offer_blob. Each
+    chunk is acknowledged with `chunk_ok`, or `chunk_retry` when its CRC doesn't
+    match; only verified chunks count. Returns (digest, stats) once the whole
+    file is in and matches the claimed sha256.
+    """
+    digest = header["options"]["sha256"].lower()
+    entry = partial_upload(digest, header["options"]["upload_id"], header["file_size"])
+    if entry["busy"]:
+        raise Exception("This upload is already in progress on another connection.")
+    entry["busy"] = True
+    resumed_at = entry["received"]
+    started = time.time()
+    try:
+        if entry["hasher"] is None:
+            entry["hasher"] = await asyncio.to_thread(file_digest, entry["path"])
+        while entry["received"] < entry["size"]:
+            message = await channel.read_message()
+            if message.get("type") != "chunk":
+                raise Exception("Expected an upload chunk.")
+            offset, size = int(message["offset"]), int(message["size"])
+            if await channel.read_frame_header(FRAME_DATA) != size:
+                raise Exception("Chunk size doesn't match its data frame.")
+            if offset != entry["received"] or size <= 0 or offset + size > entry["size"]:
+                raise Exception(f"Chunk at offset {offset} doesn't continue the upload (expected {entry['received']}).")
+
+            checker = ChunkHasher(entry["hasher"].copy())
+            received = await receive_file(channel.reader, channel.writer, entry["path"], size, checker, mode="ab")
+            count("render_bytes_received_total", received)
+            if received == size and checker.crc == int(message["crc32"]):
+                entry["hasher"] = checker.sha256
+                entry["received"] += size
+                save_partial_upload(entry)
+                channel.send("chunk_ok", offset=entry["received"])
+            else:
+                with open(entry["path"], "ab") as f:
+                    f.truncate(entry["received"])
+                if received < size:
+                    raise Exception("Client disconnected during upload.")
+                channel.send("chunk_retry", offset=entry["received"], message="Chunk checksum mismatch.")
+            await channel.writer.drain()
+
+        if entry["hasher"].hexdigest() != digest:
+            forget_partial_upload(entry)
+            raise Exception("Upload checksum mismatch.")
+        os.replace(entry["path"], blend_path)
+        forget_partial_upload(entry)
+    finally:
+        entry["busy"] = False
+
+    add_blob(digest, blend_path)
+    stats = format_rate(entry["size"] - resumed_at, time.time() - started)
+    if resumed_at:
+        stats += f", resumed at {resumed_at / 1e6:.1f} MB"
+    return digest, stats
+
+# === ADD-ON SYNC ===
+def addon_path(*parts):
+    return os.path.join(RENDER_ROOT, ADDON_STORE_DIR, *parts)
+
+def manifest_digest(files):
+    """Hash naming an add-on manifest ({relative path: [sha256, size]}); the client computes the same."""
+    return hashlib.sha256(json.dumps(files, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def valid_manifest(files):
+    if not isinstance(files, dict):
+        return False
+    for relpath, entry in files.items():
+        parts = relpath.split("/")
+        if any(part in ("", ".", "..") for part in parts) or "\\" in relpath or "\0" in relpath:
+            return False
+        if not (isinstance(entry, list) and len(entry) == 2 and valid_digest(str(entry[0]))
+                and isinstance(entry[1], int) and 0 <= entry[1] <= ADDON_MAX_FILE_SIZE):
+            return False
+    return True
+
+def addon_modules(files):
+    """Add-on module names in a manifest: top-level packages and single-file add-ons."""
+    names = set()
+    for relpath in files:
+        head, sep, rest = relpath.partition("/")
+        if not sep and head.endswith(".py"):
+            names.add(head[:-3])
+        elif rest == "__init__.py":
+            names.add(head)
+    return sorted(names)
+
+def build_addon_tree(digest, files):
+    """Link a manifest's files out of the store into RENDER_ROOT/addons/trees/<digest>/addons."""
+    tree = addon_path("trees", digest)
+    if os.path.isdir(tree):
+        return tree
+    os.makedirs(addon_path("trees"), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=addon_path("trees"))
+    try:
+        for relpath, (file_hash, _) in files.items():
+            target = os.path.join(staging, "addons", *relpath.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_file(addon_path("objects", file_hash), target)
+        os.rename(staging, tree)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        # Another job may have built the same tree meanwhile.
+        if not os.path.isdir(tree):
+            raise
+    return tree
+
+async def receive_addon_file(channel, file_hash, size):
+    path = addon_path("objects", f".{file_hash}.{uuid.uuid4().hex[:8]}")
+    hasher = hashlib.sha256()
+    try:
+        received = await receive_file(channel.reader, channel.writer, path, size, hasher)
+        count("render_bytes_received_total", received)
+        if received < size:
+            raise Exception("Client disconnected during add-on sync.")
+        if hasher.hexdigest() != file_hash:
+            raise Exception("Add-on file checksum mismatch.")
+        os.replace(path, addon_path("objects", file_hash))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def sync_addons(channel, header):
+    """
+    Make sure the add-ons named by the job's `addons` manifest digest are on
+    disk, asking the client for the manifest (`addons` event, want=manifest) if
+    it is new and then for the files the store lacks (want=files); each comes
+    back as an `addon_file` message and a data frame. A known manifest costs no
+    messages at all. Returns (scripts dir, add-on modules), or (None, []).
+    """
+    digest = header["options"].get("addons", "").lower()
+    if not digest or "addon-sync" not in channel.capabilities:
+        return None, []
+    if not valid_digest(digest):
+        raise Exception("Invalid add-on manifest digest.")
+    manifest_file = addon_path("manifests", digest + ".json")
+    try:
+        with open(manifest_file) as f:
+            files = json.load(f)
+    except (OSError, ValueError):
+        channel.send("addons", want="manifest")
+        message = await channel.read_message()
+        files = message.get("files") if message.get("type") == "addon_manifest" else None
+        if not valid_manifest(files) or manifest_digest(files) != digest:
+            raise Exception("Invalid add-on manifest.")
+        os.makedirs(addon_path("manifests"), exist_ok=True)
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(files, f)
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+    if not os.path.isdir(addon_path("trees", digest)):
+        os.makedirs(addon_path("objects"), exist_ok=True)
+        sizes = {file_hash: size for file_hash, size in files.values()}
+        missing = sorted(file_hash for file_hash in sizes if not os.path.exists(addon_path("objects", file_hash)))
+        if missing:
+            started = time.time()
+            channel.send("addons", want="files", files=missing)
+            for _ in missing:
+                message = await channel.read_message()
+                file_hash = str(message.get("sha256", "")).lower()
+                if message.get("type") != "addon_file" or file_hash not in missing:
+                    raise Exception("Expected a requested add-on file.")
+                if await channel.read_frame_header(FRAME_DATA) != sizes[file_hash]:
+                    raise Exception("Add-on file size doesn't match the manifest.")
+                await receive_addon_file(channel, file_hash, sizes[file_hash])
+            sent = sum(sizes[file_hash] for file_hash in missing)
+            verbose(f"Add-ons received: {len(missing)} file(s), {format_rate(sent, time.time() - started)}")
+        build_addon_tree(digest, files)
+        channel.send("addons", f"ADDONS: {len(files)} file(s), {len(missing)} sent\n",
+                     files=len(files), sent=len(missing))
+    return addon_path("trees", digest), addon_modules(files)
+
+# === RESULT CACHE ===
+def detect_blender_version(blender=None):
+    try:
+        result = subprocess.run([blender or BLENDER_PATH, "--version"], capture_output=True, text=True, timeout=120)
+    except Exception as e:
+        verbose(f"Could not read Blender version: {e}")
+        return "unknown"
+    for line in result.stdout.splitlines():
+        if line.startswith("Blender "):
+            return line.split()[1]
+    return "unknown"
+
+def load_result_cache():
+    global result_cache
+    try:
+        with open(os.path.join(RENDER_ROOT, RESULT_CACHE_FILE)) as f:
+            result_cache = json.load(f)
+        result_cache.setdefault("resolutions", {})
+    except (OSError, ValueError):
+        result_cache = {"frames": {}, "jobs": {}, "probes": {}, "resolutions": {}}
+    return len(result_cache["jobs"]) + sum(len(frames) for frames in result_cache["frames"].values())
+
+def save_result_cache():
+    path = os.path.join(RENDER_ROOT, RESULT_CACHE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(result_cache, f)
+    os.replace(path + ".tmp", path)
+
+def result_key(blend_hash, header, per_frame):
+    """Cache key: everything that changes the rendered pixels. Frame ranges are
+    left out for per-frame entries so a longer range reuses the frames it shares."""
+    params = {"blend": blend_hash, "format": header["output_format"], "blender": header.get("blender", BLENDER_VERSION)}
+    if header["options"].get("addons"):
+        params["addons"] = header["options"]["addons"]
+    if not per_frame:
+        params["render_type"] = header["render_type"]
+        params["frames"] = header["options"].get("frames")
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def requested_frames(header, frame_range):
+    """Frames a per-frame job renders, or None when the range isn't known."""
+    if header["render_type"] != "animation" and "frames" not in header["options"]:
+        return [1]
+    if frame_range is None:
+        return None
+    start, end, step = frame_range
+    return list(range(start, end + 1, step))
+
+def known_frames(blend_hash, header):
+    """Frames a per-frame request renders, if known before its blend is opened."""
+    frame_range = None
+    if "frames" in header["options"]:
+        frame_range = parse_frame_range(header["options"]["frames"])
+    elif blend_hash in result_cache["probes"]:
+        frame_range = tuple(result_cache["probes"][blend_hash])
+    return requested_frames(header, frame_range)
+
+def cached_frames(key, frames):
+    """{frame: "job_id/file"} for the requested frames whose output is still on disk."""
+    entries = result_cache["frames"].get(key, {})
+    found = {}
+    for frame in frames:
+        rel = entries.get(str(frame))
+        if rel and os.path.isfile(os.path.join(RENDER_ROOT, rel)):
+            found[frame] = rel
+    return found
+
+def link_cached_frames(cached, job_dir):
+    for rel in cached.values():
+        link_file(os.path.join(RENDER_ROOT, rel), os.path.join(job_dir, os.path.basename(rel)))
+
+def cached_job(key):
+    job_id = result_cache["jobs"].get(key)
+    if job_id and os.path.isdir(os.path.join(RENDER_ROOT, job_id)):
+        return job_id
+    return None
+
+def cached_outputs(blend_hash, header, job_id, job_dir):
+    """
+    Check whether every output of a request is cached, before anything is
+    uploaded or queued. Returns the JOB_ID holding the outputs (an earlier job,
+    or this one with cached frames linked in), or None.
+    """
+    if header["output_format"] == "FFMPEG":
+        return cached_job(result_key(blend_hash, header, per_frame=False))
+
+    frames = known_frames(blend_hash, header)
+    if frames is None:
+        return None
+    cached = cached_frames(result_key(blend_hash, header, per_frame=True), frames)
+    if len(cached) < len(frames):
+        return None
+    sources = {rel.split("/")[0] for rel in cached.values()}
+    if len(sources) == 1:
+        return sources.pop()
+    link_cached_frames(cached, job_dir)
+    return job_id
+
+def record_results(job):
+    if job["per_frame"]:
+        entries = result_cache["frames"].setdefault(job["cache_key"], {})
+        for name in os.listdir(job["job_dir"]):
+            match = FRAME_FILE_RE.match(name)
+            if match and valid_frame_file(os.path.join(job["job_dir"], name), job["output_format"]):
+                entries[str(int(match.group(1)))] = f"{job['job_id']}/{name}"
+    else:
+        result_cache["jobs"][job["cache_key"]] = job["job_id"]
+    try:
+        save_result_cache()
+    except OSError as e:
+        verbose(f"Failed to save result cache: {e}")
+
+def set_socket_buffers(sock):
+    if SOCKET_BUFFER_SIZE:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+
+def format_rate(size, seconds):
+    return f"{size / 1e6:.1f} MB in {seconds:.2f}s ({size / 1e6 / max(seconds, 1e-6):.1f} MB/s)"
+
+def output_files(job_dir):
+    return [
+        os.path.join(job_dir, name) for name in sorted(os.listdir(job_dir))
+        if os.path.isfile(os.path.join(job_dir, name))
+        and not name.endswith((".blend", ".blend1")) and name not in (JOB_LOG_NAME, JOB_TRACE_NAME)
+    ]
+
+async def send_files(channel, paths):
+    """Send files as `FILE <size> <name>` records (v2: `file` events each followed by a data frame)."""
+    loop = asyncio.get_running_loop()
+    for path in paths:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            name = os.path.basename(path)
+            channel.send("file", f"FILE {size} {name}\n", name=name, size=size)
+            channel.start_data(size)
+            if size:
+                await loop.sendfile(channel.writer.transport, f, 0, size)
+                count("render_bytes_sent_total", size)
+
+async def send_job_files(channel, job_id, render_root=None):
+    """Stream a job's outputs as `FILE <size> <name>` records followed by `END`."""
+    job_dir = os.path.join(render_root or RENDER_ROOT, os.path.basename(job_id))
+    if not job_id or not os.path.isdir(job_dir):
+        channel.send("error", "ERR: Unknown job.\n", message="Unknown job.")
+        return
+    await send_files(channel, output_files(job_dir))
+    channel.send("end", "END\n")
+
+async def handle_command(channel, addr, name, args):
+    """Answer `@COMMAND args` (v1) or `command` messages (v2) without waiting for a render slot."""
+    if name == "NODE_STATUS":
+        status = node_status()
+        channel.send("status", f"STATUS: {json.dumps(status)}\n", status=status)
+    elif name == "FETCH":
+        await send_job_files(channel, args.strip())
+    elif name == "JOB_STATUS":
+        record = jobs.get(args.strip())
+        if record is None:
+            channel.send("error", f"ERR: Unknown job {args.strip()}\n", message=f"Unknown job {args.strip()}")
+        else:
+            summary = job_summary(record)
+            channel.send("job_status", f"JOB: {json.dumps(summary)}\n", job=summary)
+    elif name == "JOBS":
+        summaries = [job_summary(record) for record in jobs.values()]
+        channel.send("jobs", f"JOBS: {json.dumps(summaries)}\n", jobs=summaries)
+    elif name == "ATTACH":
+        job_id, _, offset = args.strip().partition(" ")
+        try:
+            offset = max(int(offset or 0), 0)
+        except ValueError:
+            channel.send("error", f"ERR: Bad offset {offset}\n", message=f"Bad offset {offset}")
+            return
+        await attach(channel, job_id, offset)
+    elif name == "CANCEL":
+        job_id = args.strip()
+        record = jobs.get(job_id)
+        if record is None or job_id not in job_tasks:
+            channel.send("error", f"ERR: No running job {job_id}\n", message=f"No running job {job_id}")
+        else:
+            record["cancel_requested"] = True
+            job_tasks[job_id].cancel()
+            verbose(f"Cancelling job {job_id} ({record['state']})")
+            channel.send("cancelled", f"CANCELLED: {job_id}\n", job_id=job_id)
+    elif name in ("LOG", "TRACE"):
+        job_id = os.path.basename(args.strip())
+        if name == "TRACE" and job_id in job_traces:
+            save_trace(job_id)
+        path = os.path.join(RENDER_ROOT, job_id, JOB_LOG_NAME if name == "LOG" else JOB_TRACE_NAME)
+        if not job_id or not os.path.isfile(path):
+            channel.send("error", f"ERR: No {name.lower()} for job {job_id}\n", message=f"No {name.lower()} for job {job_id}")
+        else:
+            await send_files(channel, [path])
+            channel.send("end", "END\n")
+    else:
+        channel.send("error", f"ERR: Unknown command {name}\n", message=f"Unknown command {name}")
+
+async def close_connection(channel):
+    active_connections.discard(channel)
+    try:
+        channel.writer.close()
+        await channel.writer.wait_closed()
+    except:
+        pass
 
 # === CLIENT HANDLING ===
-def handle_client(conn, addr):
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    count("render_connections_total")
     if shutdown_requested:
-        conn.sendall(b"ERR: Server not accepting connections.\n")
-        conn.close()
+        writer.write(b"ERR: Server not accepting connections.\n")
+        await close_connection(Channel(reader, writer))
         return
 
-    active_connections.append(conn)
-    job_data = {
-        "conn": conn,
-        "addr": addr,
-        "timestamp": datetime.datetime.now()
-    }
-    job_queue.put(job_data)
-    position = job_queue.qsize()
-    verbose(f"Job queued from {addr}, position {position}")
+    channel = None
     try:
-        conn.sendall(f"QUEUED: Your request has been added to the queue. Current position: {position}\n".encode())
-    except:
-        conn.close()
+        channel, request = await open_channel(reader, writer)
+        if channel.version == 1 and request and request[0].startswith("@"):
+            name, _, args = request[0][1:].partition(" ")
+            request = {"type": "command", "name": name, "args": args}
+        if isinstance(request, dict) and request.get("type") == "command":
+            await handle_command(channel, addr, request.get("name", ""), str(request.get("args", "")))
+            await writer.drain()
+            await close_connection(channel)
+            return
+    except Exception as e:
+        verbose(f"Exception: {e}")
+        await close_connection(channel or Channel(reader, writer))
+        return
+
+    active_connections.add(channel)
+    await process_render_job(channel, addr, request)
 
 # === SERVER SETUP ===
-def start_server():
+async def register_with_coordinator(coordinator):
+    """Periodically announce this node to a coordinator (see coordinator.py)."""
+    coord_host, _, coord_port = coordinator.rpartition(":")
+    while not shutdown_requested:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(coord_host, int(coord_port)), 5)
+            writer.write(f"@REGISTER {PORT}\n===END===\n".encode())
+            await asyncio.wait_for(reader.readline(), 5)
+            writer.close()
+        except Exception as e:
+            verbose(f"Coordinator registration failed: {e}")
+        await asyncio.sleep(REGISTER_INTERVAL)
+
+def raise_fd_limit():
+    """Every queued client holds a socket, so allow as many as the hard limit permits."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+async def serve(coordinator=None, resumed=()):
+    global free_slots
+    free_slots = MAX_CONCURRENT_JOBS
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, handle_shutdown)
+
+    background = [asyncio.create_task(journal_writer())]
+    if coordinator:
+        background.append(asyncio.create_task(register_with_coordinator(coordinator)))
+    for record, params in resumed:
+        background.append(asyncio.create_task(run_job(record, params)))
+
+    # Buffer sizes are set on the listening socket so accepted connections
+    # inherit them before the TCP window is negotiated.
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    set_socket_buffers(listen_sock)
+    listen_sock.bind((HOST, PORT))
+    server = await asyncio.start_server(
+        handle_client, sock=listen_sock, limit=STREAM_LIMIT, backlog=LISTEN_BACKLOG,
+    )
+    if METRICS_PORT:
+        background.append(await asyncio.start_server(handle_metrics, METRICS_HOST, METRICS_PORT))
+        info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    print("\n@READY: RenderServer running on", f"{HOST}:{PORT}")
+    print("========================================")
+    async with server:
+        await server.serve_forever()
+
+def start_server(install=True, coordinator=None):
+    global BLENDER_PATH, BLENDER_VERSION
     step("Starting Render Server Setup")
-    install_blender()
+    if install:
+        installs, default = install_blender(BLENDER_VERSIONS, BLENDER_ARCHIVES)
+        blender_installs.update(installs)
+        BLENDER_VERSION = resolve_blender(default)
+        BLENDER_PATH = blender_installs[BLENDER_VERSION]
+    else:
+        # Cached installs stay available to jobs that ask for them.
+        blender_installs.update(installed_blenders())
+        info(f"Using Blender at {BLENDER_PATH}")
+        BLENDER_VERSION = detect_blender_version()
+        blender_installs[BLENDER_VERSION] = BLENDER_PATH
 
     step("Creating render job output root")
     os.makedirs(RENDER_ROOT, exist_ok=True)
     success(f"Render root ready: {RENDER_ROOT}")
+    info(f"Blob store: {load_blob_store()} file(s), {blob_store_usage / 1e9:.1f} GB of {BLOB_STORE_BUDGET / 1e9:.1f} GB")
+    clean_partial_uploads()
+    info(f"Result cache: {load_result_cache()} entries")
+    journaled, resumed = replay_journal()
+    info(f"Job journal: {journaled} job(s), {len(resumed)} queued again")
+    info(f"Blender version: {BLENDER_VERSION}" +
+         (f" (also {', '.join(sorted(v for v in blender_installs if v != BLENDER_VERSION))})" if len(blender_installs) > 1 else ""))
+    info(f"Accepting up to {raise_fd_limit()} open connections")
+    cores, memory_mb = detect_resources()
+    info(f"Render slots: {MAX_CONCURRENT_JOBS} over {cores} core(s)" +
+         (f", {memory_budget_mb / 1e3:.1f} of {memory_mb / 1e3:.1f} GB for renders" if memory_budget_mb else "") +
+         ("" if PIN_CPUS else ", cores not pinned"))
 
-    print("\n@READY: RenderServer running on", f"{HOST}:{PORT}")
-    print("========================================")
+    asyncio.run(serve(coordinator, resumed))
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-        while not shutdown_requested:
-            try:
-                conn, addr = s.accept()
-                threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
-            except Exception as e:
-                verbose(f"Socket error: {e}")
+async def run_probe(blend_path, probe_expr, marker, blender=None):
+    """Run `probe_expr` on the blend in Blender. Returns the values it printed after `marker`, or None."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            blender or BLENDER_PATH, "-b", blend_path, "--python-expr", probe_expr,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), 300)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise Exception("timed out")
+    except Exception as e:
+        verbose(f"Probe {marker} failed: {e}")
+        return None
+    for line in stdout.decode(errors="ignore").splitlines():
+        if line.startswith(marker + " "):
+            return line.split()[1:]
+    return None
 
-def process_render_job(conn, addr):
+async def probe_frame_range(blend_path, blend_hash=None, blender=None):
+    """Ask Blender for the scene frame range. Returns (start, end, step) or None."""
+    if blend_hash in result_cache["probes"]:
+        return tuple(result_cache["probes"][blend_hash])
+    probe_expr = (
+        "import bpy; s = bpy.context.scene; "
+        "print('@FRAME_RANGE', s.frame_start, s.frame_end, s.frame_step)"
+    )
+    values = await run_probe(blend_path, probe_expr, "@FRAME_RANGE", blender)
     try:
-        buffer = b""
-        while b"===END===\n" not in buffer:
-            chunk = conn.recv(1024)
-            if not chunk:
-                raise Exception("Client disconnected before sending header.")
-            buffer += chunk
+        start, end, step = (int(v) for v in values[:3])
+    except (TypeError, ValueError):
+        start, end, step = 0, -1, 1
+    if end >= start:
+        if blend_hash:
+            result_cache["probes"][blend_hash] = [start, end, max(step, 1)]
+        return start, end, max(step, 1)
+    verbose("Frame range probe returned no usable range.")
+    return None
 
-        header_data, remaining = buffer.split(b"===END===\n", 1)
-        header_lines = header_data.decode().strip().split("\n")
-        if len(header_lines) < 4:
-            conn.send(b"ERR: Invalid header format.\n")
-            verbose("Invalid header format.")
-            return
+async def probe_resolution(blend_path, blend_hash=None, blender=None):
+    """Ask Blender for the size in pixels of the scene's renders. Returns (width, height) or None."""
+    if blend_hash in result_cache["resolutions"]:
+        return tuple(result_cache["resolutions"][blend_hash])
+    probe_expr = (
+        "import bpy; r = bpy.context.scene.render; "
+        "print('@RESOLUTION', r.resolution_x * r.resolution_percentage // 100, "
+        "r.resolution_y * r.resolution_percentage // 100)"
+    )
+    values = await run_probe(blend_path, probe_expr, "@RESOLUTION", blender)
+    try:
+        width, height = (int(v) for v in values[:2])
+    except (TypeError, ValueError):
+        width = height = 0
+    if width > 0 and height > 0:
+        if blend_hash:
+            result_cache["resolutions"][blend_hash] = [width, height]
+        return width, height
+    verbose("Resolution probe returned no usable size.")
+    return None
 
-        blend_name = header_lines[0]
-        render_type = header_lines[1]
-        file_size = int(header_lines[2])
-        output_format = header_lines[3].upper()
+async def send_to_client(job, data):
+    """Send Blender output to the job's client; chunks of one job share the connection."""
+    publish(job["record"]["job_id"], "log", line=data.decode(errors="replace"))
+    if job["client_gone"]:
+        return
+    try:
+        async with job["channel"].lock:
+            job["channel"].log(data)
+            await job["channel"].writer.drain()
+    except Exception as e:
+        verbose(f"Failed to send log line: {e}")
+        job["client_gone"] = True
 
-        job_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f") + "_" + str(uuid.uuid4())[:8]
-        job_dir = os.path.join(RENDER_ROOT, job_id)
-        os.makedirs(job_dir, exist_ok=True)
-        blend_path = os.path.join(job_dir, blend_name)
-
-        with open(blend_path, "wb") as f:
-            f.write(remaining)
-            received = len(remaining)
-            while received < file_size:
-                chunk = conn.recv(min(4096, file_size - received))
-                if not chunk:
-                    break
-                f.write(chunk)
-                received += len(chunk)
-
-        verbose(f"Blend file received: {blend_path}")
-        output_path = os.path.join(job_dir, "frame_#####")
+async def notify(job, event, text=None, **fields):
+    """Send an event to the job's client (see Channel.send) and its feed."""
+    publish(job["record"]["job_id"], event, **fields)
+    if job["client_gone"]:
+        return
+    try:
+        async with job["channel"].lock:
+            job["channel"].send(event, text, **fields)
+            await job["channel"].writer.drain()
+    except Exception as e:
+        verbose(f"Failed to send {event} event: {e}")
+        job["client_gone"] = True
+
+def parse_duration(value):
+    """Seconds from Blender's `[HH:]MM:SS.ss`."""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_blender_line(line):
+    """Progress fields from one line of Blender output, or None if it carries none."""
+    match = SAVED_RE.match(line)
+    if match:
+        return {"saved": match.group(1)}
+    match = APPEND_FRAME_RE.match(line)
+    if match:
+        return {"frame": int(match.group(1)), "saved": None}
+    match = FRAME_PROGRESS_RE.match(line)
+    if not match:
+        return None
+    fields = {"frame": int(match.group(1))}
+    match = PEAK_MEMORY_RE.search(line)
+    if match:
+        fields["mem_peak_mb"] = float(match.group(1) or match.group(2))
+    match = ELAPSED_RE.search(line)
+    if match:
+        fields["elapsed"] = parse_duration(match.group(1))
+    match = REMAINING_RE.search(line)
+    if match:
+        fields["remaining"] = parse_duration(match.group(1))
+    match = SAMPLES_RE.search(line)
+    if match:
+        fields["samples_done"], fields["samples_total"] = int(match.group(1)), int(match.group(2))
+    return fields
+
+async def send_progress(job):
+    record = job["record"]
+    job["progress_sent_at"] = time.monotonic()
+    job["progress_pending"] = False
+    await notify(job, "progress", job_id=job["job_id"], frames_done=record["frames_done"],
+                 frames_total=record["frames_total"], **job["progress"])
+
+async def forward_output(job, raw, lane=None):
+    """
+    Log one line of Blender output to the job's log file and relay it to the
+    client, as a raw line or as coalesced `progress` events. Returns True for
+    frame progress.
+    """
+    # Keep draining stdout even if the client is gone, so Blender never blocks on a full pipe.
+    if job.get("log_file") is None:
+        job["log_file"] = open(os.path.join(job["job_dir"], JOB_LOG_NAME), "ab")
+    job["log_file"].write(raw)
+
+    line_clean = raw.decode(errors="ignore").strip()
+    track_progress(job["record"], line_clean)
+    fields = parse_blender_line(line_clean)
+    if lane is not None:
+        trace_output(job, lane, fields, time.time())
+        if fields and "mem_peak_mb" in fields:
+            lane["peak_mb"] = max(lane["peak_mb"] or 0.0, fields["mem_peak_mb"])
+    if fields is None or "progress" not in job["capabilities"]:
+        await send_to_client(job, raw)
+    if fields is None:
+        return False
 
-        render_cmd = [
-            BLENDER_PATH, "-b", blend_path,
-            "-o", output_path,
-            "-F", output_format,
-        ]
-        if render_type == "animation":
-            render_cmd.append("-a")
+    job.setdefault("progress", {}).update(fields)
+    job["progress_pending"] = True
+    saved = "saved" in fields
+    if saved or time.monotonic() - job.get("progress_sent_at", 0) >= PROGRESS_INTERVAL:
+        sys.stdout.write(f"\r[SERVER] {line_clean[:80]:<80}" + ("\n" if saved else ""))
+        sys.stdout.flush()
+        if "progress" in job["capabilities"]:
+            await send_progress(job)
         else:
-            render_cmd += ["-f", "1"]
+            job["progress_sent_at"] = time.monotonic()
+    if fields.get("saved") and job.get("done_frames") is not None:
+        checkpoint_frame(job, fields["saved"])
+    if fields.get("saved") and job.get("outbox") is not None:
+        job["outbox"].put_nowait(fields["saved"])
+    return not saved
 
-        conn.sendall(b"PROCESSING: Your job is now rendering.\n")
+async def stream_outputs(job):
+    """
+    Push frames to a `stream-frames` client as Blender saves them, so the
+    download overlaps with rendering. Paths arrive on job["outbox"]; None ends it.
+    """
+    while True:
+        path = await job["outbox"].get()
+        if path is None:
+            return
+        path = os.path.realpath(path)
+        if (path in job["streamed"] or job["client_gone"]
+                or os.path.dirname(path) != os.path.realpath(job["job_dir"]) or not os.path.isfile(path)):
+            continue
+        job["streamed"].add(path)
+        try:
+            async with job["channel"].lock:
+                started = time.time()
+                await send_files(job["channel"], [path])
+                await job["channel"].writer.drain()
+                trace(job["job_id"], f"send {os.path.basename(path)}", started, time.time(), TRACE_OUTPUT_TID)
+        except Exception as e:
+            verbose(f"Failed to stream {path}: {e}")
+            job["client_gone"] = True
 
-        verbose(f"Launching Blender render job: {' '.join(render_cmd)}")
-        proc = subprocess.Popen(render_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+async def finish_streaming(job, ok):
+    """Send outputs that never showed up in a Saved: line (cached frames, movies), then stop the streamer."""
+    if job.get("outbox") is None:
+        return
+    if ok and os.path.isdir(job["job_dir"]):
+        for path in output_files(job["job_dir"]):
+            job["outbox"].put_nowait(path)
+    job["outbox"].put_nowait(None)
+    await job["streamer"]
+
+def blender_env(scripts_dir):
+    """Environment for a Blender process that loads add-ons from a synced scripts directory."""
+    return dict(os.environ, BLENDER_USER_SCRIPTS=scripts_dir) if scripts_dir else None
 
-        current_line = ""
-        for line in proc.stdout:
+def pin_process(pid, cpus):
+    """Restrict every thread of a running process to `cpus` (Linux; a no-op elsewhere)."""
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass
+
+async def run_blender(job, render_cmd, lane=None, slot=None):
+    """
+    Run one Blender process, pinned to the cores of the render slot `slot`
+    if it has any, forwarding its output. Returns (returncode, stats).
+    """
+    verbose(f"Launching Blender render job: {' '.join(render_cmd)}")
+    launched = time.time()
+    first_frame_at = None
+    proc = await asyncio.create_subprocess_exec(
+        *render_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, limit=1 << 20,
+        env=blender_env(job["scripts_dir"]),
+    )
+    active_processes.add(proc)
+    if slot is not None:
+        slot["pid"] = proc.pid
+        # Pinned after the spawn rather than in preexec_fn, which isn't safe with
+        # the server's threads; Blender starts its render threads long after this.
+        pin_process(proc.pid, slot["cpus"])
+    try:
+        async for raw in proc.stdout:
             if shutdown_requested:
-                conn.sendall(b"ERR: Server Stop Requested\n")
+                await notify(job, "error", "ERR: Server Stop Requested\n", message="Server Stop Requested")
+                proc.terminate()
                 break
 
+            if await forward_output(job, raw, lane) and first_frame_at is None:
+                first_frame_at = time.time()
+
+        await proc.wait()
+    finally:
+        if proc.returncode is None:
+            # Cancelled mid-render.
+            proc.kill()
+        active_processes.discard(proc)
+        if slot is not None:
+            slot["pid"] = None
+
+    finished = time.time()
+    stats = {
+        "startup": (first_frame_at or finished) - launched,
+        "rendering": finished - (first_frame_at or finished),
+        "peak_mb": None,
+    }
+    return proc.returncode, stats
+
+# === SCHEDULER ===
+def make_ticket(job_id, client, priority=0, estimate=0.0, channel=None, seq=None, memory_mb=DEFAULT_JOB_MEMORY_MB,
+                chunk=False):
+    """A request for one render slot. Only a job's first ticket (not `chunk`) gets queue positions, sent to `channel` if any."""
+    global ticket_seq
+    if seq is None:
+        ticket_seq += 1
+        seq = ticket_seq
+    return {
+        "job_id": job_id, "client": client, "priority": priority, "estimate": estimate,
+        "channel": channel, "seq": seq, "future": None, "granted_at": None, "position": None,
+        "memory_mb": memory_mb, "reserved_mb": 0.0, "cpus": [], "pid": None, "chunk": chunk,
+    }
+
+def client_usage(client, now=None):
+    """Slot-seconds `client` used recently, halved every FAIR_SHARE_HALF_LIFE seconds."""
+    now = now or time.time()
+    used, at = usage_by_client.get(client, (0.0, now))
+    return used * 0.5 ** ((now - at) / FAIR_SHARE_HALF_LIFE)
+
+def schedule_key(ticket, now):
+    return (
+        -ticket["priority"],
+        slots_by_client.get(ticket["client"], 0),
+        client_usage(ticket["client"], now),
+        ticket["estimate"] if SHORTEST_JOB_FIRST else 0.0,
+        ticket["seq"],
+    )
+
+def detect_resources():
+    """Find the cores and memory render slots share, and size the slot count if it is automatic."""
+    global slot_cpus, free_cpus, memory_budget_mb, MAX_CONCURRENT_JOBS, PIN_CPUS
+    try:
+        slot_cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        slot_cpus = list(range(os.cpu_count() or 1))
+    free_cpus = set(slot_cpus)
+    try:
+        total_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1e6
+    except (AttributeError, ValueError, OSError):
+        total_mb = 0
+    # 0 means unknown: memory admission is skipped.
+    memory_budget_mb = max(total_mb - MEMORY_RESERVE_MB, DEFAULT_JOB_MEMORY_MB) if total_mb else 0
+    if not MAX_CONCURRENT_JOBS:
+        by_memory = int(memory_budget_mb // DEFAULT_JOB_MEMORY_MB) if memory_budget_mb else len(slot_cpus)
+        MAX_CONCURRENT_JOBS = max(1, min(len(slot_cpus) // SLOT_MIN_CPUS, by_memory))
+    if MAX_CONCURRENT_JOBS > len(slot_cpus):
+        # More slots than cores were asked for: they have to share.
+        PIN_CPUS = False
+    return len(slot_cpus), total_mb
+
+def expected_memory(blend_hash):
+    """Memory to reserve for one render of `blend_hash`, from its measured peak or the average of others."""
+    peak = memory_peaks.get(blend_hash)
+    if peak is None:
+        if not memory_peaks:
+            return DEFAULT_JOB_MEMORY_MB
+        peak = sum(memory_peaks.values()) / len(memory_peaks)
+    return peak * MEMORY_HEADROOM
+
+def record_peak_memory(blend_hash, peak_mb):
+    memory_peaks[blend_hash] = peak_mb
+
+def rebalance(share):
+    """Shrink running slots to `share` cores, re-pinning their Blender processes, to make room for a new one."""
+    for ticket in granted_tickets:
+        if len(ticket["cpus"]) > share:
+            free_cpus.update(ticket["cpus"][share:])
+            ticket["cpus"] = ticket["cpus"][:share]
+            if ticket["pid"] is not None:
+                pin_process(ticket["pid"], ticket["cpus"])
+
+def admit(ticket):
+    """
+    Reserve memory and cores for `ticket`, or return False until enough are
+    free. Cores are split evenly among the jobs running or waiting (at most
+    MAX_CONCURRENT_JOBS of them), taking them back from slots that were given
+    more while the server was quieter; a job is always admitted onto an idle server.
+    """
+    global reserved_memory_mb
+    idle = free_slots == MAX_CONCURRENT_JOBS
+    memory = ticket["memory_mb"]
+    if not idle and memory_budget_mb and reserved_memory_mb + memory > memory_budget_mb:
+        return False
+    cpus = []
+    if PIN_CPUS and slot_cpus:
+        contenders = min(MAX_CONCURRENT_JOBS, MAX_CONCURRENT_JOBS - free_slots + len(waiting_tickets))
+        share = max(1, len(slot_cpus) // max(contenders, 1))
+        if len(free_cpus) < min(share, SLOT_MIN_CPUS):
+            rebalance(share)
+        if len(free_cpus) < min(share, SLOT_MIN_CPUS):
+            return False
+        cpus = sorted(free_cpus)[:share]
+        free_cpus.difference_update(cpus)
+    ticket["cpus"] = cpus
+    ticket["reserved_mb"] = memory
+    reserved_memory_mb += memory
+    return True
+
+def dispatch_slots():
+    """Hand free slots to the best-ranked waiting tickets, then refresh queue positions."""
+    global free_slots
+    while free_slots and waiting_tickets:
+        now = time.time()
+        ticket = min(waiting_tickets, key=lambda t: schedule_key(t, now))
+        # Strict order: a ticket waiting for memory or cores holds back the ones behind it.
+        if not admit(ticket):
+            break
+        waiting_tickets.remove(ticket)
+        granted_tickets.append(ticket)
+        free_slots -= 1
+        ticket["granted_at"] = now
+        if not ticket["chunk"] and ticket["job_id"] in jobs:
+            jobs[ticket["job_id"]]["position"] = None
+        slots_by_client[ticket["client"]] = slots_by_client.get(ticket["client"], 0) + 1
+        ticket["future"].set_result(None)
+    report_positions()
+
+def report_positions():
+    now = time.time()
+    waiting_tickets.sort(key=lambda t: schedule_key(t, now))
+    position = 0
+    for ticket in waiting_tickets:
+        if ticket["chunk"]:
+            continue
+        position += 1
+        if ticket["position"] != position:
+            ticket["position"] = position
+            if ticket["job_id"] in jobs:
+                jobs[ticket["job_id"]]["position"] = position
+            publish(ticket["job_id"], "queued", position=position)
+            if ticket["channel"] is None or ticket["channel"].writer.is_closing():
+                continue
             try:
-                conn.send(line.encode())
-            except Exception as e:
-                verbose(f"Failed to send log line: {e}")
-                break
+                ticket["channel"].send("queued", f"QUEUED: Current position: {position}\n", position=position)
+            except Exception:
+                pass
+
+async def acquire_slot(ticket, releasing=None):
+    """Wait for a slot. `releasing` is a slot given up only once `ticket` is queued."""
+    ticket["future"] = asyncio.get_running_loop().create_future()
+    waiting_tickets.append(ticket)
+    if releasing is not None:
+        release_slot(releasing)
+    else:
+        dispatch_slots()
+    try:
+        await ticket["future"]
+    except asyncio.CancelledError:
+        if ticket in waiting_tickets:
+            waiting_tickets.remove(ticket)
+            report_positions()
+        elif not ticket["future"].cancelled():
+            release_slot(ticket)
+        raise
+
+def release_slot(ticket):
+    global free_slots, reserved_memory_mb
+    now = time.time()
+    client = ticket["client"]
+    slots_by_client[client] -= 1
+    if not slots_by_client[client]:
+        del slots_by_client[client]
+    usage_by_client[client] = (client_usage(client, now) + now - ticket["granted_at"], now)
+    granted_tickets.remove(ticket)
+    free_cpus.update(ticket["cpus"])
+    reserved_memory_mb -= ticket["reserved_mb"]
+    free_slots += 1
+    dispatch_slots()
+
+def expected_seconds(blend_hash, header):
+    """Rough render time of a request, for shortest-job-first ordering."""
+    seconds_per_frame = frame_times.get(blend_hash)
+    if seconds_per_frame is None:
+        if not frame_times:
+            return 0.0
+        seconds_per_frame = sum(frame_times.values()) / len(frame_times)
+    frames = known_frames(blend_hash, header)
+    return seconds_per_frame * (len(frames) if frames is not None else SJF_DEFAULT_FRAMES)
+
+def record_frame_time(blend_hash, frames, seconds):
+    per_frame = seconds / max(frames, 1)
+    previous = frame_times.get(blend_hash)
+    frame_times[blend_hash] = per_frame if previous is None else 0.5 * previous + 0.5 * per_frame
+
+# === JOB REGISTRY ===
+def register_job(job_id, header, client, priority, blend_hash=None):
+    record = {
+        "job_id": job_id,
+        "state": "uploading",
+        "client": client,
+        "priority": priority,
+        "blend_name": header["blend_name"],
+        "render_type": header["render_type"],
+        "output_format": header["output_format"],
+        "blend_hash": blend_hash,
+        "position": None,
+        "frames_total": None,
+        "frames_done": 0,
+        "frames_rendered": 0,
+        "current_frame": None,
+        "submitted_at": time.time(),
+    }
+    if blend_hash:
+        frames = known_frames(blend_hash, header) if header["output_format"] != "FFMPEG" else None
+        record["frames_total"] = len(frames) if frames is not None else None
+    track_job(record)
+    journal(record)
+    forget_old_jobs()
+    return record
+
+def track_job(record):
+    """Add a live job to the registry with an empty trace timeline and feed."""
+    job_id = record["job_id"]
+    jobs[job_id] = record
+    job_traces[job_id] = {"events": [], "threads": {TRACE_JOB_TID: "job", TRACE_OUTPUT_TID: "output"}}
+    job_feeds[job_id] = {"entries": deque(maxlen=JOB_FEED_LIMIT), "next": 0, "watchers": {}, "done": False, "closed": False}
+
+def forget_job(job_id):
+    jobs.pop(job_id, None)
+    job_traces.pop(job_id, None)
+    job_feeds.pop(job_id, None)
+    journal_pending[job_id] = None
+
+def forget_old_jobs():
+    finished = [jid for jid, r in jobs.items() if not JOB_TRANSITIONS[r["state"]]]
+    for jid in finished[:max(len(finished) - JOB_HISTORY_LIMIT, 0)]:
+        forget_job(jid)
+
+def set_job_state(record, state):
+    if state not in JOB_TRANSITIONS[record["state"]]:
+        raise ValueError(f"Job {record['job_id']} can't go from {record['state']} to {state}")
+    record["state"] = state
+    record[f"{state}_at"] = time.time()
+    journal(record)
+    if not JOB_TRANSITIONS[state]:
+        count("render_jobs_total", outcome=state)
+        observe("render_job_seconds", record[f"{state}_at"] - record["submitted_at"])
+        trace(record["job_id"], "job", record["submitted_at"], record[f"{state}_at"], outcome=state)
+        save_trace(record["job_id"])
 
-            line_clean = line.strip()
-            if "Fra:" in line_clean or "Rendering" in line_clean:
-                current_line = line_clean
-                sys.stdout.write(f"\r[SERVER] {current_line[:80]:<80}")
-                sys.stdout.flush()
-            elif "Saved:" in line_clean:
-                sys.stdout.write(f"\r[SERVER] {line_clean[:80]:<80}\n")
-                sys.stdout.flush()
-
-        proc.wait()
-
-        if proc.returncode == 0:
-            sys.stdout.write("\n")
-            verbose("Render completed successfully.")
-            conn.send(f"\nDONE: OK\nJOB_ID:{job_id}\n".encode())
+def track_progress(record, line):
+    """Update frame progress from one line of Blender output."""
+    match = FRAME_PROGRESS_RE.match(line)
+    if match:
+        record["current_frame"] = int(match.group(1))
+    elif line.startswith("Saved:") or line.startswith("Append frame"):
+        record["frames_rendered"] += 1
+        record["frames_done"] += 1
+        if record["frames_total"] is not None:
+            record["frames_done"] = min(record["frames_done"], record["frames_total"])
+
+def job_eta(record, now):
+    """Seconds of rendering left, from this job's progress or earlier timings of the same blend."""
+    if record["frames_total"] is None or not JOB_TRANSITIONS[record["state"]]:
+        return None
+    remaining = max(record["frames_total"] - record["frames_done"], 0)
+    if record["state"] == "rendering" and record["frames_rendered"]:
+        return remaining * (now - record["rendering_at"]) / record["frames_rendered"]
+    seconds_per_frame = frame_times.get(record["blend_hash"])
+    return remaining * seconds_per_frame if seconds_per_frame is not None else None
+
+def job_summary(record):
+    now = time.time()
+    summary = dict(record)
+    eta = job_eta(record, now)
+    summary["eta_seconds"] = round(eta, 1) if eta is not None else None
+    ended = now if JOB_TRANSITIONS[record["state"]] else record[f"{record['state']}_at"]
+    summary["elapsed_seconds"] = round(ended - record["submitted_at"], 1)
+    return summary
+
+# === JOB JOURNAL ===
+def journal(record, params=None):
+    """Queue the job's current record (and its parameters, once known) for the next journal write."""
+    job_id = record["job_id"]
+    if params is None:
+        previous = journal_pending.get(job_id)
+        params = previous[2] if previous else None
+    else:
+        params = json.dumps(params)
+    journal_pending[job_id] = (record["state"], json.dumps(record), params)
+
+def open_journal():
+    global journal_db
+    journal_db = sqlite3.connect(os.path.join(RENDER_ROOT, JOURNAL_FILE), check_same_thread=False)
+    journal_db.execute("PRAGMA journal_mode=WAL")
+    journal_db.execute("PRAGMA synchronous=NORMAL")
+    journal_db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, state TEXT NOT NULL,"
+        " record TEXT NOT NULL, params TEXT, updated_at REAL NOT NULL)"
+    )
+    journal_db.commit()
+
+def write_journal(rows):
+    """Write a batch of journal_pending entries in one transaction. Runs in an executor thread."""
+    now = time.time()
+    with journal_lock, journal_db:
+        journal_db.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id, row in rows if row is None])
+        journal_db.executemany(
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, ?) ON CONFLICT(job_id) DO UPDATE SET state = excluded.state,"
+            " record = excluded.record, params = COALESCE(excluded.params, jobs.params), updated_at = excluded.updated_at",
+            [(job_id, *row, now) for job_id, row in rows if row is not None],
+        )
+
+def flush_journal():
+    rows = list(journal_pending.items())
+    journal_pending.clear()
+    if rows and journal_db is not None:
+        write_journal(rows)
+
+async def journal_writer():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+        rows = list(journal_pending.items())
+        journal_pending.clear()
+        if rows:
+            try:
+                await loop.run_in_executor(None, write_journal, rows)
+            except sqlite3.Error as e:
+                error(f"Job journal write failed: {e}")
+
+def replay_journal():
+    """
+    Load the job journal. Finished jobs go back into the registry; queued and
+    interrupted ones are returned as (record, params) to run again. Jobs caught
+    mid-upload are marked failed, their clients resume the upload as a new job.
+    """
+    open_journal()
+    rows = journal_db.execute("SELECT record, params FROM jobs").fetchall()
+    entries = sorted(((json.loads(record), json.loads(params) if params else None) for record, params in rows),
+                     key=lambda entry: entry[0]["submitted_at"])
+    now = time.time()
+    resumed = []
+    for record, params in entries:
+        if not JOB_TRANSITIONS[record["state"]]:
+            jobs[record["job_id"]] = record
+            continue
+        if record["state"] == "uploading" or params is None or not os.path.isfile(params["blend_path"]):
+            record.update(state="failed", failed_at=now, error="Interrupted by a server restart")
+            jobs[record["job_id"]] = record
         else:
-            sys.stdout.write("\n")
-            verbose("Render failed.")
-            conn.send(f"\nDONE: ERROR\nJOB_ID:{job_id}\n".encode())
+            record.update(state="queued", queued_at=now, position=None, current_frame=None,
+                          frames_done=0, frames_rendered=0, restarts=record.get("restarts", 0) + 1)
+            track_job(record)
+            resumed.append((record, params))
+        journal(record)
+    forget_old_jobs()
+    return len(entries), resumed
 
+# === JOB FEEDS ===
+def publish(jid, event, **fields):
+    """Append an event to the feed of job `jid` and pass it on to attached clients."""
+    feed = job_feeds.get(jid)
+    if feed is None or feed["closed"]:
+        return
+    seq = feed["next"]
+    feed["next"] += 1
+    feed["entries"].append((seq, event, fields))
+    feed["done"] = feed["done"] or event == "done"
+    for channel, detached in feed["watchers"].items():
+        if channel.writer.is_closing() or channel.writer.transport.get_write_buffer_size() > ATTACH_MAX_BUFFER:
+            if not detached.done():
+                detached.set_result(None)
+        elif not detached.done():
+            channel.send(event, None, seq=seq, **fields)
+
+def close_feed(job_id, ok):
+    """End the job's feed with a `done` event, releasing attached clients."""
+    feed = job_feeds.get(job_id)
+    if feed is None or feed["closed"]:
+        return
+    if not feed["done"]:
+        publish(job_id, "done", ok=ok, job_id=job_id)
+    feed["closed"] = True
+    for detached in feed["watchers"].values():
+        if not detached.done():
+            detached.set_result(None)
+
+async def attach(channel, job_id, offset):
+    """Replay the job's feed from `offset`, then follow it until the job ends or the client leaves."""
+    feed = job_feeds.get(job_id)
+    if feed is None:
+        channel.send("error", f"ERR: Unknown job {job_id}\n", message=f"Unknown job {job_id}")
+        return
+    if channel.version == 1:
+        channel.send("error", "ERR: ATTACH needs protocol v2\n")
+        return
+    first = feed["entries"][0][0] if feed["entries"] else feed["next"]
+    record = jobs.get(job_id)
+    channel.send("attached", job_id=job_id, offset=max(offset, first), missed=max(first - offset, 0),
+                 state=record["state"] if record else None)
+    for seq, event, fields in list(feed["entries"]):
+        if seq >= offset:
+            channel.send(event, None, seq=seq, **fields)
+    await channel.writer.drain()
+    if feed["closed"]:
+        return
+
+    detached = asyncio.get_running_loop().create_future()
+    feed["watchers"][channel] = detached
+    # The client sends nothing more; a read returning means it hung up.
+    hangup = asyncio.ensure_future(channel.reader.read(1))
+    try:
+        await asyncio.wait([detached, hangup], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hangup.cancel()
+        feed["watchers"].pop(channel, None)
+
+# === TRACING ===
+def trace(job_id, name, start, end, tid=TRACE_JOB_TID, **args):
+    """Record a complete ("X") span on the job's timeline."""
+    timeline = job_traces.get(job_id)
+    if timeline is None:
+        return
+    timeline["events"].append({
+        "name": name, "ph": "X", "pid": TRACE_SERVER_PID, "tid": tid,
+        "ts": round(start * 1e6), "dur": round(max(end - start, 0) * 1e6), "args": args,
+    })
+
+def save_trace(job_id):
+    """Write the job's timeline to its job dir as Chrome trace JSON."""
+    timeline = job_traces.get(job_id)
+    job_dir = os.path.join(RENDER_ROOT, job_id)
+    if timeline is None or not os.path.isdir(job_dir):
+        return
+    metadata = [{"name": "process_name", "ph": "M", "pid": TRACE_SERVER_PID, "args": {"name": "server"}}]
+    metadata += [
+        {"name": "thread_name", "ph": "M", "pid": TRACE_SERVER_PID, "tid": tid, "args": {"name": name}}
+        for tid, name in timeline["threads"].items()
+    ]
+    path = os.path.join(job_dir, JOB_TRACE_NAME)
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump({"traceEvents": metadata + timeline["events"], "displayTimeUnit": "ms",
+                       "otherData": {"job_id": job_id, "clock": "server"}}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        verbose(f"Failed to save trace for {job_id}: {e}")
+
+def open_lane(job, name):
+    """A timeline row for one render call, tracking what its Blender output says it is doing."""
+    timeline = job_traces.get(job["job_id"])
+    tid = TRACE_JOB_TID
+    if timeline is not None:
+        tid = len(timeline["threads"])
+        timeline["threads"][tid] = name
+    return {"tid": tid, "name": name, "started": time.time(), "output_at": None, "frame": None, "frame_at": None,
+            "peak_mb": None}
+
+def trace_output(job, lane, fields, now):
+    """
+    Infer spans from one line of Blender output: launch lasts until the first
+    line, scene load until the first `Fra:` line, and each frame from its first
+    `Fra:` line to its `Saved:` line (or the next frame).
+    """
+    if lane["output_at"] is None:
+        lane["output_at"] = now
+        trace(job["job_id"], "launch", lane["started"], now, lane["tid"])
+    if fields is None:
+        return
+    frame = fields.get("frame")
+    if frame is not None and frame != lane["frame"]:
+        if lane["frame"] is None:
+            trace(job["job_id"], "load scene", lane["output_at"], now, lane["tid"])
+        elif lane["frame_at"] is not None:
+            trace(job["job_id"], f"frame {lane['frame']}", lane["frame_at"], now, lane["tid"])
+        lane["frame"], lane["frame_at"] = frame, now
+    if "saved" in fields and lane["frame_at"] is not None:
+        trace(job["job_id"], f"frame {lane['frame']}", lane["frame_at"], now, lane["tid"], saved=fields["saved"])
+        lane["frame_at"] = None
+
+def close_lane(job, lane, returncode):
+    now = time.time()
+    if lane["frame_at"] is not None:
+        trace(job["job_id"], f"frame {lane['frame']}", lane["frame_at"], now, lane["tid"])
+    trace(job["job_id"], lane["name"], lane["started"], now, lane["tid"], returncode=returncode)
+
+# === METRICS ===
+METRIC_HELP = {
+    "render_connections_total": ("counter", "Client connections accepted."),
+    "render_jobs_total": ("counter", "Render jobs finished, by outcome."),
+    "render_cache_hits_total": ("counter", "Requests answered entirely from the result cache."),
+    "render_bytes_received_total": ("counter", "Upload bytes received (after delta decoding)."),
+    "render_bytes_sent_total": ("counter", "Output file bytes sent to clients."),
+    "render_upload_seconds": ("histogram", "Time to receive a .blend upload."),
+    "render_queue_wait_seconds": ("histogram", "Time a job waited for its first render slot."),
+    "render_blender_startup_seconds": ("histogram", "Time from starting a render to its first frame."),
+    "render_frame_seconds": ("histogram", "Render time per frame."),
+    "render_job_seconds": ("histogram", "Time from submission to the end of a job."),
+}
+
+def count(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    counters[key] = counters.get(key, 0) + amount
+
+def observe(name, value, times=1):
+    """Add `times` observations of `value` to a histogram."""
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = [[0] * (len(HISTOGRAM_BUCKETS[name]) + 1), 0.0, 0]
+    histogram[0][bisect.bisect_left(HISTOGRAM_BUCKETS[name], value)] += times
+    histogram[1] += value * times
+    histogram[2] += times
+
+def directory_usage(root):
+    """Bytes allocated under `root`, counting hardlinked files (blob store, cache) once."""
+    seen = set()
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+    return total
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def render_metrics():
+    """All metrics in the Prometheus text format."""
+    status = node_status()
+    gauges = {
+        "render_queue_depth": ("Jobs waiting for a render slot.", status["queue_depth"]),
+        "render_active_jobs": ("Jobs holding a render slot.", status["active_jobs"]),
+        "render_slots": ("Configured render slots.", status["slots"]),
+        "render_free_cores": ("Cores not pinned to a running render slot.", status["free_cores"]),
+        "render_reserved_memory_mb": ("Memory reserved by running render slots.", round(reserved_memory_mb)),
+        "render_active_connections": ("Open client connections.", len(active_connections)),
+        "render_workers_idle": ("Warm Blender workers waiting for a job.", len(idle_workers)),
+        "render_workers_busy": ("Warm Blender workers rendering.", worker_stats["busy"]),
+        "render_blob_store_bytes": ("Size of the uploaded .blend store.", blob_store_usage),
+        "render_root_disk_bytes": ("Disk space used under RENDER_ROOT.", disk_usage[1]),
+    }
+    lines = []
+    for name, (help_text, value) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for name in ("started", "reused", "recycled"):
+        lines += [f"# TYPE render_workers_{name}_total counter", f"render_workers_{name}_total {worker_stats[name]}"]
+
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == "counter":
+            samples = [(labels, value) for (key, labels), value in counters.items() if key == name]
+            for labels, value in samples or [((), 0)]:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            continue
+        buckets, total, observations = histograms.get(name, [[0] * (len(HISTOGRAM_BUCKETS[name]) + 1), 0.0, 0])
+        cumulative = 0
+        for bound, observed in zip(HISTOGRAM_BUCKETS[name] + ("+Inf",), buckets):
+            cumulative += observed
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{name}_sum {total}", f"{name}_count {observations}"]
+    return "\n".join(lines) + "\n"
+
+async def handle_metrics(reader, writer):
+    global disk_usage
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] != b"/metrics":
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        else:
+            if time.time() - disk_usage[0] > DISK_USAGE_INTERVAL:
+                disk_usage = (time.time(), await asyncio.to_thread(directory_usage, RENDER_ROOT))
+            body = render_metrics().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+        await writer.drain()
     except Exception as e:
-        verbose(f"Exception: {e}")
+        verbose(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+# === WARM BLENDER WORKERS ===
+async def read_worker(worker, job=None, lane=None):
+    """
+    Read a worker's output up to its next driver event, relaying Blender's lines
+    to `job`. Returns (event, first_frame_at); event is None if the worker died.
+    """
+    first_frame_at = None
+    async for raw in worker["process"].stdout:
+        if shutdown_requested:
+            if job:
+                await notify(job, "error", "ERR: Server Stop Requested\n", message="Server Stop Requested")
+            worker["process"].terminate()
+            break
+        line = raw.decode(errors="ignore")
+        if line.startswith(DRIVER_PREFIX):
+            try:
+                return json.loads(line[len(DRIVER_PREFIX):]), first_frame_at
+            except ValueError:
+                continue
+        if job is None:
+            continue
+        if await forward_output(job, raw, lane) and first_frame_at is None:
+            first_frame_at = time.time()
+    return None, first_frame_at
+
+async def start_worker(blender, scripts_dir=None):
+    started = time.time()
+    proc = await asyncio.create_subprocess_exec(
+        blender, "-b", "--python", DRIVER_SCRIPT,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, limit=1 << 20,
+        env=blender_env(scripts_dir),
+    )
+    active_processes.add(proc)
+    worker = {"process": proc, "blender": blender, "scripts_dir": scripts_dir, "jobs": 0, "rss_mb": 0.0, "startup": None}
+    event, _ = await read_worker(worker)
+    if not event or event.get("event") != "ready":
+        await retire_worker(worker)
+        raise RuntimeError("Blender worker did not start")
+    worker["startup"] = time.time() - started
+    worker_stats["started"] += 1
+    verbose(f"Started Blender worker (pid {proc.pid}) in {worker['startup']:.2f}s")
+    return worker
+
+async def retire_worker(worker):
+    proc = worker["process"]
+    active_processes.discard(proc)
+    if proc.returncode is None:
+        # The driver exits once stdin closes.
         try:
-            conn.send(f"ERR: {e}\n".encode())
-        except:
-            pass
+            proc.stdin.close()
+            await asyncio.wait_for(proc.wait(), timeout=10)
+        except (asyncio.TimeoutError, OSError):
+            proc.kill()
+            await proc.wait()
+
+async def acquire_worker(blender, scripts_dir=None):
+    """Take an idle worker running `blender` with the add-ons in `scripts_dir`, or start one. Returns (worker, reused)."""
+    for worker in reversed(idle_workers):
+        if worker["blender"] != blender or worker["scripts_dir"] != scripts_dir:
+            continue
+        idle_workers.remove(worker)
+        if worker["process"].returncode is None:
+            return worker, True
+        await retire_worker(worker)
+        return await acquire_worker(blender, scripts_dir)
+    # Every add-on set or Blender version gets its own worker; make room rather
+    # than keep one more idle Blender around per combination ever seen.
+    if idle_workers and len(idle_workers) + worker_stats["busy"] >= MAX_CONCURRENT_JOBS:
+        await retire_worker(idle_workers.pop(0))
+    return await start_worker(blender, scripts_dir), False
+
+async def release_worker(worker, healthy):
+    if healthy and not shutdown_requested and worker["jobs"] < WORKER_MAX_JOBS and worker["rss_mb"] < WORKER_MAX_RSS_MB:
+        idle_workers.append(worker)
+        # At most one idle worker per render slot; the oldest goes first.
+        while len(idle_workers) > MAX_CONCURRENT_JOBS:
+            await retire_worker(idle_workers.pop(0))
+        return
+    if healthy:
+        worker_stats["recycled"] += 1
+        verbose(f"Recycling Blender worker (pid {worker['process'].pid}) after {worker['jobs']} job(s), {worker['rss_mb']:.0f} MB")
+    await retire_worker(worker)
+
+async def run_in_worker(job, request, lane=None, slot=None):
+    """Render `request` on a warm worker pinned to the cores of `slot`. Returns (returncode, stats) like run_blender."""
+    worker, reused = await acquire_worker(job["blender"], job["scripts_dir"])
+    if reused:
+        worker_stats["reused"] += 1
+        worker_stats["startup_saved"] += worker["startup"]
+        await notify(job, "worker", f"WORKER: Reusing a warm Blender process (saved ~{worker['startup']:.2f}s startup)\n",
+                     startup_saved=round(worker["startup"], 3))
+    verbose(f"Rendering on Blender worker (pid {worker['process'].pid}): {request}")
+
+    launched = time.time()
+    event = None
+    worker_stats["busy"] += 1
+    try:
+        if slot is not None:
+            slot["pid"] = worker["process"].pid
+        pin_process(worker["process"].pid, slot["cpus"] if slot and slot["cpus"] else slot_cpus)
+        worker["process"].stdin.write(json.dumps(request).encode() + b"\n")
+        await worker["process"].stdin.drain()
+        event, first_frame_at = await read_worker(worker, job, lane)
     finally:
-        if conn in active_connections:
-            active_connections.remove(conn)
-        conn.close()
+        worker_stats["busy"] -= 1
+        if slot is not None:
+            slot["pid"] = None
+        worker["jobs"] += 1
+        if event:
+            worker["rss_mb"] = event.get("rss_mb", 0.0)
+        elif worker["process"].returncode is None:
+            # Cancelled mid-render: don't wait for the driver to finish it.
+            worker["process"].kill()
+        await release_worker(worker, healthy=event is not None)
 
+    finished = time.time()
+    stats = {
+        "startup": (first_frame_at or finished) - launched,
+        "rendering": finished - (first_frame_at or finished),
+        "peak_mb": event.get("peak_rss_mb") if event else None,
+    }
+    if event and not event.get("ok"):
+        verbose(f"Worker render failed: {event.get('error')}")
+    return (0 if event and event.get("ok") else 1), stats
 
-def render_worker():
-    while not shutdown_requested:
+async def render(job, start=None, end=None, animation=True, ticket=None, region=None):
+    """
+    Render frames `start`-`end` of `job` (the whole scene when unset, one still
+    when not `animation`) on the cores of the slot `ticket` holds. A `region`
+    (see render_regions) renders only that part of the still, to its own file.
+    """
+    result = None
+    ticket = ticket or job["ticket"]
+    cpus = ticket["cpus"]
+    lane = open_lane(job, f"region {region['index']}" if region is not None else
+                     f"frames {start}-{end}" if start is not None and start != end else
+                     f"frame {start}" if start is not None else "render")
+    if WARM_WORKERS:
+        request = {
+            "blend": job["blend_path"], "output": job["output_path"], "format": job["output_format"],
+            "start": start, "end": end, "animation": animation, "threads": len(cpus), "addons": job["addons"],
+        }
+        if region is not None:
+            request.update(output=region["output"], format=region["format"], border=region["border"])
         try:
-            job_data = job_queue.get(timeout=1)
-        except queue.Empty:
+            result = await run_in_worker(job, request, lane, ticket)
+        except RuntimeError as e:
+            verbose(f"{e}; falling back to a fresh Blender process")
+
+    if result is None:
+        render_cmd = list(job["render_cmd"])
+        if cpus:
+            render_cmd += ["-t", str(len(cpus))]
+        if region is not None:
+            # Arguments apply in order, so these override the job's -o/-F before -f renders.
+            render_cmd += ["--python-expr", border_expr(region["border"]), "-o", region["output"], "-F", region["format"]]
+        if not animation:
+            render_cmd += ["-f", str(start)]
+        elif start is not None:
+            render_cmd += ["-s", str(start), "-e", str(end), "-a"]
+        else:
+            render_cmd += ["-a"]
+        lane["started"] = time.time()
+        result = await run_blender(job, render_cmd, lane, ticket)
+
+    returncode, stats = result
+    close_lane(job, lane, returncode)
+    peak_mb = max(stats["peak_mb"] or 0.0, lane["peak_mb"] or 0.0)
+    if returncode == 0 and peak_mb:
+        record_peak_memory(job["blend_hash"], peak_mb)
+    observe("render_blender_startup_seconds", stats["startup"])
+    if returncode == 0 and start is not None and region is None:
+        frames = (end - start) // job.get("frame_step", 1) + 1
+        record_frame_time(job["blend_hash"], frames, stats["rendering"])
+        observe("render_frame_seconds", stats["rendering"] / frames, frames)
+    return result
+
+async def finish_job(job, ok):
+    sys.stdout.write("\n")
+    if job.get("progress_pending") and "progress" in job["capabilities"]:
+        await send_progress(job)
+    await finish_streaming(job, ok)
+    set_job_state(job["record"], "done" if ok else "failed")
+    if ok or job["per_frame"]:
+        # Frames a failed job did render are reused when it is submitted again.
+        record_results(job)
+    if ok:
+        verbose(f"Render completed successfully: {job['job_id']}")
+        await notify(job, "done", f"\nDONE: OK\nJOB_ID:{job['job_id']}\n", ok=True, job_id=job["job_id"],
+                     failed_frames=sorted(job.get("failed_frames") or []))
+    else:
+        verbose(f"Render failed: {job['job_id']}")
+        await notify(job, "done", f"\nDONE: ERROR\nJOB_ID:{job['job_id']}\n", ok=False, job_id=job["job_id"])
+    if job["channel"] is not None:
+        await close_connection(job["channel"])
+
+# === FRAME CHECKPOINTS ===
+def valid_frame_file(path, output_format):
+    """Whether a frame file is complete: non-empty and, for formats with a known
+    signature, starting and ending with it (a crash mid-write truncates it)."""
+    head, tail = FRAME_SIGNATURES.get(output_format, (b"", b""))
+    try:
+        size = os.path.getsize(path)
+        if size < max(len(head) + len(tail), 1):
+            return False
+        with open(path, "rb") as f:
+            if f.read(len(head)) != head:
+                return False
+            f.seek(size - len(tail))
+            return f.read(len(tail)) == tail
+    except OSError:
+        return False
+
+def checkpointed_frames(job_dir, frames, output_format):
+    """Frames of `frames` with a valid output file in `job_dir`. Incomplete files are deleted."""
+    wanted = set(frames)
+    found = set()
+    for name in os.listdir(job_dir):
+        match = FRAME_FILE_RE.match(name)
+        if not match or int(match.group(1)) not in wanted:
+            continue
+        path = os.path.join(job_dir, name)
+        if valid_frame_file(path, output_format):
+            found.add(int(match.group(1)))
             continue
+        verbose(f"Discarding incomplete frame file {path}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return found
+
+def checkpoint_frame(job, path):
+    """Mark the frame a Saved: line names as rendered, once its file checks out."""
+    match = FRAME_FILE_RE.match(os.path.basename(path))
+    if (match and os.path.dirname(os.path.realpath(path)) == os.path.realpath(job["job_dir"])
+            and valid_frame_file(path, job["output_format"])):
+        job["done_frames"].add(int(match.group(1)))
+        job["frames_saved"] += 1
+
+async def retry_frames(job, missing):
+    """
+    Requeue the frames of a failed chunk that weren't saved. Blender renders a
+    chunk in order, so only the first of them was attempted: that one is charged
+    a retry and rendered on its own from now on, the rest go back as they were.
+    """
+    if not missing or shutdown_requested:
+        return
+    frame = missing[0]
+    attempts = job["frame_attempts"][frame] = job["frame_attempts"].get(frame, 0) + 1
+    for other in missing[1:]:
+        bisect.insort(job["pending_frames"], other)
+    if attempts <= FRAME_RETRIES:
+        bisect.insort(job["pending_frames"], frame)
+        verbose(f"Frame {frame} of job {job['job_id']} failed, retrying ({attempts}/{FRAME_RETRIES})")
+        await notify(job, "retry", f"RETRY: Frame {frame} failed, retrying ({attempts}/{FRAME_RETRIES})\n",
+                     frame=frame, attempt=attempts, retries=FRAME_RETRIES)
+    elif not job["frames_saved"]:
+        # No frame of this job has rendered at all: the job is broken, not the frame.
+        job["failed"] = True
+        job["pending_frames"].clear()
+    else:
+        verbose(f"Frame {frame} of job {job['job_id']} failed {attempts} times, skipping it")
+        job["failed_frames"].append(frame)
+
+# === STILL REGIONS ===
+def check_regions(header):
+    """Validate a job's `regions` option. Raises ValueError for jobs it can't apply to."""
+    value = header["options"]["regions"]
+    if value != "auto" and not (value.isdigit() and int(value) > 0):
+        raise ValueError(f"Invalid regions option: {value}")
+    if header["render_type"] == "animation" or "frames" in header["options"]:
+        raise ValueError("Region rendering only applies to single images.")
+    if header["output_format"] not in REGION_FORMATS:
+        raise ValueError(f"Region rendering can't stitch {header['output_format']} output; "
+                         f"use one of {', '.join(REGION_FORMATS)}.")
 
-        conn = job_data["conn"]
-        addr = job_data["addr"]
-        process_render_job(conn, addr)
-        job_queue.task_done()
+def region_count(requested, width, height):
+    """Number of regions to split a `width`x`height` still into for a `regions=` option."""
+    count = 1 + free_slots if requested == "auto" else int(requested)
+    return max(1, min(count, REGION_MAX, height, width * height // REGION_MIN_PIXELS))
 
-for _ in range(MAX_CONCURRENT_JOBS):
-    threading.Thread(target=render_worker, daemon=True).start()
+def border_edge(pixel, size):
+    # Blender truncates border * size to whole pixels; aim at the middle of the
+    # pixel so float rounding can't move the edge.
+    return min((pixel + 0.5) / size, 1.0)
+
+def border_expr(border):
+    """--python-expr enabling a cropped border render of (min_x, max_x, min_y, max_y)."""
+    return ("import bpy; r = bpy.context.scene.render; r.use_border = r.use_crop_to_border = True; "
+            "r.border_min_x, r.border_max_x, r.border_min_y, r.border_max_y = {!r}, {!r}, {!r}, {!r}".format(*border))
+
+async def run_region(job, region, ticket=None):
+    """
+    Render one region, on the job's own slot when `ticket` is given, else on a
+    slot it queues for. A failed region is retried up to FRAME_RETRIES times.
+    Returns True once its file is written.
+    """
+    own = ticket is None
+    if own:
+        ticket = chunk_ticket(job)
+        waited = time.time()
+        await acquire_slot(ticket)
+        trace(job["job_id"], "region queue wait", waited, time.time())
+    try:
+        if valid_frame_file(region["path"], region["format"]):
+            # Rendered before the job was interrupted.
+            return True
+        for attempt in range(FRAME_RETRIES + 1):
+            if shutdown_requested:
+                return False
+            try:
+                returncode, _ = await render(job, 1, 1, animation=False, ticket=ticket, region=region)
+            except Exception as e:
+                verbose(f"Region {region['index']} of job {job['job_id']} failed: {e}")
+                returncode = -1
+            if returncode == 0 and valid_frame_file(region["path"], region["format"]):
+                return True
+            if attempt < FRAME_RETRIES:
+                await notify(job, "retry", f"RETRY: Region {region['index']} failed, retrying ({attempt + 1}/{FRAME_RETRIES})\n",
+                             region=region["index"], attempt=attempt + 1, retries=FRAME_RETRIES)
+        return False
+    finally:
+        if own:
+            release_slot(ticket)
+
+async def render_regions(job, requested):
+    """
+    Render the still of `job` as horizontal regions in parallel and stitch them
+    into frame 1. Falls back to one plain render when the image is too small to
+    split or its size can't be probed. Returns True once the image is written.
+    """
+    size = await probe_resolution(job["blend_path"], job["blend_hash"], job["blender"])
+    count = region_count(requested, *size) if size else 1
+    if count < 2:
+        returncode, _ = await render(job, 1, 1, animation=False)
+        return returncode == 0
+
+    width, height = size
+    region_format = REGION_FORMATS[job["output_format"]]
+    regions_dir = os.path.join(job["job_dir"], "regions")
+    os.makedirs(regions_dir, exist_ok=True)
+    # Blender's border y runs from the bottom, like the pixel rows of its images.
+    edges = [round(i * height / count) for i in range(count + 1)]
+    regions = [{
+        "index": i,
+        "y": edges[i],
+        "border": (0.0, 1.0, border_edge(edges[i], height), border_edge(edges[i + 1], height)),
+        "output": os.path.join(regions_dir, f"region_{i:02d}_of_{count:02d}_#####"),
+        "path": os.path.join(regions_dir, f"region_{i:02d}_of_{count:02d}_00001{FORMAT_EXTENSIONS[region_format]}"),
+        "format": region_format,
+    } for i in range(count)]
+    verbose(f"Splitting the {width}x{height} still of job {job['job_id']} into {count} regions")
+    await notify(job, "regions", f"REGIONS: Rendering {width}x{height} as {count} regions\n",
+                 count=count, width=width, height=height)
+
+    # The first region runs on the slot the job holds; the others queue for free slots.
+    rendered = await asyncio.gather(run_region(job, regions[0], job["ticket"]),
+                                    *(run_region(job, region) for region in regions[1:]))
+    if not all(rendered):
+        return False
+
+    output = os.path.join(job["job_dir"], f"frame_00001{FORMAT_EXTENSIONS[job['output_format']]}")
+    request = {"stitch": {
+        "tiles": [{"path": region["path"], "x": 0, "y": region["y"]} for region in regions],
+        "width": width, "height": height, "output": output, "format": job["output_format"],
+    }}
+    started = time.time()
+    if WARM_WORKERS:
+        try:
+            returncode, _ = await run_in_worker(job, request, slot=job["ticket"])
+        except RuntimeError as e:
+            verbose(f"Stitching job {job['job_id']} failed: {e}")
+            return False
+    else:
+        stitch_cmd = [job["blender"], "-b", "--python", DRIVER_SCRIPT, "--", json.dumps(request)]
+        returncode, _ = await run_blender(job, stitch_cmd, slot=job["ticket"])
+    trace(job["job_id"], "stitch", started, time.time(), regions=count)
+    if returncode != 0 or not valid_frame_file(output, job["output_format"]):
+        return False
+    shutil.rmtree(regions_dir, ignore_errors=True)
+    return True
+
+# === ANIMATION CHUNKING ===
+def chunk_size(job):
+    """Pick the next chunk length in frames for an animation job."""
+    fair_share = -(-len(job["pending_frames"]) // MAX_CONCURRENT_JOBS)
+    if job["frame_seconds"] is None:
+        size = CHUNK_INITIAL_FRAMES
+    else:
+        # Enough frames that Blender startup is at most CHUNK_MAX_STARTUP_SHARE of the chunk.
+        overhead_ratio = (1 - CHUNK_MAX_STARTUP_SHARE) / CHUNK_MAX_STARTUP_SHARE
+        size = round(overhead_ratio * job["startup_seconds"] / max(job["frame_seconds"], 1e-3))
+    return max(1, min(size, CHUNK_MAX_FRAMES, fair_share))
+
+def claim_chunk(job):
+    """
+    Reserve the next run of consecutive pending frames. Returns (start, end) or
+    None. Frames being retried are claimed one at a time.
+    """
+    pending = job["pending_frames"]
+    if not pending:
+        return None
+    retried = job["frame_attempts"]
+    count = 1
+    limit = chunk_size(job) if pending[0] not in retried else 1
+    while (count < min(limit, len(pending)) and pending[count] == pending[count - 1] + job["frame_step"]
+           and pending[count] not in retried):
+        count += 1
+    start, end = pending[0], pending[count - 1]
+    del pending[:count]
+    return start, end
+
+async def render_chunk(job, start, end, ticket):
+    verbose(f"Rendering frames {start}-{end} of job {job['job_id']} on {len(ticket['cpus']) or 'all'} core(s)")
+    try:
+        returncode, stats = await render(job, start, end, ticket=ticket)
+    except Exception as e:
+        verbose(f"Chunk {start}-{end} of job {job['job_id']} failed: {e}")
+        returncode, stats = -1, None
+
+    job["record"]["frames_done"] = len(job["done_frames"])
+    missing = [frame for frame in range(start, end + 1, job["frame_step"]) if frame not in job["done_frames"]]
+    if returncode != 0 or missing:
+        await retry_frames(job, missing)
+        return
+
+    frames = (end - start) // job["frame_step"] + 1
+    frame_seconds = stats["rendering"] / frames
+    if job["frame_seconds"] is None:
+        job["frame_seconds"] = frame_seconds
+        job["startup_seconds"] = stats["startup"]
+    else:
+        job["frame_seconds"] = 0.5 * job["frame_seconds"] + 0.5 * frame_seconds
+        job["startup_seconds"] = 0.5 * job["startup_seconds"] + 0.5 * stats["startup"]
+
+async def run_chunks(job, slot_held=False):
+    """Render chunks of `job`, taking a render slot for each one, until its frames run out."""
+    ticket = job["ticket"] if slot_held else None
+    try:
+        while not shutdown_requested and job["pending_frames"]:
+            if ticket is None:
+                ticket = chunk_ticket(job)
+                waited = time.time()
+                await acquire_slot(ticket)
+                trace(job["job_id"], "chunk queue wait", waited, time.time())
+            claimed = claim_chunk(job)
+            if claimed is None:
+                return
+            await render_chunk(job, *claimed, ticket)
+
+            if job["pending_frames"] and not shutdown_requested:
+                # Queue for the next chunk before giving up this slot, so the
+                # scheduler weighs this job against the others waiting.
+                previous, ticket = ticket, chunk_ticket(job)
+                waited = time.time()
+                try:
+                    await acquire_slot(ticket, releasing=previous)
+                except BaseException:
+                    ticket = None
+                    raise
+                trace(job["job_id"], "chunk queue wait", waited, time.time())
+    finally:
+        if ticket is not None:
+            release_slot(ticket)
+
+def chunk_ticket(job):
+    base = job["ticket"]
+    return make_ticket(job["job_id"], base["client"], base["priority"], base["estimate"], seq=base["seq"], chunk=True,
+                       memory_mb=expected_memory(job["blend_hash"]))
+
+def announce_blender(channel, header):
+    """
+    Tell the client which Blender a `blender=` request resolved to. Sent only
+    after the HAVE/SEND exchange: v1 peers read the first line as the blob reply.
+    """
+    requested = header["options"].get("blender")
+    if requested:
+        channel.send("blender", f"BLENDER: Rendering with {header['blender']} (requested {requested})\n",
+                     version=header["blender"], requested=requested)
+
+async def process_render_job(channel, addr, request):
+    job_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f") + "_" + str(uuid.uuid4())[:8]
+    record = None
+    queued = False
+    try:
+        try:
+            if channel.version == 1:
+                header = parse_job_header(request)
+            elif request.get("type") == "job":
+                header = job_header_from_message(request)
+            else:
+                raise ValueError("Expected a job message.")
+            priority = int(header["options"].get("priority", 0))
+            header["blender"] = resolve_blender(header["options"].get("blender"))
+        except ValueError:
+            channel.send("error", "ERR: Invalid header format.\n", message="Invalid header format.")
+            verbose("Invalid header format.")
+            await close_connection(channel)
+            return
+        if "regions" in header["options"]:
+            try:
+                check_regions(header)
+            except ValueError as e:
+                channel.send("error", f"ERR: {e}\n", message=str(e))
+                verbose(f"Refused job: {e}")
+                await close_connection(channel)
+                return
+
+        job_dir = os.path.join(RENDER_ROOT, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        blend_path = os.path.join(job_dir, header["blend_name"])
+        use_cache = header["options"].get("cache", "1") != "0"
+        claimed_hash = header["options"].get("sha256", "").lower()
+        client = header["options"].get("client") or addr[0]
+        record = register_job(job_id, header, client, priority, claimed_hash if valid_digest(claimed_hash) else None)
+        job_tasks[job_id] = asyncio.current_task()
+        trace(job_id, "handshake", channel.opened_at, record["submitted_at"], protocol=channel.version)
+
+        # Fully cached requests are answered before queueing: no upload, slot or Blender.
+        if use_cache and valid_digest(claimed_hash):
+            cached_job_id = cached_outputs(claimed_hash, header, job_id, job_dir)
+            if cached_job_id:
+                if cached_job_id != job_id:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    forget_job(job_id)
+                else:
+                    record["frames_done"] = record["frames_total"] or 0
+                    set_job_state(record, "done")
+                count("render_cache_hits_total")
+                verbose(f"Request from {addr} served from result cache: {cached_job_id}")
+                channel.send("have", f"HAVE: {claimed_hash}\n", sha256=claimed_hash)
+                announce_blender(channel, header)
+                channel.send("job", job_id=cached_job_id)
+                channel.send("cached", "CACHED: All outputs reused from earlier renders.\n", complete=True)
+                if "stream-frames" in channel.capabilities:
+                    await send_files(channel, output_files(os.path.join(RENDER_ROOT, cached_job_id)))
+                channel.send("done", f"\nDONE: OK\nJOB_ID:{cached_job_id}\n", ok=True, job_id=cached_job_id)
+                await close_connection(channel)
+                return
+
+        # Add-ons and then the .blend: the job is only queued once both are confirmed.
+        scripts_dir, addons = await sync_addons(channel, header)
+        if offer_blob(channel, header, blend_path):
+            blend_hash = claimed_hash
+            verbose(f"Blend file reused from store: {blend_path}")
+        else:
+            blend_hash, upload_stats = await receive_blend(channel, header, blend_path)
+            observe("render_upload_seconds", time.time() - record["submitted_at"])
+            trace(job_id, "upload", record["submitted_at"], time.time(), stats=upload_stats)
+            verbose(f"Blend file received: {blend_path} ({upload_stats})")
+            channel.send("upload", f"UPLOAD: {upload_stats}\n", message=upload_stats)
+        announce_blender(channel, header)
+        record["blend_hash"] = blend_hash
+        set_job_state(record, "queued")
+
+        params = {
+            "header": header, "blend_path": blend_path, "blend_hash": blend_hash,
+            "scripts_dir": scripts_dir, "addons": addons,
+        }
+        journal(record, params)
+        channel.send("job", f"JOB: {job_id}\n", job_id=job_id)
+        channel.send("queued", "QUEUED: Your request has been added to the queue.\n", position=None)
+        publish(job_id, "job", job_id=job_id)
+        publish(job_id, "queued", position=None)
+        verbose(f"Job queued from {addr} (client {client}, priority {priority})")
+        if header["options"].get("detach") == "1":
+            # Progress goes to the feed only; the client reattaches or fetches later.
+            channel.send("detached", f"DETACHED: {job_id}\n", job_id=job_id)
+            await close_connection(channel)
+            channel = None
+        queued = True
+    except asyncio.CancelledError:
+        if record is None or not record.get("cancel_requested"):
+            raise
+        await job_cancelled(channel, record)
+        return
+    except Exception as e:
+        await job_error(channel, job_id, e)
+        return
+    finally:
+        if record is not None and not queued:
+            end_job(record)
+    await run_job(record, params, channel)
+
+async def run_job(record, params, channel=None):
+    """
+    Queue, render and finish a received job. Without a `channel` (a detached
+    job, or one resumed from the journal) its events only go to its feed.
+    """
+    job_id = record["job_id"]
+    header = params["header"]
+    blend_path, blend_hash = params["blend_path"], params["blend_hash"]
+    scripts_dir, addons = params["scripts_dir"], params["addons"]
+    job_dir = os.path.join(RENDER_ROOT, job_id)
+    use_cache = header["options"].get("cache", "1") != "0"
+    priority = record["priority"]
+    ticket = None
+    job = None
+    streamer = None
+    slot_held = False
+    job_tasks[job_id] = asyncio.current_task()
+    try:
+        ticket = make_ticket(job_id, record["client"], priority, expected_seconds(blend_hash, header), channel,
+                             memory_mb=expected_memory(blend_hash))
+        await acquire_slot(ticket)
+        slot_held = True
+        running_jobs.add(job_id)
+        observe("render_queue_wait_seconds", time.time() - record["queued_at"])
+        trace(job_id, "queue wait", record["queued_at"], time.time(), priority=priority, cores=len(ticket["cpus"]))
+
+        render_type = header["render_type"]
+        output_format = header["output_format"]
+        output_path = os.path.join(job_dir, "frame_#####")
+        blender = blender_installs.get(header["blender"], BLENDER_PATH)
+
+        job = {
+            "job_id": job_id,
+            "job_dir": job_dir,
+            "blend_path": blend_path,
+            "output_path": output_path,
+            "output_format": output_format,
+            "blend_hash": blend_hash,
+            "ticket": ticket,
+            "record": record,
+            "channel": channel,
+            "capabilities": channel.capabilities if channel is not None else set(SERVER_CAPABILITIES),
+            "client_gone": channel is None,
+            "outbox": None,
+            "streamed": set(),
+            "blender": blender,
+            "scripts_dir": scripts_dir,
+            "addons": addons,
+            "render_cmd": [
+                blender, "-b", *(["--addons", ",".join(addons)] if addons else []), blend_path,
+                "-o", output_path,
+                "-F", output_format,
+            ],
+        }
+        if channel is not None and "stream-frames" in channel.capabilities:
+            job["outbox"] = asyncio.Queue()
+            job["streamer"] = streamer = asyncio.create_task(stream_outputs(job))
+
+        # A coordinator hands out explicit frame ranges; otherwise ask Blender.
+        frame_range = None
+        if "frames" in header["options"]:
+            frame_range = parse_frame_range(header["options"]["frames"])
+        elif render_type == "animation" and output_format != "FFMPEG":
+            frame_range = await probe_frame_range(blend_path, blend_hash, job["blender"])
+
+        job["frame_step"] = frame_range[2] if frame_range else 1
+        set_job_state(record, "rendering")
+
+        # Movie output can't be assembled from independently rendered chunks,
+        # so it is rendered and cached as a whole.
+        frames = None if output_format == "FFMPEG" else requested_frames(header, frame_range)
+        job["per_frame"] = frames is not None
+        if frames is not None:
+            record["frames_total"] = len(frames)
+        elif frame_range is not None:
+            record["frames_total"] = len(range(frame_range[0], frame_range[1] + 1, frame_range[2]))
+        job["cache_key"] = result_key(blend_hash, header, job["per_frame"])
+
+        if frames is None:
+            earlier = cached_job(job["cache_key"]) if use_cache else None
+            if earlier:
+                job["job_id"] = earlier
+                job["job_dir"] = os.path.join(RENDER_ROOT, earlier)
+                await notify(job, "cached", "CACHED: All outputs reused from earlier renders.\n", complete=True)
+                shutil.rmtree(job_dir, ignore_errors=True)
+                await finish_job(job, True)
+                return
+
+            await notify(job, "processing", "PROCESSING: Your job is now rendering.\n")
+            if frame_range is not None:
+                returncode, _ = await render(job, frame_range[0], frame_range[1])
+            else:
+                returncode, _ = await render(job)
+            await finish_job(job, returncode == 0)
+            return
+
+        cached = cached_frames(job["cache_key"], frames) if use_cache else {}
+        if cached:
+            link_cached_frames(cached, job_dir)
+            await notify(job, "cached", f"CACHED: {len(cached)} of {len(frames)} frame(s) reused from earlier renders.\n",
+                         complete=False, frames=len(cached), total=len(frames))
+        # Frames left in the job dir by a run that crashed or was restarted count as rendered.
+        done = checkpointed_frames(job_dir, frames, output_format)
+        resumed = len(done - set(cached))
+        record["frames_done"] = len(done)
+        if resumed:
+            await notify(job, "resumed", f"RESUMED: {resumed} of {len(frames)} frame(s) already rendered.\n",
+                         frames=resumed, total=len(frames))
+        pending = [frame for frame in frames if frame not in done]
+        if not pending:
+            await finish_job(job, True)
+            return
+
+        await notify(job, "processing", "PROCESSING: Your job is now rendering.\n")
+        if render_type != "animation" and "frames" not in header["options"]:
+            if "regions" in header["options"]:
+                ok = await render_regions(job, header["options"]["regions"])
+            else:
+                returncode, _ = await render(job, 1, 1, animation=False)
+                ok = returncode == 0
+            await finish_job(job, ok)
+            return
+
+        job.update({
+            "pending_frames": pending,
+            "frame_seconds": None,
+            "startup_seconds": None,
+            "failed": False,
+            "done_frames": done,
+            "frames_saved": 0,
+            "frame_attempts": {},
+            "failed_frames": [],
+        })
+        verbose(f"Splitting {len(pending)} frame(s) of job {job_id} into chunks")
+
+        # One runner continues on the slot we already hold; the others queue for
+        # free slots alongside other jobs.
+        runners = [run_chunks(job, slot_held=True)]
+        runners += [run_chunks(job) for _ in range(MAX_CONCURRENT_JOBS - 1)]
+        slot_held = False
+        await asyncio.gather(*runners)
+        # Frames that failed every retry are left out; the job still succeeds with the rest.
+        failed = sorted(job["failed_frames"])
+        if failed:
+            record["failed_frames"] = failed
+            message = f"Frame(s) {', '.join(map(str, failed))} failed after {FRAME_RETRIES} retries and were skipped"
+            await notify(job, "skipped", f"SKIPPED: {message}\n", message=message, frames=failed)
+        await finish_job(job, not job["failed"] and done.issuperset(set(frames) - set(failed)))
+
+    except asyncio.CancelledError:
+        if not record.get("cancel_requested"):
+            raise
+        await job_cancelled(channel, record)
+    except Exception as e:
+        await job_error(channel, job_id, e)
+    finally:
+        if streamer is not None and not streamer.done():
+            streamer.cancel()
+        if job is not None and job.get("log_file") is not None:
+            job["log_file"].close()
+        if slot_held:
+            release_slot(ticket)
+        end_job(record)
+
+async def job_cancelled(channel, record):
+    """Tell the feed and the client, if still connected, that CANCEL stopped the job."""
+    job_id = record["job_id"]
+    verbose(f"Job {job_id} cancelled")
+    if JOB_TRANSITIONS[record["state"]]:
+        set_job_state(record, "cancelled")
+    publish(job_id, "error", message="Job cancelled")
+    if channel is None:
+        return
+    try:
+        # The lock lets a frame the streamer is sending finish first.
+        async with channel.lock:
+            channel.send("error", "ERR: Job cancelled\n", message="Job cancelled")
+            channel.send("done", f"\nDONE: ERROR\nJOB_ID:{job_id}\n", ok=False, job_id=job_id)
+            await channel.writer.drain()
+    except Exception:
+        pass
+    await close_connection(channel)
+
+async def job_error(channel, job_id, e):
+    verbose(f"Exception: {e}")
+    publish(job_id, "error", message=str(e))
+    if channel is None:
+        return
+    try:
+        channel.send("error", f"ERR: {e}\n", message=str(e))
+    except:
+        pass
+    await close_connection(channel)
+
+def end_job(record):
+    """Registry bookkeeping once a job's task is over, however it ended."""
+    job_id = record["job_id"]
+    if JOB_TRANSITIONS[record["state"]] and job_id in jobs:
+        set_job_state(record, "failed")
+    running_jobs.discard(job_id)
+    job_tasks.pop(job_id, None)
+    close_feed(job_id, record["state"] == "done")
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Blender render server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--render-root", default=RENDER_ROOT)
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_JOBS,
+                        help="Concurrent Blender processes (0 = size from cores and memory)")
+    parser.add_argument("--no-pin", action="store_true",
+                        help="Let every Blender process use all cores instead of pinning each slot to its own")
+    parser.add_argument("--memory-reserve-mb", type=int, default=MEMORY_RESERVE_MB,
+                        help="Memory kept free for the system when admitting jobs")
+    parser.add_argument("--blender", help="Use this Blender executable instead of installing one")
+    parser.add_argument("--blender-version", action="append", metavar="VERSION",
+                        help=f"Blender release to keep installed (repeatable; the first is the default, default {BLENDER_VERSIONS[0]})")
+    parser.add_argument("--blender-archive", action="append", default=[], metavar="TARBALL",
+                        help="Install Blender from a local tarball, checked against TARBALL.sha256 if present (repeatable)")
+    parser.add_argument("--blender-dir", default=BLENDER_INSTANCE_DIR, help="Blender install cache")
+    parser.add_argument("--coordinator", help="HOST:PORT of a coordinator to register with")
+    parser.add_argument("--socket-buffer", type=int, default=SOCKET_BUFFER_SIZE,
+                        help="SO_RCVBUF/SO_SNDBUF in bytes (0 keeps kernel autotuning)")
+    parser.add_argument("--shortest-job-first", action="store_true",
+                        help="Within a priority level, prefer jobs with the shortest expected render time")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Start a fresh Blender process per render instead of reusing warm workers")
+    parser.add_argument("--worker-max-jobs", type=int, default=WORKER_MAX_JOBS, help="Recycle a warm worker after this many renders")
+    parser.add_argument("--worker-max-rss-mb", type=int, default=WORKER_MAX_RSS_MB, help="Recycle a warm worker above this resident memory")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Serve Prometheus metrics on this port (0 = off)")
+    parser.add_argument("--blob-budget-gb", type=float, default=BLOB_STORE_BUDGET / 1024**3,
+                        help="Size of the uploaded .blend store before LRU eviction")
+    args = parser.parse_args()
+
+    BLOB_STORE_BUDGET = int(args.blob_budget_gb * 1024**3)
+    HOST, PORT, MAX_CONCURRENT_JOBS = args.host, args.port, args.workers
+    SOCKET_BUFFER_SIZE = args.socket_buffer
+    METRICS_PORT = args.metrics_port
+    WARM_WORKERS = not args.cold_start
+    PIN_CPUS, MEMORY_RESERVE_MB = not args.no_pin, args.memory_reserve_mb
+    SHORTEST_JOB_FIRST = args.shortest_job_first
+    WORKER_MAX_JOBS, WORKER_MAX_RSS_MB = args.worker_max_jobs, args.worker_max_rss_mb
+    RENDER_ROOT = os.path.abspath(os.path.expanduser(args.render_root))
+    BLENDER_INSTANCE_DIR = os.path.abspath(os.path.expanduser(args.blender_dir))
+    BLENDER_ARCHIVES = [os.path.abspath(path) for path in args.blender_archive]
+    if args.blender_version:
+        BLENDER_VERSIONS = args.blender_version
+    elif BLENDER_ARCHIVES:
+        # Local tarballs alone are enough to run offline; the first one becomes the default.
+        BLENDER_VERSIONS = []
+    if args.blender:
+        BLENDER_PATH = os.path.abspath(args.blender)
+    start_server(install=not args.blender, coordinator=args.coordinator)
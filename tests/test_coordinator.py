@@ -0,0 +1,158 @@
+"""
+Coordinator end to end on one machine: two render nodes (server.py with the
+fake Blender from bench/fake_blender.py) behind coordinator.py, driven through
+client.send_render_job.
+
+    python3 -m unittest discover tests
+"""
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "remote_render_addon"))
+import client
+
+FAKE_BLENDER = os.path.join(ROOT, "bench", "fake_blender.py")
+FRAMES = range(1, 13)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(cmd, log_path, env):
+    proc = subprocess.Popen(cmd, stdout=open(log_path, "w"), stderr=subprocess.STDOUT, env=env, cwd=ROOT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        with open(log_path) as f:
+            if "@READY" in f.read():
+                return proc
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{os.path.basename(cmd[1])} did not start, see {log_path}")
+
+
+def stop(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+class CoordinatorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="render-coordinator-test-")
+        env = dict(os.environ, HOME=cls.workdir, FAKE_BLENDER_FRAMES=f"{FRAMES[0]}-{FRAMES[-1]}",
+                   FAKE_BLENDER_FRAME_TIME="0.01", FAKE_BLENDER_STARTUP="0.05")
+        cls.procs = []
+        cls.node_roots = []
+        try:
+            nodes = []
+            for i in range(2):
+                port = free_port()
+                root = os.path.join(cls.workdir, f"node{i}")
+                cls.node_roots.append(root)
+                cls.procs.append(start(
+                    [sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(port),
+                     "--render-root", root, "--blender", FAKE_BLENDER, "--workers", "2"],
+                    os.path.join(cls.workdir, f"node{i}.log"), env))
+                nodes += ["--node", f"127.0.0.1:{port}"]
+            cls.port = free_port()
+            cls.procs.append(start(
+                [sys.executable, os.path.join(ROOT, "coordinator.py"), "--host", "127.0.0.1", "--port", str(cls.port),
+                 "--render-root", os.path.join(cls.workdir, "coordinator"), "--blender", FAKE_BLENDER, *nodes],
+                os.path.join(cls.workdir, "coordinator.log"), env))
+        except Exception:
+            cls.tearDownClass()
+            raise
+        # Keep the client's hash cache inside the test directory.
+        client.HASH_CACHE_PATH = os.path.join(cls.workdir, "hashes.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        for proc in cls.procs:
+            stop(proc)
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def node_jobs(self):
+        """Job directories on the nodes (the render roots also hold the blob store)."""
+        return {os.path.join(root, name) for root in self.node_roots if os.path.isdir(root) for name in os.listdir(root)
+                if os.path.isfile(os.path.join(root, name, "render.log"))}
+
+    def submit(self, name, **kwargs):
+        """
+        Send the .blend called `name` to the coordinator, writing fresh content the first time.
+        Returns (job_id, log lines, config, node job dirs).
+        """
+        path = os.path.join(self.workdir, f"{name}.blend")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(os.urandom(64 * 1024))
+        config = {
+            "server_host": "127.0.0.1", "server_port": self.port,
+            "local_addons_dir": os.path.join(self.workdir, "no-addons"),
+            "render_output_dir": os.path.join(self.workdir, "out"), "socket_buffer_size": 0,
+            "client_id": f"test-{name}",
+        }
+        config.update(kwargs.pop("config", {}))
+        lines = []
+        before = self.node_jobs()
+        job_id = client.send_render_job(path, render_type="animation", output_format="PNG", config=config,
+                                        log=lines.append, use_cache=False, **kwargs)
+        self.assertTrue(job_id, "\n".join(lines))
+        return job_id, lines, config, sorted(self.node_jobs() - before)
+
+    def assert_frames(self, job_id, config, node_jobs):
+        """Every frame came back exactly once, and the nodes rendered each exactly once between them."""
+        names = sorted(os.listdir(os.path.join(config["render_output_dir"], job_id)))
+        self.assertEqual(names, [f"frame_{frame:05d}.png" for frame in FRAMES])
+
+        saved = []
+        for job_dir in node_jobs:
+            with open(os.path.join(job_dir, "render.log"), errors="replace") as f:
+                saved += [int(m) for m in re.findall(r"^Saved: '.*frame_(\d+)\.png'", f.read(), re.M)]
+        self.assertEqual(sorted(saved), list(FRAMES))
+        self.assertEqual(len(node_jobs), 2, "the frame range should be split over both nodes")
+
+    def test_frame_range_split_across_nodes(self):
+        job_id, lines, config, node_jobs = self.submit("split")
+        self.assert_frames(job_id, config, node_jobs)
+
+    def test_detach_is_not_offered(self):
+        job_id, lines, config, node_jobs = self.submit("detach", detach=True)
+        self.assertIn("Server does not support detached jobs; staying connected.", lines)
+        self.assert_frames(job_id, config, node_jobs)
+
+    def test_addons_are_not_synced(self):
+        addons_dir = os.path.join(self.workdir, "addons")
+        os.makedirs(os.path.join(addons_dir, "my_addon"), exist_ok=True)
+        with open(os.path.join(addons_dir, "my_addon", "__init__.py"), "w") as f:
+            f.write("bl_info = {'name': 'My Add-on'}\n")
+        job_id, lines, config, node_jobs = self.submit("addons", config={"local_addons_dir": addons_dir})
+        self.assertIn("Server does not support add-on sync; add-ons were not sent.", lines)
+        self.assert_frames(job_id, config, node_jobs)
+
+    def test_stored_blob_with_blender_version(self):
+        # The node's BLENDER notice must not be taken for its HAVE/SEND reply.
+        for _ in range(3):
+            job_id, lines, config, node_jobs = self.submit("blender-version", blender_version="4.0.2")
+            self.assert_frames(job_id, config, node_jobs)
+            self.assertTrue(any("BLENDER: Rendering with" in line for line in lines), "\n".join(lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Frame retries on one render node (server.py with the fake Blender from
+bench/fake_blender.py): a frame that fails every retry is skipped and the job
+still succeeds with the others.
+
+    python3 -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from test_coordinator import ROOT, FAKE_BLENDER, FRAMES, client, free_port, start, stop
+
+FAILING_FRAME = 7
+
+
+class SkippedFrameTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="render-frames-test-")
+        env = dict(os.environ, HOME=cls.workdir, FAKE_BLENDER_FRAMES=f"{FRAMES[0]}-{FRAMES[-1]}",
+                   FAKE_BLENDER_FAIL_FRAMES=str(FAILING_FRAME), FAKE_BLENDER_FRAME_TIME="0.01",
+                   FAKE_BLENDER_STARTUP="0.05")
+        cls.port = free_port()
+        cls.server = start(
+            [sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(cls.port),
+             "--render-root", os.path.join(cls.workdir, "root"), "--blender", FAKE_BLENDER, "--workers", "2"],
+            os.path.join(cls.workdir, "server.log"), env)
+        client.HASH_CACHE_PATH = os.path.join(cls.workdir, "hashes.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        stop(cls.server)
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_failed_frame_is_skipped(self):
+        path = os.path.join(self.workdir, "animation.blend")
+        with open(path, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        config = {
+            "server_host": "127.0.0.1", "server_port": self.port,
+            "local_addons_dir": os.path.join(self.workdir, "no-addons"),
+            "render_output_dir": os.path.join(self.workdir, "out"), "socket_buffer_size": 0,
+            "client_id": "test-frames",
+        }
+        lines = []
+        job_id = client.send_render_job(path, render_type="animation", output_format="PNG", config=config,
+                                        log=lines.append, use_cache=False)
+        self.assertTrue(job_id, "\n".join(lines))
+        names = sorted(os.listdir(os.path.join(config["render_output_dir"], job_id)))
+        self.assertEqual(names, [f"frame_{frame:05d}.png" for frame in FRAMES if frame != FAILING_FRAME])
+        self.assertIn(f"Render finished with status: success, 1 frame(s) skipped: {FAILING_FRAME} (job_id={job_id})",
+                      lines)
+        self.assertTrue(any(line.startswith("[Skipped] Frame(s) 7 failed") for line in lines), "\n".join(lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Region rendering with `--cold-start`: a still split into regions on one render
+node (server.py with the fake Blender from bench/fake_blender.py) must stitch
+without starting a warm Blender worker.
+
+    python3 -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from test_coordinator import ROOT, FAKE_BLENDER, client, free_port, start, stop
+
+
+class ColdStartRegionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="render-regions-test-")
+        env = dict(os.environ, HOME=cls.workdir, FAKE_BLENDER_RESOLUTION="640x512",
+                   FAKE_BLENDER_FRAME_TIME="0.01", FAKE_BLENDER_STARTUP="0.05")
+        cls.port = free_port()
+        cls.log_path = os.path.join(cls.workdir, "server.log")
+        cls.server = start(
+            [sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(cls.port),
+             "--render-root", os.path.join(cls.workdir, "root"), "--blender", FAKE_BLENDER, "--workers", "4",
+             "--memory-reserve-mb", "0", "--cold-start"],
+            cls.log_path, env)
+        client.HASH_CACHE_PATH = os.path.join(cls.workdir, "hashes.json")
+
+    @classmethod
+    def tearDownClass(cls):
+        stop(cls.server)
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def render(self, path, **kwargs):
+        config = {
+            "server_host": "127.0.0.1", "server_port": self.port,
+            "local_addons_dir": os.path.join(self.workdir, "no-addons"),
+            "render_output_dir": os.path.join(self.workdir, "out"), "socket_buffer_size": 0,
+            "client_id": "test-regions",
+        }
+        lines = []
+        job_id = client.send_render_job(path, render_type="image", output_format="PNG", config=config,
+                                        log=lines.append, use_cache=False, **kwargs)
+        self.assertTrue(job_id, "\n".join(lines))
+        with open(os.path.join(config["render_output_dir"], job_id, "frame_00001.png"), "rb") as f:
+            return f.read(), lines
+
+    def test_regions_stitch_without_warm_workers(self):
+        path = os.path.join(self.workdir, "still.blend")
+        with open(path, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        stitched, lines = self.render(path, regions=4)
+        self.assertIn("[Status] Rendering 640x512 as 4 regions", lines)
+        whole, _ = self.render(path)
+        self.assertEqual(stitched, whole)
+        with open(self.log_path) as f:
+            self.assertNotIn("Started Blender worker", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()